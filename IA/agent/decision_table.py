@@ -7,6 +7,7 @@ import psycopg
 from typing import Any, Iterable, Optional
 from dotenv import load_dotenv
 from dataclasses import dataclass
+from dgsi_scraper.scrape import db_document_fk
 
 load_dotenv()
 
@@ -45,23 +46,27 @@ def ensure_decision_table(conn) -> None:
     """
     A table to store big text chunks linked to dgsi_documents(id).
     - ON DELETE CASCADE: if a document is removed, chunks go too.
+    - source: part of the key when dgsi_documents is partitioned by source.
     """
     with conn.cursor() as cur:
         cur.execute(
-            """
+            f"""
             CREATE TABLE IF NOT EXISTS dgsi_document_decision (
               id BIGSERIAL PRIMARY KEY,
-              document_id BIGINT NOT NULL REFERENCES dgsi_documents(id) ON DELETE CASCADE,
+              document_id BIGINT NOT NULL,
+              source TEXT,
               decision_index INT NOT NULL,
               decision_sha256 TEXT NOT NULL,
               decision_text TEXT NOT NULL,
               final_decision TEXT NOT NULL,
               decision_gzip BYTEA,
               created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-              UNIQUE (document_id, decision_index)
+              UNIQUE (document_id, decision_index),
+              {db_document_fk(cur, "document_id")}
             );
             """
         )
+        cur.execute("ALTER TABLE dgsi_document_decision ADD COLUMN IF NOT EXISTS source TEXT;")
         # Add final_decision column if it doesn't exist
         cur.execute(
             """
@@ -100,8 +105,8 @@ def insert_decision(
         cur.execute(
             """
             INSERT INTO dgsi_document_decision (
-              document_id, decision_index, decision_sha256, decision_text, final_decision, decision_gzip, created_at
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+              document_id, source, decision_index, decision_sha256, decision_text, final_decision, decision_gzip, created_at
+            ) VALUES (%s, (SELECT source FROM dgsi_documents WHERE id = %s), %s, %s, %s, %s, %s, %s)
             ON CONFLICT (document_id, decision_index) DO UPDATE SET
               decision_sha256 = EXCLUDED.decision_sha256,
               decision_text = EXCLUDED.decision_text,
@@ -110,7 +115,7 @@ def insert_decision(
               created_at = EXCLUDED.created_at
             RETURNING id;
             """,
-            (document_id, decision_index, decision_hash, decision_text, final_decision, decision_gz, created_at),
+            (document_id, document_id, decision_index, decision_hash, decision_text, final_decision, decision_gz, created_at),
         )
         row_id = int(cur.fetchone()[0])
     conn.commit()
@@ -2,15 +2,23 @@ import os
 from dotenv import load_dotenv
 from typing import List
 
-from dgsi_scraper.retriever import DocumentRetriever, ChunkRetrievalResult
+from dgsi_scraper.async_retriever import AsyncDocumentRetriever
+from dgsi_scraper.retriever import ChunkRetrievalResult
 from agent.splitter import split
 from agent.decision_table import db_connect, insert_decision, get_decision
 from dgsi_scraper.scrape import search_documents
 
 DB_DSN = os.getenv("DGSISCRAPER_DB_DSN")
-retriever = DocumentRetriever(db_dsn=DB_DSN)
+# follows the embedding registry, so a shadow reindex goes live without a restart;
+# retried tool calls are served from the result cache until the index changes
+retriever = AsyncDocumentRetriever(
+    db_dsn=DB_DSN,
+    follow_active=True,
+    result_cache_size=1024,
+    result_cache_redis_url=os.getenv("DGSI_RESULT_CACHE_REDIS_URL"),
+)
 
-def tool_retriever(text: str) -> List[ChunkRetrievalResult]:
+async def tool_retriever(text: str) -> List[ChunkRetrievalResult]:
     '''
     Retrieve chunks relevant to text provided.
     Chunks have their decision associated to them.
@@ -19,9 +27,10 @@ def tool_retriever(text: str) -> List[ChunkRetrievalResult]:
     :param text: text given by user.
     :return: list of chunk retrieval results
     '''
-    return retriever.retrieve(query=text)
+    # snippets keep the LLM context small; full text_plain is tens of KB per hit
+    return await retriever.retrieve(query=text, projection="snippet")
   
-def tool_class_retriever(file: str, decision: str) -> List[ChunkRetrievalResult]:
+async def tool_class_retriever(file: str, decision: str) -> List[ChunkRetrievalResult]:
     '''
     Retrieve chunks relevant to text provided and filtered by decision.
     
@@ -29,5 +38,5 @@ def tool_class_retriever(file: str, decision: str) -> List[ChunkRetrievalResult]
     :param decision: decision to filter chunks by.
     :return: list of chunk retrieval results
     '''
-    retrieved = retriever.retrieve_by_class(decision=decision, query=file)
+    retrieved = await retriever.retrieve_by_class(decision=decision, query=file)
     return retrieved
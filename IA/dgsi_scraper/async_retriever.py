@@ -0,0 +1,332 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import numpy as np
+
+from dgsi_scraper import query_log
+from dgsi_scraper.query_log import instrumented, span
+from dgsi_scraper.result_cache import cached_results
+from dgsi_scraper.retriever import (
+    EXACT_SCAN_SQL,
+    INDEX_VERSION_COLUMN_SQL,
+    INDEX_VERSION_SQL,
+    ChunkRetrievalResult,
+    DocumentRetriever,
+    RetrievalResult,
+)
+
+try:
+    import psycopg
+except Exception:
+    psycopg = None
+
+try:
+    from psycopg_pool import AsyncConnectionPool
+    POOL_IMPORT_ERROR = None
+except ImportError as e:
+    AsyncConnectionPool = None
+    POOL_IMPORT_ERROR = e
+
+
+class AsyncDocumentRetriever:
+    """Non-blocking retrieval for the async serving path.
+
+    SQL and result mapping are shared with DocumentRetriever. Queries go
+    through a psycopg AsyncConnectionPool (psycopg[pool], a project
+    dependency); if psycopg_pool can't be imported a warning is printed and
+    every call opens its own AsyncConnection. The CPU-bound
+    vectorization runs in an executor so the event loop stays free. Indexing
+    and the CLI keep using the sync DocumentRetriever.
+    """
+
+    def __init__(
+        self,
+        db_dsn: str,
+        min_pool_size: int = 1,
+        max_pool_size: int = 10,
+        executor: Optional[Executor] = None,
+        **retriever_kwargs,
+    ):
+        if psycopg is None:
+            raise RuntimeError("psycopg is not installed!")
+        self.db_dsn = db_dsn
+        self.sync = DocumentRetriever(db_dsn=db_dsn, **retriever_kwargs)
+        self.executor = executor
+        self.pool = None
+        if AsyncConnectionPool is not None:
+            self.pool = AsyncConnectionPool(db_dsn, min_size=min_pool_size, max_size=max_pool_size, open=False)
+        else:
+            print(f"[WARN] psycopg_pool unavailable ({POOL_IMPORT_ERROR}); opening one connection per query. "
+                  "Install psycopg[pool].")
+        self._opened = False
+        self._open_lock = asyncio.Lock()
+
+    async def open(self):
+        if self.pool is None:
+            return
+        async with self._open_lock:
+            if not self._opened:
+                await self.pool.open()
+                self._opened = True
+
+    async def close(self):
+        if self.pool is not None and self._opened:
+            await self.pool.close()
+            self._opened = False
+
+    @asynccontextmanager
+    async def connection(self):
+        if self.pool is not None:
+            await self.open()
+            async with self.pool.connection() as conn:
+                yield conn
+        else:
+            conn = await psycopg.AsyncConnection.connect(self.db_dsn)
+            try:
+                yield conn
+            finally:
+                await conn.close()
+
+    @property
+    def model_version(self) -> str:
+        return self.sync.model_version
+
+    @property
+    def result_cache(self):
+        return self.sync.result_cache
+
+    async def index_version(self) -> int:
+        """DocumentRetriever.index_version, read through the pool."""
+        if self.sync._index_version_due():
+            row = None
+            async with self.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(INDEX_VERSION_COLUMN_SQL)
+                    if (await cur.fetchone())[0]:
+                        await cur.execute(INDEX_VERSION_SQL, (self.sync.model_version,))
+                        row = await cur.fetchone()
+                await conn.rollback()
+            self.sync._observe_index_version(row[0] if row else 0)
+        return self.sync._index_version
+
+    async def embed_query(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        with span("embedding"):
+            return await loop.run_in_executor(self.executor, self.sync.embed_query, text)
+
+    async def _plan_filtered(self, top_k: int, filter_source: Optional[str], decision: Optional[str], probes, ef_search) -> dict:
+        # the planner snapshot is refreshed with a blocking query now and then
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.sync._plan_filtered, top_k, filter_source, decision, probes, ef_search
+        )
+
+    async def _fetch(
+        self,
+        sql,
+        params,
+        probes: Optional[int],
+        ef_search: Optional[int],
+        exact_fallback_k: Optional[int] = None,
+        exact: bool = False,
+        method: str = "retrieve",
+    ):
+        async with self.connection() as conn:
+            async with conn.cursor() as cur:
+                if exact:
+                    await cur.execute(EXACT_SCAN_SQL)
+                for statement, statement_params in self.sync._search_param_statements(probes, ef_search):
+                    await cur.execute(statement, statement_params)
+                with span("sql"):
+                    await cur.execute(sql, params)
+                    rows = await cur.fetchall()
+                    if not exact and exact_fallback_k is not None and len(rows) < exact_fallback_k:
+                        await cur.execute(EXACT_SCAN_SQL)
+                        await cur.execute(sql, params)
+                        rows = await cur.fetchall()
+                if self.sync._sample_explain():
+                    # replayed under EXPLAIN ANALYZE by the sampler's thread
+                    await cur.execute(query_log.SETTINGS_SQL)
+                    settings = await cur.fetchone()
+                    sql_text = sql if isinstance(sql, str) else sql.as_string(conn)
+                    self.sync.plan_sampler.submit(
+                        method, self.sync.model_version, sql_text, params, settings, query_log.current_spans()
+                    )
+            # read-only; also discards the transaction-local search settings
+            await conn.rollback()
+        return rows
+
+    @instrumented
+    @cached_results
+    async def retrieve(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        projection: str = "full",
+        snippet_chars: int = 600,
+    ) -> List[RetrievalResult]:
+        query_embedding = await self.embed_query(query)
+        sql, params = self.sync._retrieve_query(query_embedding, top_k, filter_source, projection, snippet_chars)
+        rows = await self._fetch(sql, params, probes, ef_search, method="retrieve")
+        return self.sync._document_results(rows, min_similarity)
+
+    async def load_texts(self, results: List[RetrievalResult]) -> List[RetrievalResult]:
+        missing = [r.id for r in results if r.text_plain is None]
+        if missing:
+            async with self.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute("SELECT id, text_plain FROM dgsi_documents WHERE id = ANY(%s);", (missing,))
+                    texts = dict(await cur.fetchall())
+                await conn.rollback()
+            for r in results:
+                if r.text_plain is None:
+                    r.text_plain = texts.get(r.id)
+        return results
+
+    @instrumented
+    @cached_results
+    async def retrieve_chunks(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        projection: str = "full",
+        group_by_document: bool = False,
+        group_candidates: Optional[int] = None,
+    ) -> List[ChunkRetrievalResult]:
+        query_embedding = await self.embed_query(query)
+        sql, params = self.sync._retrieve_chunks_query(
+            query_embedding, top_k, filter_source, projection, group_by_document, group_candidates
+        )
+        plan = await self._plan_filtered(top_k, filter_source, None, probes, ef_search)
+        start = time.perf_counter()
+        rows = await self._fetch(
+            sql, params, plan["probes"], plan["ef_search"], exact=plan["plan"] == "exact", method="retrieve_chunks"
+        )
+        if filter_source:
+            self.sync._log_plan("retrieve_chunks", plan, start, len(rows))
+        return self.sync._chunk_results(rows, min_similarity)
+
+    @instrumented
+    @cached_results
+    async def retrieve_chunks_quantized(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        quantization: str = "binary",
+        rerank_factor: int = 4,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[ChunkRetrievalResult]:
+        query_embedding = await self.embed_query(query)
+        sql, params = self.sync._retrieve_chunks_quantized_query(
+            query_embedding, top_k, filter_source, quantization, rerank_factor
+        )
+        ef_search = max(ef_search or self.sync.ef_search or 40, params["candidates"])
+        rows = await self._fetch(sql, params, probes, ef_search, method="retrieve_chunks_quantized")
+        return self.sync._chunk_results(rows, min_similarity)
+
+    @instrumented
+    @cached_results
+    async def retrieve_chunks_two_stage(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        candidate_docs: int = 50,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        projection: str = "full",
+    ) -> List[ChunkRetrievalResult]:
+        query_embedding = await self.embed_query(query)
+        sql, params = self.sync._retrieve_chunks_two_stage_query(
+            query_embedding, top_k, filter_source, candidate_docs, projection
+        )
+        ef_search = max(ef_search or self.sync.ef_search or 40, candidate_docs)
+        rows = await self._fetch(sql, params, probes, ef_search, method="retrieve_chunks_two_stage")
+        return self.sync._chunk_results(rows, min_similarity)
+
+    @instrumented
+    @cached_results
+    async def retrieve_hybrid(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        candidates: int = 50,
+        rrf_k: int = 60,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[ChunkRetrievalResult]:
+        query_embedding = await self.embed_query(query)
+        sql, params = self.sync._retrieve_hybrid_query(query, query_embedding, top_k, filter_source, candidates, rrf_k)
+        rows = await self._fetch(sql, params, probes, ef_search, method="retrieve_hybrid")
+        return self.sync._chunk_results(rows, min_similarity)
+
+    @instrumented
+    @cached_results
+    async def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        filters: Optional[dict] = None,
+        min_similarity: float = 0.0,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[List[ChunkRetrievalResult]]:
+        if not queries:
+            return []
+        loop = asyncio.get_running_loop()
+        with span("embedding"):
+            query_embeddings = await loop.run_in_executor(self.executor, self.sync.embed_queries, queries)
+        filters = filters or {}
+        sql, params = self.sync._retrieve_many_query(query_embeddings, top_k, filters)
+        plan = await self._plan_filtered(top_k, filters.get("source"), filters.get("decision"), probes, ef_search)
+        start = time.perf_counter()
+        exact = plan["plan"] == "exact"
+        rows = await self._fetch(sql, params, plan["probes"], plan["ef_search"], exact=exact, method="retrieve_many")
+        per_query = self.sync._rows_by_query(rows, len(queries))
+        short = self.sync._short_queries(per_query, top_k) if not exact else []
+        if short:
+            plan.update({"plan": "ann+exact", "refilled": len(short)})
+            sql, params = self.sync._retrieve_many_query([query_embeddings[i] for i in short], top_k, filters)
+            self.sync._refill(per_query, short, await self._fetch(sql, params, None, None, exact=True, method="retrieve_many"))
+        self.sync._log_plan("retrieve_many", plan, start, sum(len(rows) for rows in per_query))
+        return self.sync._group_by_query(per_query, min_similarity, filters.get("decision"))
+
+    @instrumented
+    @cached_results
+    async def retrieve_by_class(
+        self,
+        decision: str,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[ChunkRetrievalResult]:
+        query_embedding = await self.embed_query(query)
+        sql, params = self.sync._retrieve_by_class_query(decision, query_embedding, top_k, filter_source)
+        plan = await self._plan_filtered(top_k, filter_source, decision, probes, ef_search)
+        start = time.perf_counter()
+        rows = await self._fetch(
+            sql, params, plan["probes"], plan["ef_search"], exact_fallback_k=top_k, exact=plan["plan"] == "exact",
+            method="retrieve_by_class",
+        )
+        self.sync._log_plan("retrieve_by_class", plan, start, len(rows))
+        return self.sync._chunk_results(rows, min_similarity, decision)
@@ -0,0 +1,419 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import psycopg
+from psycopg.types.json import Jsonb
+from dotenv import load_dotenv
+
+from dgsi_scraper.retriever import DEFAULT_DECISION_JSON, DocumentRetriever
+from dgsi_scraper.scrape import db_ensure_schema
+
+BENCH_METHODS = ("retrieve", "retrieve_chunks", "retrieve_by_class")
+
+DOCUMENT_COLUMNS = (
+    "source, base_name, url, processo, sessao_date, relator, descritores, "
+    "text_sha256, text_plain, text_gzip, extra"
+)
+
+# shared legal vocabulary of the synthetic corpus; each class also gets its own terms
+COMMON_WORDS = (
+    "tribunal recurso acordao processo autor reu prova testemunha sentença juiz relator "
+    "apelação revista direito dever obrigação contrato indemnização danos responsabilidade "
+    "prazo norma artigo código facto matéria questão decisão fundamento alegação pedido"
+).split()
+
+
+def _prepare_bench_db(conn, reset: bool):
+    """Refuse to write into a non-empty database unless reset=True."""
+    db_ensure_schema(conn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM dgsi_documents);")
+        if cur.fetchone()[0]:
+            if not reset:
+                raise RuntimeError("dgsi_documents is not empty; pass reset=True (--reset) to replace its contents")
+            # cascades to every table referencing dgsi_documents
+            cur.execute("TRUNCATE dgsi_documents CASCADE;")
+    conn.commit()
+
+
+def _write_labels(path: str, ids_by_class: Dict[str, List[dict]]):
+    """Labels in the decision JSON layout, readable by load_decision_classes."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"ids_by_class": ids_by_class}, f, ensure_ascii=False, indent=2)
+
+
+def build_synthetic_corpus(
+    db_dsn: str,
+    labels_path: str,
+    num_docs: int = 2000,
+    num_classes: int = 6,
+    class_words: int = 80,
+    seed: int = 0,
+    reset: bool = False,
+) -> dict:
+    """Generate labelled documents whose text leans towards their class vocabulary."""
+    rng = random.Random(seed)
+    sources = ("dgsi_stj", "dgsi_sta", "dgsi_trp")
+    noise = [f"termo{k}" for k in range(2000)]
+
+    ids_by_class: Dict[str, List[dict]] = {}
+    with psycopg.connect(db_dsn) as conn:
+        _prepare_bench_db(conn, reset)
+        with conn.cursor() as cur:
+            for i in range(num_docs):
+                cls = f"CLASSE{i % num_classes}"
+                own = [f"c{i % num_classes}t{k}" for k in range(class_words)]
+                words = []
+                for _ in range(rng.randint(150, 1500)):
+                    r = rng.random()
+                    pool = own if r < 0.25 else COMMON_WORDS if r < 0.55 else noise
+                    words.append(rng.choice(pool))
+                text = " ".join(words)
+                source = rng.choice(sources)
+                cur.execute(f"""
+                    INSERT INTO dgsi_documents ({DOCUMENT_COLUMNS})
+                    VALUES (%s, %s, %s, %s, NULL, NULL, '{{}}', %s, %s, %s, '{{}}'::jsonb)
+                    RETURNING id;
+                """, (
+                    source, f"bench{i}", f"bench://{seed}/{i}", f"BENCH/{i}",
+                    hashlib.sha256(text.encode("utf-8")).hexdigest(), text, gzip.compress(text.encode("utf-8")),
+                ))
+                doc_id = cur.fetchone()[0]
+                ids_by_class.setdefault(cls, []).append({"id": doc_id, "source": source, "variant": cls})
+        conn.commit()
+
+    _write_labels(labels_path, ids_by_class)
+    print(f"Generated {num_docs} synthetic documents in {num_classes} classes")
+    return {"corpus": "synthetic", "documents": num_docs, "classes": num_classes}
+
+
+def sample_corpus(
+    source_dsn: str,
+    db_dsn: str,
+    labels_path: str,
+    per_class: int = 200,
+    decision_json: str = DEFAULT_DECISION_JSON,
+    seed: int = 0,
+    reset: bool = False,
+) -> dict:
+    """Copy up to per_class labelled documents per decision class from source_dsn.
+
+    Document ids are kept, so the decision JSON labels stay valid.
+    """
+    with open(decision_json, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    rng = random.Random(seed)
+    picked: Dict[str, List[dict]] = {}
+    for cls, items in data["ids_by_class"].items():
+        items = list(items)
+        rng.shuffle(items)
+        picked[cls] = items[:per_class]
+    wanted = [int(item["id"]) for items in picked.values() for item in items]
+
+    copied = set()
+    with psycopg.connect(source_dsn) as src, psycopg.connect(db_dsn) as dst:
+        _prepare_bench_db(dst, reset)
+        with src.cursor(name="dgsi_bench_sample") as read, dst.cursor() as write:
+            read.execute(f"SELECT id, {DOCUMENT_COLUMNS} FROM dgsi_documents WHERE id = ANY(%s);", (wanted,))
+            for row in read:
+                write.execute(f"""
+                    INSERT INTO dgsi_documents (id, {DOCUMENT_COLUMNS})
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT ON CONSTRAINT dgsi_documents_url_key DO NOTHING;
+                """, (*row[:11], Jsonb(row[11])))
+                copied.add(row[0])
+            write.execute("""
+                SELECT setval(pg_get_serial_sequence('dgsi_documents', 'id'), COALESCE(MAX(id), 1))
+                FROM dgsi_documents;
+            """)
+        src.rollback()
+        dst.commit()
+
+    ids_by_class = {
+        cls: [item for item in items if int(item["id"]) in copied]
+        for cls, items in picked.items()
+    }
+    _write_labels(labels_path, {cls: items for cls, items in ids_by_class.items() if items})
+    print(f"Sampled {len(copied)} labelled documents from {source_dsn.split('@')[-1]}")
+    return {"corpus": "sampled", "documents": len(copied), "classes": sum(1 for items in ids_by_class.values() if items)}
+
+
+def make_queries(
+    db_dsn: str,
+    num_queries: int = 100,
+    query_words: int = 30,
+    drop_rate: float = 0.2,
+    seed: int = 0,
+) -> List[dict]:
+    """Known-item queries: a noisy excerpt of a labelled document.
+
+    Each query's relevant document is the one it was cut from; the documents
+    sharing its decision class are the class-level relevants.
+    """
+    rng = random.Random(seed)
+    with psycopg.connect(db_dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT setseed(%s);", (rng.random() * 2 - 1,))
+            cur.execute("""
+                SELECT id, decision_class, text_plain
+                FROM dgsi_documents
+                WHERE decision_class IS NOT NULL
+                ORDER BY random() LIMIT %s;
+            """, (num_queries,))
+            rows = cur.fetchall()
+
+    queries = []
+    for doc_id, decision, text in rows:
+        words = text.split()
+        if not words:
+            continue
+        start = rng.randrange(max(1, len(words) - query_words))
+        excerpt = [w for w in words[start:start + query_words] if rng.random() >= drop_rate]
+        queries.append({"doc_id": doc_id, "decision": decision, "text": " ".join(excerpt or words[:query_words])})
+    return queries
+
+
+def _class_members(db_dsn: str) -> Dict[str, set]:
+    with psycopg.connect(db_dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT decision_class, array_agg(id) FROM dgsi_documents WHERE decision_class IS NOT NULL GROUP BY 1;")
+            return {cls: set(ids) for cls, ids in cur.fetchall()}
+
+
+def _ranked_doc_ids(results) -> List[int]:
+    """Document ids in rank order; chunk results count a document once."""
+    seen = []
+    for r in results:
+        doc_id = getattr(r, "doc_id", None) or r.id
+        if doc_id not in seen:
+            seen.append(doc_id)
+    return seen
+
+
+def _run_query(retriever: DocumentRetriever, method: str, query: dict, top_k: int, search_params: dict):
+    if method == "retrieve":
+        return retriever.retrieve(query["text"], top_k=top_k, projection="ids", **search_params)
+    if method == "retrieve_chunks":
+        return retriever.retrieve_chunks(query["text"], top_k=top_k, projection="ids", **search_params)
+    return retriever.retrieve_by_class(query["decision"], query["text"], top_k=top_k, **search_params)
+
+
+def _percentiles(latencies: List[float]) -> dict:
+    if not latencies:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def _timed(retriever, method, query, top_k, search_params) -> Tuple[list, float]:
+    start = time.perf_counter()
+    results = _run_query(retriever, method, query, top_k, search_params)
+    return results, (time.perf_counter() - start) * 1000
+
+
+def evaluate(
+    retriever: DocumentRetriever,
+    queries: List[dict],
+    classes: Dict[str, set],
+    methods: Tuple[str, ...] = BENCH_METHODS,
+    top_k: int = 10,
+    concurrency: Tuple[int, ...] = (1, 4, 8),
+    min_calls: int = 200,
+    search_params: Optional[dict] = None,
+) -> dict:
+    """Quality and latency of each retrieval method on one query set.
+
+    recall_at_k and mrr are over the known-item relevant document;
+    class_precision_at_k is the share of the returned documents in the query's
+    decision class. Latencies are end to end (embedding, SQL, result mapping)
+    with the query-embedding cache cleared, and QPS is measured by running the
+    queries from `c` threads, each opening its own connection.
+    """
+    search_params = search_params or {}
+    report = {}
+    for method in methods:
+        hits = []
+        reciprocal_ranks = []
+        class_precision = []
+        latencies = []
+        retriever.clear_query_cache()
+        for query in queries:
+            results, elapsed = _timed(retriever, method, query, top_k, search_params)
+            latencies.append(elapsed)
+            ranked = _ranked_doc_ids(results)[:top_k]
+            rank = ranked.index(query["doc_id"]) + 1 if query["doc_id"] in ranked else None
+            hits.append(1.0 if rank else 0.0)
+            reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+            members = classes.get(query["decision"], set())
+            class_precision.append(sum(1 for d in ranked if d in members) / max(len(ranked), 1))
+
+        levels = []
+        workload = [queries[i % len(queries)] for i in range(max(min_calls, len(queries)))] if queries else []
+        for c in concurrency:
+            retriever.clear_query_cache()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=c) as pool:
+                timings = [t for _, t in pool.map(lambda q: _timed(retriever, method, q, top_k, search_params), workload)]
+            wall = time.perf_counter() - start
+            levels.append({
+                "concurrency": c,
+                "calls": len(workload),
+                "qps": len(workload) / wall if wall > 0 else 0.0,
+                **_percentiles(timings),
+            })
+
+        report[method] = {
+            "queries": len(queries),
+            "recall_at_k": float(np.mean(hits)) if hits else 0.0,
+            "mrr": float(np.mean(reciprocal_ranks)) if reciprocal_ranks else 0.0,
+            "class_precision_at_k": float(np.mean(class_precision)) if class_precision else 0.0,
+            **_percentiles(latencies),
+            "concurrency": levels,
+        }
+    return report
+
+
+def run_benchmark(
+    db_dsn: str,
+    corpus: str = "synthetic",
+    source_dsn: Optional[str] = None,
+    output_dir: str = "dgsi_scraper/output/benchmark",
+    num_docs: int = 2000,
+    per_class: int = 200,
+    num_queries: int = 100,
+    top_k: int = 10,
+    concurrency: Tuple[int, ...] = (1, 4, 8),
+    index_method: Optional[str] = "hnsw",
+    skip_index: bool = False,
+    reset: bool = False,
+    seed: int = 0,
+    search_params: Optional[dict] = None,
+    **retriever_kwargs,
+) -> dict:
+    """Build (or reuse) a benchmark corpus, index it and evaluate retrieval."""
+    labels_path = os.path.join(output_dir, "labels.json")
+    if corpus == "synthetic":
+        corpus_info = build_synthetic_corpus(db_dsn, labels_path, num_docs=num_docs, seed=seed, reset=reset)
+    elif corpus == "sampled":
+        if not source_dsn:
+            raise ValueError("corpus='sampled' needs source_dsn")
+        corpus_info = sample_corpus(source_dsn, db_dsn, labels_path, per_class=per_class, seed=seed, reset=reset)
+    elif corpus == "existing":
+        corpus_info = {"corpus": "existing"}
+    else:
+        raise ValueError("corpus must be one of: synthetic, sampled, existing")
+
+    retriever = DocumentRetriever(db_dsn=db_dsn, **retriever_kwargs)
+    timings = {}
+    if not skip_index:
+        retriever.ensure_vector_schema()
+        if reset:
+            retriever.refresh_stats()
+        start = time.perf_counter()
+        retriever.index_all_documents()
+        retriever.index_all_documents_chunks()
+        timings["index_seconds"] = time.perf_counter() - start
+        if os.path.exists(labels_path):
+            retriever.load_decision_classes(labels_path)
+        if index_method:
+            start = time.perf_counter()
+            retriever.build_vector_indexes(method=index_method, per_class=True)
+            timings["ann_build_seconds"] = time.perf_counter() - start
+
+    # report (and pass) only the parameter the index reads: probes for
+    # ivfflat, ef_search for hnsw
+    index_method = retriever.index_method("chunks") if skip_index else index_method
+    search_params = retriever.search_params_for(index_method, **(search_params or {}))
+    queries = make_queries(db_dsn, num_queries=num_queries, seed=seed)
+    results = evaluate(
+        retriever, queries, _class_members(db_dsn),
+        top_k=top_k, concurrency=concurrency, search_params=search_params,
+    )
+    stats = retriever.get_document_stats()
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            **corpus_info,
+            "model_version": retriever.model_version,
+            "embedding_dim": retriever.embedding_dim,
+            "chunk_size": retriever.chunk_size,
+            "vector_type": retriever.vector_type,
+            "index_method": index_method,
+            "search_params": search_params,
+            "top_k": top_k,
+            "seed": seed,
+        },
+        "corpus_stats": {key: stats.get(key) for key in ("total_documents", "total_chunks", "indexed_chunks")},
+        **timings,
+        "results": results,
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    return report
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Retrieval quality and latency benchmark")
+    parser.add_argument("--db-dsn", type=str, default=os.getenv("DGSI_BENCH_DB_DSN"),
+                        help="Benchmark PostgreSQL database (never the production one)")
+    parser.add_argument("--source-dsn", type=str, default=os.getenv("DGSISCRAPER_DB_DSN"),
+                        help="Database to sample labelled documents from (--corpus sampled)")
+    parser.add_argument("--corpus", type=str, default="synthetic", choices=["synthetic", "sampled", "existing"])
+    parser.add_argument("--reset", action="store_true", help="Replace the benchmark database's documents")
+    parser.add_argument("--output-dir", type=str, default="dgsi_scraper/output/benchmark")
+    parser.add_argument("--num-docs", type=int, default=2000, help="Synthetic corpus size")
+    parser.add_argument("--per-class", type=int, default=200, help="Sampled documents per decision class")
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--index-method", type=str, default="hnsw", choices=["ivfflat", "hnsw", "none"])
+    parser.add_argument("--skip-index", action="store_true", help="Evaluate the vectors and indexes already in the database")
+    parser.add_argument("--embedding-dim", type=int, default=768)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--probes", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not args.db_dsn:
+        print("Error: benchmark database DSN not provided (--db-dsn or DGSI_BENCH_DB_DSN).")
+        return
+
+    report = run_benchmark(
+        args.db_dsn,
+        corpus=args.corpus,
+        source_dsn=args.source_dsn,
+        output_dir=args.output_dir,
+        num_docs=args.num_docs,
+        per_class=args.per_class,
+        num_queries=args.num_queries,
+        top_k=args.top_k,
+        concurrency=tuple(args.concurrency),
+        index_method=None if args.index_method == "none" else args.index_method,
+        skip_index=args.skip_index,
+        reset=args.reset,
+        seed=args.seed,
+        search_params={"probes": args.probes, "ef_search": args.ef_search},
+        embedding_dim=args.embedding_dim,
+        chunk_size=args.chunk_size,
+    )
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from dgsi_scraper.retriever import CHUNK_TEXT_SQL, DocumentRetriever, ChunkRetrievalResult
+
+
+QUANTIZATIONS = ("int8",)
+
+
+def export_chunk_snapshot(retriever: DocumentRetriever, out_dir: str, batch_size: int = 5000, int8: bool = False) -> dict:
+    """Write chunk embeddings (L2-normalized float32) and their ids to out_dir.
+
+    With int8=True an int8 copy (embeddings_int8.npy, one scale per row in
+    scales.npy) is written too, for MmapChunkSearcher(quantization="int8").
+
+    Files are written to a temporary directory and moved into place at the end,
+    so searchers never map a half-written snapshot.
+    """
+    tmp_dir = out_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    conn = retriever.get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(*) FROM {retriever.chunk_table} WHERE embedding IS NOT NULL;")
+            total = int(cur.fetchone()[0])
+
+        dim = retriever.embedding_dim
+        embeddings = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "embeddings.npy"), mode="w+", dtype=np.float32, shape=(total, dim)
+        )
+        embeddings_int8 = None
+        scales = None
+        if int8:
+            embeddings_int8 = np.lib.format.open_memmap(
+                os.path.join(tmp_dir, "embeddings_int8.npy"), mode="w+", dtype=np.int8, shape=(total, dim)
+            )
+            scales = np.zeros(total, dtype=np.float32)
+        # Rows deleted between COUNT and the scan leave a tail with id -1
+        ids = np.full(total, -1, dtype=np.int64)
+        source_codes = np.full(total, -1, dtype=np.int16)
+        class_codes = np.full(total, -1, dtype=np.int16)
+        sources: Dict[str, int] = {}
+        classes: Dict[str, int] = {}
+
+        # Server-side cursor: rows stream in batches instead of one fetchall()
+        n = 0
+        with conn.cursor(name="dgsi_chunk_snapshot") as cur:
+            cur.itersize = batch_size
+            cur.execute(f"""
+                SELECT c.id, d.source, c.decision_class, c.embedding::vector::real[]
+                FROM {retriever.chunk_table} c
+                JOIN dgsi_documents d ON c.doc_id = d.id
+                WHERE c.embedding IS NOT NULL
+                ORDER BY c.id;
+            """)
+            for chunk_id, source, decision_class, emb in cur:
+                if n >= total:
+                    break
+                ids[n] = chunk_id
+                source_codes[n] = sources.setdefault(source, len(sources))
+                class_codes[n] = classes.setdefault(decision_class, len(classes)) if decision_class else -1
+                vec = np.asarray(emb, dtype=np.float32)
+                vec = vec / max(float(np.linalg.norm(vec)), 1e-12)
+                embeddings[n] = vec
+                if int8:
+                    # symmetric per-row scale: row ~= scale * int8 row
+                    scales[n] = max(float(np.abs(vec).max()), 1e-12) / 127.0
+                    embeddings_int8[n] = np.rint(vec / scales[n]).astype(np.int8)
+                n += 1
+        conn.rollback()
+    finally:
+        conn.close()
+
+    embeddings[n:] = 0
+    embeddings.flush()
+    del embeddings
+    if int8:
+        embeddings_int8[n:] = 0
+        embeddings_int8.flush()
+        del embeddings_int8
+        np.save(os.path.join(tmp_dir, "scales.npy"), scales)
+
+    np.save(os.path.join(tmp_dir, "ids.npy"), ids)
+    np.save(os.path.join(tmp_dir, "sources.npy"), source_codes)
+    np.save(os.path.join(tmp_dir, "classes.npy"), class_codes)
+
+    meta = {
+        "rows": n,
+        "dim": retriever.embedding_dim,
+        "model_version": retriever.model_version,
+        "int8": int8,
+        "sources": sorted(sources, key=sources.get),
+        "classes": sorted(classes, key=classes.get),
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    old_dir = out_dir.rstrip("/") + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    print(f"Exported {n} chunk embeddings to {out_dir}")
+    return meta
+
+
+class MmapChunkSearcher:
+    """Exact cosine search over a memory-mapped chunk snapshot.
+
+    Same retrieve_chunks / retrieve_by_class interface as DocumentRetriever.
+    The snapshot is opened read-only with mmap, so several serving workers on
+    one host share the same pages through the OS page cache. Postgres is only
+    hit to fetch metadata for the winning ids.
+
+    quantization="int8" scans the int8 copy instead (a quarter of the bytes
+    to page in) and re-scores the best top_k * rerank_factor rows with the
+    float embeddings, so returned similarities are exact.
+    """
+
+    def __init__(
+        self,
+        snapshot_dir: str,
+        retriever: DocumentRetriever,
+        block_size: int = 65536,
+        quantization: Optional[str] = None,
+        rerank_factor: int = 4,
+    ):
+        with open(os.path.join(snapshot_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["model_version"] != retriever.model_version:
+            raise RuntimeError(
+                f"Snapshot model {self.meta['model_version']!r} does not match retriever {retriever.model_version!r}"
+            )
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError(f"quantization must be one of: {', '.join(QUANTIZATIONS)}")
+        if quantization == "int8" and not self.meta.get("int8"):
+            raise RuntimeError(f"Snapshot {snapshot_dir} has no int8 embeddings; export it with int8=True")
+        self.retriever = retriever
+        self.block_size = block_size
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.embeddings = np.load(os.path.join(snapshot_dir, "embeddings.npy"), mmap_mode="r")
+        if quantization == "int8":
+            self.embeddings_int8 = np.load(os.path.join(snapshot_dir, "embeddings_int8.npy"), mmap_mode="r")
+            self.scales = np.load(os.path.join(snapshot_dir, "scales.npy"))
+        self.ids = np.load(os.path.join(snapshot_dir, "ids.npy"))
+        self.sources = np.load(os.path.join(snapshot_dir, "sources.npy"))
+        self.classes = np.load(os.path.join(snapshot_dir, "classes.npy"))
+        self.source_codes = {name: i for i, name in enumerate(self.meta["sources"])}
+        self.class_codes = {name: i for i, name in enumerate(self.meta["classes"])}
+
+    def search(self, query_vec: np.ndarray, top_k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Blocked matrix-product top-k. Returns (row indices, scores), best first."""
+        q = np.asarray(query_vec, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        if self.quantization is None:
+            return self._scan(self.embeddings, q, top_k, mask)
+
+        # the query stays float; only the stored side is quantized
+        rows, _ = self._scan(self.embeddings_int8, q, top_k * max(1, self.rerank_factor), mask, self.scales)
+        rows = np.sort(rows)
+        scores = self.embeddings[rows] @ q
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return rows[order], scores[order]
+
+    def _scan(
+        self,
+        matrix: np.ndarray,
+        q: np.ndarray,
+        top_k: int,
+        mask: Optional[np.ndarray],
+        row_scales: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, matrix.shape[0], self.block_size):
+            stop = min(start + self.block_size, matrix.shape[0])
+            if row_scales is None:
+                scores = matrix[start:stop] @ q
+            else:
+                scores = (matrix[start:stop].astype(np.float32) @ q) * row_scales[start:stop]
+            rows = np.arange(start, stop)
+            if mask is not None:
+                block_mask = mask[start:stop]
+                scores = scores[block_mask]
+                rows = rows[block_mask]
+            if scores.size > top_k:
+                keep = np.argpartition(-scores, top_k - 1)[:top_k]
+                scores = scores[keep]
+                rows = rows[keep]
+            best_rows = np.concatenate([best_rows, rows])
+            best_scores = np.concatenate([best_scores, scores])
+            if best_scores.size > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1)[:top_k]
+                best_rows = best_rows[keep]
+                best_scores = best_scores[keep]
+
+        order = np.argsort(-best_scores, kind="stable")
+        return best_rows[order], best_scores[order]
+
+    def _mask(self, filter_source: Optional[str], decision: Optional[str]) -> Optional[np.ndarray]:
+        mask = self.ids >= 0
+        if filter_source is not None:
+            mask &= self.sources == self.source_codes.get(filter_source, -2)
+        if decision is not None:
+            mask &= self.classes == self.class_codes.get(decision, -2)
+        return mask
+
+    def _fetch_results(self, rows: np.ndarray, scores: np.ndarray, min_similarity: float, decision: Optional[str]) -> List[ChunkRetrievalResult]:
+        pairs = [(int(self.ids[r]), float(s)) for r, s in zip(rows, scores) if float(s) >= min_similarity]
+        if not pairs:
+            return []
+
+        conn = self.retriever.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT c.id, c.doc_id, c.chunk_index, {CHUNK_TEXT_SQL},
+                           d.url, d.processo, d.source, d.sessao_date,
+                           c.start_offset, c.end_offset
+                    FROM {self.retriever.chunk_table} c
+                    JOIN dgsi_documents d ON c.doc_id = d.id
+                    WHERE c.id = ANY(%s);
+                """, ([chunk_id for chunk_id, _ in pairs],))
+                by_id = {row[0]: row for row in cur.fetchall()}
+        finally:
+            conn.close()
+
+        results = []
+        for chunk_id, similarity in pairs:
+            row = by_id.get(chunk_id)
+            if row is None:
+                # deleted since the snapshot was taken
+                continue
+            results.append(ChunkRetrievalResult(
+                chunk_id=row[0],
+                doc_id=row[1],
+                chunk_index=row[2],
+                chunk_text=row[3],
+                url=row[4],
+                processo=row[5],
+                source=row[6],
+                sessao_date=row[7],
+                similarity=similarity,
+                decision=decision,
+                start_offset=row[8],
+                end_offset=row[9],
+            ))
+        return results
+
+    def retrieve_chunks(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        **_ann_params,
+    ) -> List[ChunkRetrievalResult]:
+        query_embedding = self.retriever.embed_query(query)
+        rows, scores = self.search(query_embedding, top_k, self._mask(filter_source, None))
+        return self._fetch_results(rows, scores, min_similarity, None)
+
+    def retrieve_by_class(
+        self,
+        decision: str,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        **_ann_params,
+    ) -> List[ChunkRetrievalResult]:
+        query_embedding = self.retriever.embed_query(query)
+        rows, scores = self.search(query_embedding, top_k, self._mask(filter_source, decision))
+        return self._fetch_results(rows, scores, min_similarity, decision)
+
+
+def benchmark_quantization(
+    snapshot_dir: str,
+    retriever: DocumentRetriever,
+    rerank_factors: Tuple[int, ...] = (1, 4, 10),
+    num_queries: int = 50,
+    top_k: int = 10,
+    seed: int = 0,
+) -> List[dict]:
+    """Recall@k, latency and bytes scanned of int8 vs. float snapshot search.
+
+    Queries are snapshot rows; the ground truth is the float search. Needs a
+    snapshot exported with int8=True.
+    """
+    exact_searcher = MmapChunkSearcher(snapshot_dir, retriever)
+    rows = int(exact_searcher.meta["rows"])
+    rng = np.random.default_rng(seed)
+    queries = [np.array(exact_searcher.embeddings[i]) for i in rng.choice(rows, size=min(num_queries, rows), replace=False)]
+    mask = exact_searcher._mask(None, None)
+
+    def run(searcher):
+        latencies = []
+        found = []
+        for q in queries:
+            start = time.perf_counter()
+            result_rows, _ = searcher.search(q, top_k, mask)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append(set(result_rows.tolist()))
+        return found, latencies
+
+    truth, latencies = run(exact_searcher)
+    float_bytes = os.path.getsize(os.path.join(snapshot_dir, "embeddings.npy"))
+    configs = [("float", 1, exact_searcher, float_bytes)]
+    for factor in rerank_factors:
+        searcher = MmapChunkSearcher(snapshot_dir, retriever, quantization="int8", rerank_factor=factor)
+        int8_bytes = os.path.getsize(os.path.join(snapshot_dir, "embeddings_int8.npy")) + searcher.scales.nbytes
+        configs.append(("int8", factor, searcher, int8_bytes))
+
+    report = []
+    for name, factor, searcher, scanned_bytes in configs:
+        found, latencies = run(searcher)
+        recalls = [len(f & t) / len(t) for f, t in zip(found, truth) if t]
+        report.append({
+            "representation": name,
+            "rerank_factor": factor,
+            "queries": len(queries),
+            "recall_at_k": float(np.mean(recalls)) if recalls else 0.0,
+            "p50_ms": float(np.percentile(latencies, 50)) if latencies else 0.0,
+            "p95_ms": float(np.percentile(latencies, 95)) if latencies else 0.0,
+            "p99_ms": float(np.percentile(latencies, 99)) if latencies else 0.0,
+            "scanned_bytes": scanned_bytes,
+        })
+    return report
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Memory-mapped exact chunk search")
+    parser.add_argument("--db-dsn", type=str, default=os.getenv("DGSISCRAPER_DB_DSN"),
+                        help="PostgreSQL connection string")
+    parser.add_argument("--action", type=str, required=True, choices=["export", "search", "bench"])
+    parser.add_argument("--snapshot-dir", type=str, default="dgsi_scraper/output/chunk_snapshot")
+    parser.add_argument("--query", type=str, help="Search query (for search action)")
+    parser.add_argument("--decision", type=str, help="Restrict search to one decision class")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--int8", action="store_true",
+                        help="export: also write int8 embeddings; search: scan them and re-score in float")
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    if not args.db_dsn:
+        print("Error: Database DSN not provided.")
+        return
+
+    retriever = DocumentRetriever.from_registry(args.db_dsn)
+
+    if args.action == "export":
+        export_chunk_snapshot(retriever, args.snapshot_dir, int8=args.int8)
+
+    elif args.action == "bench":
+        report = benchmark_quantization(args.snapshot_dir, retriever, top_k=args.top_k)
+        print(json.dumps(report, indent=2))
+
+    elif args.action == "search":
+        if not args.query:
+            print("Error: --query required for search action")
+            return
+        searcher = MmapChunkSearcher(
+            args.snapshot_dir, retriever,
+            quantization="int8" if args.int8 else None, rerank_factor=args.rerank_factor,
+        )
+        if args.decision:
+            results = searcher.retrieve_by_class(args.decision, args.query, top_k=args.top_k)
+        else:
+            results = searcher.retrieve_chunks(args.query, top_k=args.top_k)
+        for i, result in enumerate(results, 1):
+            print(f"{i}. [Similarity: {result.similarity:.3f}] Chunk {result.chunk_index + 1} from Doc {result.doc_id}")
+            print(f"   Source: {result.source}")
+            print(f"   URL: {result.url}")
+            print(f"   Chunk text: {result.chunk_text[:300]}...")
+            print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from typing import List, Optional
+
+import numpy as np
+
+try:
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+except Exception:
+    torch = None
+    SentenceTransformer = None
+    models = None
+
+ENCODER_BACKENDS = ("torch", "onnx")
+
+
+class NeuralEncoder:
+    """CPU sentence-embedding encoder for a sentence-transformers model in a local directory.
+
+    Texts are tokenized once, sorted by token length and cut into batches of
+    similar length, each padded only to its own longest text (dynamic
+    padding), so short chunks don't pay for long ones. A batch is closed at
+    batch_size texts or max_batch_tokens padded tokens, whichever comes first.
+
+    quantize="int8" applies torchao dynamic quantization (int8 activations
+    and weights) to the Linear layers;
+    backend="onnx" loads the model through onnxruntime (needs
+    sentence-transformers[onnx]). processes > 1 spreads large encode() calls
+    over worker processes, each loading its own copy of the model.
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        batch_size: int = 32,
+        max_batch_tokens: int = 16384,
+        max_seq_length: Optional[int] = None,
+        quantize: Optional[str] = None,
+        backend: str = "torch",
+        processes: int = 1,
+        num_threads: Optional[int] = None,
+        normalize: bool = True,
+        length_bucketing: bool = True,
+    ):
+        if torch is None:
+            raise RuntimeError("sentence-transformers / torch are not installed!")
+        if not os.path.isdir(model_dir):
+            raise FileNotFoundError(f"Model directory not found: {model_dir}")
+        if backend not in ENCODER_BACKENDS:
+            raise ValueError(f"backend must be one of: {', '.join(ENCODER_BACKENDS)}")
+        if quantize not in (None, "int8"):
+            raise ValueError("quantize must be None or 'int8'")
+        if quantize and backend != "torch":
+            raise ValueError("int8 dynamic quantization applies to the torch backend only")
+
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.quantize = quantize
+        self.backend = backend
+        self.processes = max(1, processes)
+        self.num_threads = num_threads
+        self.normalize = normalize
+        self.length_bucketing = length_bucketing
+        self._pool = None
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        try:
+            self.model = SentenceTransformer(model_dir, device="cpu", backend=backend, local_files_only=True)
+        except Exception as e:
+            if backend == "onnx":
+                raise RuntimeError(f"Could not load {model_dir} with onnxruntime (pip install sentence-transformers[onnx]): {e}") from e
+            raise
+        if max_seq_length:
+            self.model.max_seq_length = max_seq_length
+        self.model.eval()
+        if quantize == "int8":
+            # torch.ao.quantization.quantize_dynamic is deprecated in favour of torchao
+            try:
+                from torchao.quantization import Int8DynamicActivationInt8WeightConfig, quantize_
+            except ImportError as e:
+                raise RuntimeError(f"int8 quantization needs torchao (pip install torchao): {e}") from e
+            quantize_(self.model, Int8DynamicActivationInt8WeightConfig())
+        self.tokenizer = self.model.tokenizer
+        # renamed get_embedding_dimension in sentence-transformers 6
+        dimension = getattr(self.model, "get_embedding_dimension", None) or self.model.get_sentence_embedding_dimension
+        self.dim = dimension()
+
+    @property
+    def max_seq_length(self) -> int:
+        return self.model.max_seq_length
+
+    def _options(self) -> dict:
+        return {
+            "batch_size": self.batch_size,
+            "max_batch_tokens": self.max_batch_tokens,
+            "max_seq_length": self.max_seq_length,
+            "quantize": self.quantize,
+            "backend": self.backend,
+            "normalize": self.normalize,
+            "length_bucketing": self.length_bucketing,
+        }
+
+    def _batches(self, lengths: List[int]) -> List[List[int]]:
+        """Length-sorted batches (longest first) within batch_size and max_batch_tokens."""
+        if not self.length_bucketing:
+            return [list(range(i, min(i + self.batch_size, len(lengths)))) for i in range(0, len(lengths), self.batch_size)]
+        order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+        batches = []
+        batch: List[int] = []
+        for i in order:
+            # longest first: the first text of a batch sets its padded length
+            padded = lengths[batch[0]] if batch else lengths[i]
+            if batch and (len(batch) >= self.batch_size or (len(batch) + 1) * padded > self.max_batch_tokens):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _encode_local(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        todo = [i for i, text in enumerate(texts) if text and text.strip()]
+        if not todo:
+            return out
+
+        encoded = self.tokenizer(
+            [texts[i] for i in todo], truncation=True, max_length=self.max_seq_length, padding=False
+        )
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        with torch.inference_mode():
+            for batch in self._batches(lengths):
+                features = self.tokenizer.pad(
+                    {key: [encoded[key][i] for i in batch] for key in encoded.keys()},
+                    padding="longest",
+                    return_tensors="pt",
+                )
+                embeddings = self.model(dict(features))["sentence_embedding"]
+                if self.normalize:
+                    embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+                out[[todo[i] for i in batch]] = embeddings.float().cpu().numpy()
+        return out
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """(len(texts), dim) float32 embeddings; empty texts get zero vectors."""
+        if self.processes > 1 and len(texts) >= self.batch_size * self.processes:
+            return self._encode_parallel(texts)
+        return self._encode_local(texts)
+
+    def _encode_parallel(self, texts: List[str]) -> np.ndarray:
+        if self._pool is None:
+            threads = max(1, (self.num_threads or os.cpu_count() or 1) // self.processes)
+            # spawn: torch's thread pools don't survive fork
+            self._pool = multiprocessing.get_context("spawn").Pool(
+                self.processes, initializer=_init_worker, initargs=(self.model_dir, self._options(), threads)
+            )
+        # contiguous slices of the length-sorted texts keep each worker's batches dense
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i] or ""))
+        step = max(self.batch_size, -(-len(texts) // (self.processes * 4)))
+        slices = [order[i:i + step] for i in range(0, len(order), step)]
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for rows, embeddings in zip(slices, self._pool.map(_encode_in_worker, [[texts[i] for i in s] for s in slices])):
+            out[rows] = embeddings
+        return out
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+_worker_encoder: Optional[NeuralEncoder] = None
+
+
+def _init_worker(model_dir: str, options: dict, threads: int):
+    global _worker_encoder
+    _worker_encoder = NeuralEncoder(model_dir, processes=1, num_threads=threads, **options)
+
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return _worker_encoder._encode_local(texts)
+
+
+def create_random_model(out_dir: str, dim: int = 32, layers: int = 2, max_seq_length: int = 128, seed: int = 0) -> str:
+    """Save a tiny randomly initialised BERT sentence-transformers model to out_dir.
+
+    The vectors carry no meaning; it only exercises the encoding and indexing
+    code paths without downloading a real model.
+    """
+    if torch is None:
+        raise RuntimeError("sentence-transformers / torch are not installed!")
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    torch.manual_seed(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        chars = list("abcdefghijklmnopqrstuvwxyzáàâãçéêíóôõú0123456789.,;:-()/º")
+        vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + chars + [f"##{c}" for c in chars]
+        with open(os.path.join(tmp, "vocab.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(vocab) + "\n")
+        tokenizer = BertTokenizerFast(vocab_file=os.path.join(tmp, "vocab.txt"), do_lower_case=True)
+        config = BertConfig(
+            vocab_size=len(vocab),
+            hidden_size=dim,
+            num_hidden_layers=layers,
+            num_attention_heads=2,
+            intermediate_size=dim * 2,
+            max_position_embeddings=max_seq_length,
+        )
+        BertModel(config).save_pretrained(tmp)
+        tokenizer.save_pretrained(tmp)
+
+        transformer = models.Transformer(tmp, max_seq_length=max_seq_length)
+        pooling = models.Pooling(transformer.get_word_embedding_dimension(), pooling_mode="mean")
+        SentenceTransformer(modules=[transformer, pooling], device="cpu").save(out_dir)
+    print(f"Saved random {dim}-d model to {out_dir}")
+    return out_dir
+
+
+def benchmark_encoder(model_dir: str, texts: List[str], **options) -> List[dict]:
+    """Texts/s with and without length bucketing, for each encoder configuration."""
+    report = []
+    for quantize in (None, "int8"):
+        for bucketed in (True, False):
+            encoder = NeuralEncoder(model_dir, quantize=quantize, length_bucketing=bucketed, **options)
+            # warm-up
+            encoder.encode(texts[:encoder.batch_size])
+            start = time.perf_counter()
+            encoder.encode(texts)
+            elapsed = time.perf_counter() - start
+            report.append({
+                "quantize": quantize,
+                "length_bucketing": bucketed,
+                "texts": len(texts),
+                "seconds": elapsed,
+                "texts_per_second": len(texts) / elapsed if elapsed > 0 else 0.0,
+            })
+            encoder.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU sentence-embedding encoder utilities")
+    parser.add_argument("--action", type=str, required=True, choices=["random-model", "bench"])
+    parser.add_argument("--model-dir", type=str, required=True)
+    parser.add_argument("--dim", type=int, default=32, help="random-model: hidden size")
+    parser.add_argument("--texts-file", type=str, help="bench: one text per line (default: random texts)")
+    parser.add_argument("--num-texts", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.action == "random-model":
+        create_random_model(args.model_dir, dim=args.dim)
+
+    elif args.action == "bench":
+        if args.texts_file:
+            with open(args.texts_file, "r", encoding="utf-8") as f:
+                texts = [line.strip() for line in f if line.strip()][:args.num_texts]
+        else:
+            rng = random.Random(0)
+            words = "tribunal recurso acordao processo contrato prova sentença direito decisão".split()
+            texts = [" ".join(rng.choice(words) for _ in range(rng.choice((5, 20, 80, 300)))) for _ in range(args.num_texts)]
+        report = benchmark_encoder(args.model_dir, texts, batch_size=args.batch_size, num_threads=args.threads)
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
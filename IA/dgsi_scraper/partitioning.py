@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+from typing import Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+try:
+    import psycopg
+except Exception:
+    psycopg = None
+
+from dgsi_scraper.retriever import LEGACY_TABLES, DocumentRetriever
+from dgsi_scraper.scrape import (
+    SOURCES,
+    db_document_fk,
+    db_ensure_source_partitions,
+    db_is_partitioned,
+    db_source_partitions,
+)
+
+# Keys of the partitioned tables: unique constraints must contain the partition key
+DOCUMENT_KEYS = ("PRIMARY KEY (id, source)", "CONSTRAINT dgsi_documents_url_key UNIQUE (url, source)")
+CHUNK_KEYS = ("PRIMARY KEY (id, source)", "UNIQUE (doc_id, chunk_index, source)")
+DOC_VECTOR_KEYS = ("PRIMARY KEY (id, source)",)
+
+ANN_METHODS = ("ivfflat", "hnsw")
+
+
+def source_partitioned_tables(cur) -> List[str]:
+    """Tables LIST-partitioned by source, dgsi_documents first."""
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0]
+        WHERE p.partstrat = 'l' AND a.attname = 'source'
+          AND c.relnamespace = current_schema()::regnamespace
+        ORDER BY c.relname <> 'dgsi_documents', c.relname;
+    """)
+    return [row[0] for row in cur.fetchall()]
+
+
+def document_references(cur) -> List[Tuple[str, str, str, bool]]:
+    """(table, constraint, column, composite) of every foreign key to dgsi_documents."""
+    cur.execute("""
+        SELECT con.conrelid::regclass::text, con.conname, a.attname, array_length(con.conkey, 1) > 1
+        FROM pg_constraint con
+        JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = con.conkey[1]
+        WHERE con.contype = 'f' AND con.confrelid = 'dgsi_documents'::regclass
+          AND con.conparentid = 0
+        ORDER BY 1;
+    """)
+    return [tuple(row) for row in cur.fetchall()]
+
+
+def _model_tables(cur, column: str, legacy: str) -> List[str]:
+    """Existing per-model tables of a registry column (chunk_table, doc_table), legacy one first."""
+    tables = []
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (legacy,))
+    if cur.fetchone()[0]:
+        tables.append(legacy)
+    cur.execute("SELECT to_regclass('dgsi_embedding_models') IS NOT NULL;")
+    if cur.fetchone()[0]:
+        # doc_table of a legacy model registered before its vectors moved out of dgsi_documents
+        cur.execute(f"""
+            SELECT {column} FROM dgsi_embedding_models
+            WHERE to_regclass({column}) IS NOT NULL AND {column} <> 'dgsi_documents';
+        """)
+        tables += [row[0] for row in cur.fetchall()]
+    return list(dict.fromkeys(tables))
+
+
+def _repartition(cur, table: str, keys: Iterable[str], sources: Iterable[str]) -> List[str]:
+    """Rebuild an unpartitioned table as LIST-partitioned by source, rows and secondary indexes included.
+
+    Foreign keys to the table must be dropped beforehand. ANN indexes are not
+    rebuilt here (they need per-partition sizing); their names are returned.
+    """
+    cur.execute("""
+        SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid), am.amname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE i.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint con WHERE con.conindid = i.indexrelid);
+    """, (table,))
+    indexes = cur.fetchall()
+    cur.execute("""
+        SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u');
+    """, (table,))
+    constraints = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT pg_get_serial_sequence(%s, 'id');", (table,))
+    sequence = cur.fetchone()[0]
+
+    # free the index and constraint names for the partitioned table
+    old = f"{table[:50]}_unpartitioned"
+    cur.execute(f"ALTER TABLE {table} RENAME TO {old};")
+    for name in constraints:
+        cur.execute(f"ALTER TABLE {old} DROP CONSTRAINT {name};")
+    for name, _, _ in indexes:
+        cur.execute(f"DROP INDEX {name};")
+
+    cur.execute(f"""
+        CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS, {", ".join(keys)})
+        PARTITION BY LIST (source);
+    """)
+    db_ensure_source_partitions(cur, table, sources)
+    cur.execute(f"INSERT INTO {table} SELECT * FROM {old};")
+    if sequence:
+        cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id;")
+    cur.execute(f"DROP TABLE {old};")
+
+    skipped = []
+    for name, definition, method in indexes:
+        if method in ANN_METHODS:
+            skipped.append(name)
+        elif not definition.endswith("(source)"):
+            # a source index is useless once every partition holds one source
+            cur.execute(definition + ";")
+    return skipped
+
+
+def migrate(conn, sources: Optional[Iterable[str]] = None) -> dict:
+    """Convert dgsi_documents, the chunk and the document vector tables to LIST partitioning by source.
+
+    Runs in one transaction. Every foreign key to dgsi_documents becomes
+    (column, source) -> (id, source): the referencing tables get a source
+    column, filled from their documents. ANN indexes are dropped; rebuild them
+    per model with retriever.py --action build-index (one index per partition).
+    """
+    with conn.cursor() as cur:
+        if db_is_partitioned(cur):
+            raise RuntimeError("dgsi_documents is already partitioned")
+        cur.execute("LOCK TABLE dgsi_documents IN ACCESS EXCLUSIVE MODE;")
+        cur.execute("SELECT DISTINCT source FROM dgsi_documents;")
+        wanted = list(dict.fromkeys([*(sources or [s["source"] for s in SOURCES]), *(row[0] for row in cur.fetchall())]))
+
+        references = document_references(cur)
+        for table, constraint, _, _ in references:
+            cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {constraint};")
+
+        dropped = {"dgsi_documents": _repartition(cur, "dgsi_documents", DOCUMENT_KEYS, wanted)}
+        for table in _model_tables(cur, "chunk_table", LEGACY_TABLES[1]):
+            # chunks carry their document's source; it is the partition key now
+            cur.execute(f"""
+                UPDATE {table} c SET source = d.source
+                FROM dgsi_documents d
+                WHERE c.doc_id = d.id AND c.source IS DISTINCT FROM d.source;
+            """)
+            dropped[table] = _repartition(cur, table, CHUNK_KEYS, wanted)
+        for table in _model_tables(cur, "doc_table", LEGACY_TABLES[0]):
+            cur.execute(f"""
+                UPDATE {table} v SET source = d.source
+                FROM dgsi_documents d
+                WHERE v.id = d.id AND v.source IS DISTINCT FROM d.source;
+            """)
+            dropped[table] = _repartition(cur, table, DOC_VECTOR_KEYS, wanted)
+
+        for table, _, column, _ in references:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS source TEXT;")
+            cur.execute(f"""
+                UPDATE {table} t SET source = d.source
+                FROM dgsi_documents d
+                WHERE t.{column} = d.id AND t.source IS DISTINCT FROM d.source;
+            """)
+            cur.execute(f"ALTER TABLE {table} ADD {db_document_fk(cur, column)};")
+
+        cur.execute("SELECT to_regclass('dgsi_corpus_stats') IS NOT NULL AND to_regclass(%s) IS NOT NULL;", (LEGACY_TABLES[1],))
+        if cur.fetchone()[0]:
+            # the statement triggers went away with the old tables
+            DocumentRetriever(conn.info.dsn)._ensure_stats(cur)
+    conn.commit()
+
+    for table, names in dropped.items():
+        if names:
+            print(f"[WARN] {table}: rebuild ANN indexes {', '.join(names)} (retriever.py --action build-index)")
+    print(f"Partitioned dgsi_documents and {len(dropped) - 1} chunk/vector table(s) by source ({len(wanted)} sources)")
+    return {"sources": wanted, "tables": list(dropped), "foreign_keys": [r[0] for r in references], "ann_indexes_dropped": dropped}
+
+
+def add_sources(conn, sources: Iterable[str]) -> List[str]:
+    """Give new sources their own partition in every table partitioned by source."""
+    sources = list(sources)
+    created = []
+    with conn.cursor() as cur:
+        for table in source_partitioned_tables(cur):
+            created += db_ensure_source_partitions(cur, table, sources)
+    conn.commit()
+    for name in created:
+        print(f"Created partition {name}")
+    return created
+
+
+def drop_source(conn, source: str) -> dict:
+    """Delete a source's documents and everything derived from them.
+
+    Partitions of the chunk and document vector tables are truncated and the
+    documents partition is detached, dropped and recreated empty, so no other
+    source is scanned or locked row by row. Unpartitioned tables referencing
+    dgsi_documents (index state, ...) delete the source's rows.
+    """
+    with conn.cursor() as cur:
+        if not db_is_partitioned(cur):
+            raise RuntimeError("dgsi_documents is not partitioned; run --action migrate first")
+        partition = db_source_partitions(cur).get(source)
+        truncated = []
+        for table in source_partitioned_tables(cur):
+            if table == "dgsi_documents":
+                continue
+            part = db_source_partitions(cur, table).get(source)
+            if part:
+                cur.execute(f"TRUNCATE {part};")
+                truncated.append(part)
+        for table, _, column, _ in document_references(cur):
+            if not db_is_partitioned(cur, table):
+                cur.execute(f"""
+                    DELETE FROM {table} t USING dgsi_documents d
+                    WHERE t.{column} = d.id AND d.source = %s;
+                """, (source,))
+
+        if partition:
+            cur.execute(f"ALTER TABLE dgsi_documents DETACH PARTITION {partition};")
+            cur.execute(f"DROP TABLE {partition};")
+            db_ensure_source_partitions(cur, "dgsi_documents", [source])
+        else:
+            # rows in the DEFAULT partition
+            cur.execute("DELETE FROM dgsi_documents WHERE source = %s;", (source,))
+        # TRUNCATE and DROP bypass the stats triggers
+        cur.execute("SELECT to_regclass('dgsi_corpus_stats') IS NOT NULL;")
+        if cur.fetchone()[0]:
+            cur.execute("DELETE FROM dgsi_corpus_stats WHERE source = %s;", (source,))
+    conn.commit()
+    print(f"Dropped {source}: {partition or 'DEFAULT partition rows'}" + (f", truncated {', '.join(truncated)}" if truncated else ""))
+    return {"source": source, "documents_partition": partition, "truncated": truncated}
+
+
+def partition_status(conn) -> dict:
+    """Rows (planner estimate) and total bytes of every partition, per partitioned table."""
+    status = {}
+    with conn.cursor() as cur:
+        for table in source_partitioned_tables(cur):
+            cur.execute("""
+                SELECT c.relname, pg_get_expr(c.relpartbound, c.oid),
+                       GREATEST(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid)
+                FROM pg_partition_tree(%s::regclass) t
+                JOIN pg_class c ON c.oid = t.relid
+                WHERE t.isleaf
+                ORDER BY c.relname;
+            """, (table,))
+            status[table] = [
+                {"partition": name, "bound": bound, "approx_rows": rows, "bytes": size}
+                for name, bound, rows, size in cur.fetchall()
+            ]
+    conn.rollback()
+    return status
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Source partitioning of dgsi_documents and the chunk tables")
+    parser.add_argument("--db-dsn", type=str, default=os.getenv("DGSISCRAPER_DB_DSN"),
+                        help="PostgreSQL connection string")
+    parser.add_argument("--action", type=str, required=True, choices=["migrate", "add-sources", "drop-source", "status"])
+    parser.add_argument("--sources", type=str,
+                        help="Comma-separated source ids (migrate: partitions to create, default: all known; add-sources)")
+    parser.add_argument("--source", type=str, help="drop-source: the source to delete")
+    args = parser.parse_args()
+
+    if not args.db_dsn:
+        print("Error: Database DSN not provided.")
+        return
+    if psycopg is None:
+        raise RuntimeError("psycopg is not installed!")
+    sources = [s.strip() for s in args.sources.split(",") if s.strip()] if args.sources else None
+
+    with psycopg.connect(args.db_dsn) as conn:
+        if args.action == "migrate":
+            migrate(conn, sources)
+
+        elif args.action == "add-sources":
+            if not sources:
+                print("Error: --sources required for add-sources")
+                return
+            add_sources(conn, sources)
+
+        elif args.action == "drop-source":
+            if not args.source:
+                print("Error: --source required for drop-source")
+                return
+            drop_source(conn, args.source)
+
+        elif args.action == "status":
+            print(json.dumps(partition_status(conn), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+logger = logging.getLogger("dgsi_scraper.retriever")
+
+# Timing spans (ms by name) of the retrieve* call running in this context;
+# None outside of one. A ContextVar, so concurrent async searches and threads
+# each see their own.
+_spans: ContextVar[Optional[dict]] = ContextVar("dgsi_retriever_spans", default=None)
+
+QUERY_PLANS_TABLE = "dgsi_query_plans"
+
+EXPLAIN_PREFIX = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+
+# Settings a search may change for its transaction (ANN parameters, the exact
+# scan fallback); a sampled query is replayed with the values it ran with.
+REPLAYED_SETTINGS = ("ivfflat.probes", "hnsw.ef_search", "enable_indexscan")
+SETTINGS_SQL = "SELECT " + ", ".join(f"current_setting('{name}', true)" for name in REPLAYED_SETTINGS) + ";"
+
+
+@contextmanager
+def span(name: str):
+    """Add the time spent in the block to span name of the current retrieve* call."""
+    spans = _spans.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if spans is not None:
+            key = f"{name}_ms"
+            spans[key] = spans.get(key, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def current_spans() -> Optional[dict]:
+    return _spans.get()
+
+
+def instrumented(method):
+    """Record embedding / sql / materialize spans of a retrieve* method in last_timings.
+
+    Nested instrumented calls add to the outermost one. Cache hits (see
+    result_cache.cached_results) show up as a total without sql time.
+    """
+    def finish(self, spans: dict, start: float):
+        spans["total_ms"] = (time.perf_counter() - start) * 1000
+        timings = {"method": method.__name__, **{k: round(v, 3) for k, v in spans.items()}}
+        self.last_timings = timings
+        logger.debug("%s timings: %s", method.__name__, json.dumps(timings))
+
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            if _spans.get() is not None:
+                return await method(self, *args, **kwargs)
+            spans: dict = {}
+            token = _spans.set(spans)
+            start = time.perf_counter()
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                finish(self, spans, start)
+                _spans.reset(token)
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if _spans.get() is not None:
+            return method(self, *args, **kwargs)
+        spans: dict = {}
+        token = _spans.set(spans)
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            finish(self, spans, start)
+            _spans.reset(token)
+    return wrapper
+
+
+QUERY_LOG_SCHEMA_SQL = (
+    f"""
+    CREATE TABLE IF NOT EXISTS {QUERY_PLANS_TABLE} (
+        id BIGSERIAL PRIMARY KEY,
+        logged_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        method TEXT NOT NULL,
+        model_version TEXT,
+        query_hash TEXT NOT NULL,
+        query_sql TEXT NOT NULL,
+        execution_ms DOUBLE PRECISION,
+        planning_ms DOUBLE PRECISION,
+        shared_hit_blocks BIGINT,
+        shared_read_blocks BIGINT,
+        hot_node TEXT,
+        spans JSONB,
+        plan JSONB NOT NULL
+    );
+    """,
+    f"CREATE INDEX IF NOT EXISTS {QUERY_PLANS_TABLE}_logged_at_idx ON {QUERY_PLANS_TABLE} (logged_at);",
+)
+
+
+INSERT_PLAN_SQL = f"""
+    INSERT INTO {QUERY_PLANS_TABLE} (
+        method, model_version, query_hash, query_sql, execution_ms, planning_ms,
+        shared_hit_blocks, shared_read_blocks, hot_node, spans, plan
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s::jsonb, %s::jsonb);
+"""
+
+
+def _node_label(node: dict) -> str:
+    label = node.get("Node Type", "?")
+    if node.get("Index Name"):
+        label += f" using {node['Index Name']}"
+    if node.get("Relation Name"):
+        label += f" on {node['Relation Name']}"
+    return label
+
+
+def hot_node(plan: dict) -> Optional[str]:
+    """The plan node with the most exclusive time (its own, children excluded)."""
+    best = None
+
+    def walk(node: dict):
+        nonlocal best
+        children = node.get("Plans", [])
+        total = node.get("Actual Total Time", 0.0) * node.get("Actual Loops", 1)
+        own = total - sum(c.get("Actual Total Time", 0.0) * c.get("Actual Loops", 1) for c in children)
+        if best is None or own > best[0]:
+            best = (own, node)
+        for child in children:
+            walk(child)
+
+    walk(plan)
+    if best is None:
+        return None
+    return f"{_node_label(best[1])} ({best[0]:.2f} ms)"
+
+
+def plan_record(method: str, model_version: str, sql_text: str, explain: list, spans: Optional[dict]) -> tuple:
+    """INSERT_PLAN_SQL parameters from EXPLAIN (FORMAT JSON) output."""
+    result = explain[0] if isinstance(explain, list) else explain
+    plan = result["Plan"]
+    normalized = re.sub(r"\s+", " ", sql_text).strip()
+    return (
+        method,
+        model_version,
+        hashlib.md5(normalized.encode("utf-8")).hexdigest(),
+        normalized,
+        result.get("Execution Time"),
+        result.get("Planning Time"),
+        plan.get("Shared Hit Blocks"),
+        plan.get("Shared Read Blocks"),
+        hot_node(plan),
+        json.dumps(spans or {}),
+        json.dumps(result),
+    )
+
+
+def slowest_plans(conn, limit: int = 20, since_hours: Optional[float] = None, method: Optional[str] = None) -> List[dict]:
+    """Captured plans grouped by method and statement, slowest (p95 execution time) first."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (QUERY_PLANS_TABLE,))
+        if not cur.fetchone()[0]:
+            return []
+        filters = ["true"]
+        params: list = []
+        if since_hours is not None:
+            filters.append("logged_at >= now() - make_interval(secs => %s)")
+            params.append(since_hours * 3600)
+        if method:
+            filters.append("method = %s")
+            params.append(method)
+        cur.execute(f"""
+            SELECT method, query_hash, model_version, COUNT(*),
+                   AVG(execution_ms),
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY execution_ms),
+                   MAX(execution_ms),
+                   AVG(planning_ms),
+                   AVG(shared_hit_blocks),
+                   AVG(shared_read_blocks),
+                   (array_agg(hot_node ORDER BY execution_ms DESC))[1],
+                   (array_agg(id ORDER BY execution_ms DESC))[1],
+                   MAX(logged_at)
+            FROM {QUERY_PLANS_TABLE}
+            WHERE {" AND ".join(filters)}
+            GROUP BY method, query_hash, model_version
+            ORDER BY 6 DESC NULLS LAST
+            LIMIT %s;
+        """, (*params, limit))
+        names = [
+            "method", "query_hash", "model_version", "samples", "avg_ms", "p95_ms", "max_ms", "avg_planning_ms",
+            "avg_shared_hit_blocks", "avg_shared_read_blocks", "slowest_hot_node", "slowest_plan_id", "last_logged_at",
+        ]
+        rows = [dict(zip(names, row)) for row in cur.fetchall()]
+    conn.rollback()
+    for row in rows:
+        for key in ("avg_ms", "p95_ms", "max_ms", "avg_planning_ms", "avg_shared_hit_blocks", "avg_shared_read_blocks"):
+            if row[key] is not None:
+                row[key] = round(float(row[key]), 3)
+        row["last_logged_at"] = row["last_logged_at"].isoformat() if row["last_logged_at"] else None
+    return rows
+
+
+class PlanSampler:
+    """Replays sampled similarity queries under EXPLAIN ANALYZE on a background thread.
+
+    The search itself only queues its statement, parameters and settings; the
+    replay runs on its own connection (from connect) and its plan goes to
+    dgsi_query_plans. Samples arriving while max_pending are queued are
+    dropped, so a slow database never backs up searches.
+    """
+
+    def __init__(self, connect, max_pending: int = 100):
+        self._connect = connect
+        self._pending: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._schema_ready = False
+        self.dropped = 0
+
+    def submit(self, method: str, model_version: str, sql_text: str, params, settings, spans: Optional[dict]) -> bool:
+        """Queue a query for replay; False when the queue is full."""
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="dgsi-plan-sampler", daemon=True)
+                self._worker.start()
+        try:
+            self._pending.put_nowait((method, model_version, sql_text, params, tuple(settings), dict(spans or {})))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self):
+        """Wait until every queued query has been replayed."""
+        self._pending.join()
+
+    def _run(self):
+        while True:
+            sample = self._pending.get()
+            try:
+                self.capture(*sample)
+            except Exception as e:
+                print(f"[WARN] Could not capture the plan of {sample[0]}: {e}")
+            finally:
+                self._pending.task_done()
+
+    def capture(self, method: str, model_version: str, sql_text: str, params, settings, spans: Optional[dict]):
+        """Replay one query under EXPLAIN ANALYZE and store its plan."""
+        conn = self._connect()
+        try:
+            with conn.cursor() as cur:
+                for name, value in zip(REPLAYED_SETTINGS, settings):
+                    if value is not None:
+                        cur.execute("SELECT set_config(%s, %s, true);", (name, value))
+                cur.execute(EXPLAIN_PREFIX + sql_text, params)
+                explain = cur.fetchone()[0]
+            # the replay wrote nothing; also ends its transaction-local settings
+            conn.rollback()
+            with conn.cursor() as cur:
+                if not self._schema_ready:
+                    for statement in QUERY_LOG_SCHEMA_SQL:
+                        cur.execute(statement)
+                cur.execute(INSERT_PLAN_SQL, plan_record(method, model_version, sql_text, explain, spans))
+            conn.commit()
+            self._schema_ready = True
+        finally:
+            conn.close()
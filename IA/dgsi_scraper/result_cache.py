@@ -0,0 +1,169 @@
+import dataclasses
+import functools
+import hashlib
+import inspect
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+
+class ResultCache:
+    """Retrieval results by key: an in-process LRU, optionally backed by Redis.
+
+    Results are stored as JSON, so callers can mutate what they get back
+    (load_texts fills text_plain in place) without touching the cache. The
+    Redis tier is shared between processes; its entries expire after ttl
+    seconds. On a Redis error the tier is skipped for redis_retry seconds; a
+    cache outage never fails a search.
+    """
+
+    def __init__(
+        self,
+        types: Iterable[type],
+        max_size: int = 1024,
+        redis_url: Optional[str] = None,
+        ttl: int = 3600,
+        prefix: str = "dgsi:results:",
+        redis_retry: float = 30.0,
+    ):
+        if redis_url and redis is None:
+            raise RuntimeError("redis is not installed! (pip install redis)")
+        self.types = {cls.__name__: cls for cls in types}
+        self.max_size = max_size
+        self.ttl = ttl
+        self.prefix = prefix
+        self.redis = redis.Redis.from_url(redis_url) if redis_url else None
+        self.redis_retry = redis_retry
+        self._redis_down_until = 0.0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        """sha256 of the JSON of parts (method, arguments, model and index version)."""
+        payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _encode(self, value) -> bytes:
+        def plain(v):
+            if isinstance(v, list):
+                return [plain(x) for x in v]
+            return {"type": type(v).__name__, "fields": dataclasses.asdict(v)}
+        return json.dumps(plain(value), ensure_ascii=False).encode("utf-8")
+
+    def _decode(self, payload: bytes):
+        def typed(v):
+            if isinstance(v, list):
+                return [typed(x) for x in v]
+            return self.types[v["type"]](**v["fields"])
+        return typed(json.loads(payload))
+
+    def _remember(self, key: str, payload: bytes):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _redis_call(self, method: str, *args):
+        if self.redis is None or time.monotonic() < self._redis_down_until:
+            return None
+        try:
+            return getattr(self.redis, method)(*args)
+        except Exception as e:
+            print(f"[WARN] Result cache: Redis unavailable for {self.redis_retry:.0f}s, in-process tier only ({e})")
+            self._redis_down_until = time.monotonic() + self.redis_retry
+            return None
+
+    def get(self, key: str) -> Optional[List]:
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._decode(payload)
+        payload = self._redis_call("get", self.prefix + key)
+        if payload is not None:
+            self.redis_hits += 1
+            self._remember(key, payload)
+            return self._decode(payload)
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: List):
+        payload = self._encode(value)
+        self._remember(key, payload)
+        self._redis_call("set", self.prefix + key, payload, self.ttl)
+
+    def clear(self):
+        """Empty the in-process tier; Redis entries of older index versions just expire."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "redis": self.redis is not None and time.monotonic() >= self._redis_down_until,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": ((self.hits + self.redis_hits) / lookups) if lookups else 0.0,
+        }
+
+
+def cached_results(method):
+    """Serve a retrieve* method from the retriever's result_cache.
+
+    The key covers the method name, every argument (query text included),
+    the model version and the index version, so a sync or reindex that bumps
+    the version makes older entries unreachable. Works on DocumentRetriever
+    and, awaiting index_version(), on AsyncDocumentRetriever.
+    """
+    signature = inspect.signature(method)
+
+    def cache_key(self, version: int, args, kwargs) -> str:
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(list(bound.arguments.items())[1:])
+        return self.result_cache.key(method.__name__, self.model_version, version, arguments)
+
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            if self.result_cache is None:
+                return await method(self, *args, **kwargs)
+            key = cache_key(self, await self.index_version(), args, kwargs)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached
+            results = await method(self, *args, **kwargs)
+            self.result_cache.put(key, results)
+            return results
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.result_cache is None:
+            return method(self, *args, **kwargs)
+        key = cache_key(self, self.index_version(), args, kwargs)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            return cached
+        results = method(self, *args, **kwargs)
+        self.result_cache.put(key, results)
+        return results
+    return wrapper
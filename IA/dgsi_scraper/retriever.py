@@ -1,17 +1,45 @@
+import atexit
+import hashlib
 import json
+import logging
+import math
 import os
+import random
+import re
+import threading
+import time
+import functools
+from collections import OrderedDict
 from typing import List, Tuple, Optional
 from dataclasses import dataclass
 import argparse
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 from scipy.sparse import csr_matrix
 
+from dgsi_scraper import query_log
+from dgsi_scraper.query_log import instrumented, span
+from dgsi_scraper.result_cache import ResultCache, cached_results
+from dgsi_scraper.scrape import (
+    db_document_fk,
+    db_ensure_source_partitions,
+    db_index_name,
+    db_is_partitioned,
+    db_source_partitions,
+)
+
 try:
     import psycopg
+    from psycopg import sql as pg_sql
 except Exception:
     psycopg = None
+    pg_sql = None
+
+DEFAULT_DECISION_JSON = os.path.join(
+    os.path.dirname(__file__), "..", "agent", "decision_ids_by_class_ALLSOURCES.json"
+)
 
 
 @dataclass
@@ -19,12 +47,15 @@ class RetrievalResult:
     id: int
     url: str
     processo: Optional[str]
-    text_plain: str
+    # None unless projection="full"; see DocumentRetriever.load_texts
+    text_plain: Optional[str]
     similarity: float
     source: str
     sessao_date: Optional[str]
     descritores: List[str]
-    decision: Optional[str]
+    decision: Optional[str] = None
+    # window of text_plain around the best-matching chunk (projection="snippet")
+    snippet: Optional[str] = None
 
 
 @dataclass
@@ -32,13 +63,127 @@ class ChunkRetrievalResult:
     chunk_id: int
     doc_id: int
     chunk_index: int
-    chunk_text: str
+    # None when projection="ids"
+    chunk_text: Optional[str]
     similarity: float
     url: str
     processo: Optional[str]
     source: str
     sessao_date: Optional[str]
-    decision: Optional[str]
+    decision: Optional[str] = None
+    # character span of the chunk inside dgsi_documents.text_plain
+    start_offset: Optional[int] = None
+    end_offset: Optional[int] = None
+    # reciprocal-rank fusion score (retrieve_hybrid only)
+    score: Optional[float] = None
+
+
+# Text search configuration for the chunk tsvectors
+FTS_CONFIG = "portuguese"
+
+# Chunks store offsets into text_plain; rows indexed before that keep chunk_text.
+CHUNK_TEXT_SQL = "COALESCE(c.chunk_text, substr(d.text_plain, c.start_offset + 1, c.end_offset - c.start_offset))"
+
+# Disables ANN index scans for the rest of the transaction (exact search)
+EXACT_SCAN_SQL = "SELECT set_config('enable_indexscan', 'off', true);"
+
+# Columns selected by every chunk query, in the order _chunk_results expects.
+CHUNK_RESULT_COLUMNS = f"""
+    c.id, c.doc_id, c.chunk_index, {CHUNK_TEXT_SQL},
+    d.url, d.processo, d.source, d.sessao_date,
+    top.distance, c.start_offset, c.end_offset
+"""
+CHUNK_ID_COLUMNS = CHUNK_RESULT_COLUMNS.replace(CHUNK_TEXT_SQL, "NULL::text")
+
+PROJECTIONS = ("ids", "snippet", "full")
+
+# First-stage representations for retrieve_chunks_quantized (pgvector >= 0.7)
+QUANTIZATIONS = ("halfvec", "binary")
+
+# first pgvector release with sparsevec, halfvec and binary_quantize
+PGVECTOR_TYPES_VERSION = (0, 7)
+
+# ANN index method -> the per-query search parameter it reads, and the
+# values index_report tries by default
+SEARCH_PARAMS = {"ivfflat": "probes", "hnsw": "ef_search"}
+INDEX_REPORT_DEFAULTS = {"probes": [1, 5, 10, 20], "ef_search": [40, 100, 200, 400]}
+
+# How document vectors are pooled from chunk vectors (doc_pooling)
+DOC_POOLINGS = ("mean", "max", "weighted")
+
+# Embedding backends DocumentRetriever can load; "sentence-transformers"
+# loads a local model directory (model_path), see neural_encoder.NeuralEncoder
+SUPPORTED_MODELS = ("tfidf", "sentence-transformers")
+
+logger = logging.getLogger(__name__)
+
+# Whether the registry has the index_version column (added after it shipped)
+INDEX_VERSION_COLUMN_SQL = """
+    SELECT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'dgsi_embedding_models' AND column_name = 'index_version'
+    );
+"""
+INDEX_VERSION_SQL = "SELECT index_version FROM dgsi_embedding_models WHERE model_version = %s;"
+
+# (document vectors, chunks, index state) of the model registered first;
+# later models get their own tables, see DocumentRetriever.model_tables.
+LEGACY_TABLES = ("dgsi_document_vectors", "dgsi_document_chunks", "dgsi_index_state")
+
+# TF-IDF vocabularies (terms in column order, idf weights) by content hash; a
+# registered TF-IDF model refers to its vocabulary by dgsi_embedding_models.vocab_sha256
+VOCABULARY_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS dgsi_tfidf_vocabularies (
+        vocab_sha256 TEXT PRIMARY KEY,
+        terms TEXT[] NOT NULL,
+        idf DOUBLE PRECISION[] NOT NULL,
+        documents INTEGER NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+# documents a TF-IDF vocabulary is fitted on (the first ones by id)
+VOCABULARY_FIT_DOCUMENTS = 5000
+
+
+class _ModelSwitchLock:
+    """Any number of embedding calls at a time, or one model switch.
+
+    A switch waits for the embedding calls in flight and holds new ones back
+    until the encoder / vectorizer and everything derived from them changed
+    together. Reads may nest in one thread; a switch must not start inside one.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+
+    @contextmanager
+    def reading(self):
+        with self._cond:
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def switching(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._readers == 0)
+            yield
+
+
+def _uses_model(method):
+    """Run an embedding method while no model switch is in progress."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._model_lock.reading():
+            return method(self, *args, **kwargs)
+    return wrapper
 
 
 class DocumentRetriever:
@@ -48,417 +193,3210 @@ class DocumentRetriever:
         model_name: str = "tfidf",
         embedding_dim: int = 768,
         chunk_size: int = 512,
+        model_version: Optional[str] = None,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        query_cache_size: int = 256,
+        sparse: Optional[bool] = None,
+        follow_active: bool = False,
+        active_check_interval: float = 30.0,
+        model_path: Optional[str] = None,
+        encoder_options: Optional[dict] = None,
+        doc_pooling: Optional[str] = None,
+        result_cache_size: int = 0,
+        result_cache_redis_url: Optional[str] = None,
+        result_cache_ttl: int = 3600,
+        version_check_interval: float = 1.0,
+        exact_scan_rows: int = 20000,
+        explain_sample_rate: float = 0.0,
     ):
+        if doc_pooling is not None and doc_pooling not in DOC_POOLINGS:
+            raise ValueError(f"doc_pooling must be one of: {', '.join(DOC_POOLINGS)}")
         self.db_dsn = db_dsn
-        self.model_name = model_name
-        self.embedding_dim = embedding_dim
-        self.chunk_size = chunk_size
-        print(f"Loading TF-IDF vectorizer: {model_name}")
-        # Initialize TF-IDF vectorizer with a max features limit
-        self.vectorizer = TfidfVectorizer(
-            max_features=embedding_dim,
-            lowercase=True,
-            ngram_range=(1, 2),
-            min_df=1,
-            max_df=0.95
-        )
-        self.vectorizer_fitted = False
-    
+        # None: document vectors embed the first chunk_size * 3 characters;
+        # otherwise they pool the vectors of all the document's chunks
+        self.doc_pooling = doc_pooling
+        # Default ANN search parameters, overridable per retrieve* call
+        self.probes = probes
+        self.ef_search = ef_search
+        # LRU of query embeddings keyed by (text sha256, model version)
+        self.query_cache_size = query_cache_size
+        self._query_cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+        self._query_cache_lock = threading.Lock()
+        # retrieve* results keyed by arguments, model and index version; the
+        # index version is re-read at most every version_check_interval seconds
+        self.result_cache = None
+        if result_cache_size > 0 or result_cache_redis_url:
+            self.result_cache = ResultCache(
+                (RetrievalResult, ChunkRetrievalResult), result_cache_size, result_cache_redis_url, result_cache_ttl
+            )
+        self.version_check_interval = version_check_interval
+        self._index_version: Optional[int] = None
+        self._index_version_checked_at = 0.0
+        # filtered chunk searches estimated to match at most exact_scan_rows
+        # chunks are exact scans; larger ones use the ANN index with probes /
+        # ef_search raised for the filter's selectivity (see _plan_filtered)
+        self.exact_scan_rows = exact_scan_rows
+        self._planner_stats: Optional[dict] = None
+        self._planner_stats_at = 0.0
+        self.last_plan: Optional[dict] = None
+        # embedding / sql / materialize ms of the last retrieve* call; a
+        # sample of the similarity queries is replayed under EXPLAIN ANALYZE in
+        # the background, into dgsi_query_plans
+        self.last_timings: Optional[dict] = None
+        self.explain_sample_rate = explain_sample_rate
+        self.plan_sampler = query_log.PlanSampler(self.get_connection)
+        # follow_active=True: switch to the registry's active model when it
+        # changes (checked at most every active_check_interval seconds)
+        self.follow_active = follow_active
+        self.active_check_interval = active_check_interval
+        self._active_checked_at = 0.0
+        # NeuralEncoder options (batch_size, processes, quantize, backend, ...);
+        # they apply to every sentence-transformers model this retriever loads
+        self.encoder_options = encoder_options or {}
+        self.encoder = None
+        self._model_lock = _ModelSwitchLock()
+        # one registry check / model load at a time (follow_active)
+        self._follow_lock = threading.Lock()
+        self._fit_lock = threading.Lock()
+        self._configure(model_name, embedding_dim, chunk_size, sparse, model_version, model_path)
+
+    def _configure(
+        self,
+        model_name: str,
+        embedding_dim: int,
+        chunk_size: int,
+        sparse: Optional[bool],
+        model_version: Optional[str],
+        model_path: Optional[str] = None,
+        tables: Optional[Tuple[str, str, str]] = None,
+    ):
+        """Load the embedding model, then switch every model setting at once.
+
+        The encoder or vectorizer is built first; the switch itself waits for
+        embedding calls in flight (see _ModelSwitchLock), so none of them sees
+        one model's vectorizer with another's dimension or version.
+        """
+        if model_name not in SUPPORTED_MODELS:
+            raise ValueError(f"Unsupported embedding model {model_name!r}; available: {', '.join(SUPPORTED_MODELS)}")
+        encoder = None
+        vectorizer = None
+        if model_name == "sentence-transformers":
+            if not model_path:
+                raise ValueError("sentence-transformers models need model_path (a local model directory)")
+            if sparse:
+                raise ValueError("sparse storage is for TF-IDF vectors only")
+            sparse = False
+            from dgsi_scraper.neural_encoder import NeuralEncoder
+
+            print(f"Loading sentence-transformers model: {model_path}")
+            encoder = NeuralEncoder(model_path, **self.encoder_options)
+            if embedding_dim != encoder.dim:
+                print(f"Using the model's embedding dimension {encoder.dim} (not {embedding_dim})")
+                embedding_dim = encoder.dim
+            if model_version is None:
+                variant = "".join(
+                    f":{v}" for v in (encoder.quantize, encoder.backend if encoder.backend != "torch" else None) if v
+                )
+                model_version = f"{os.path.basename(os.path.normpath(model_path))}:{embedding_dim}:{chunk_size}{variant}"
+        else:
+            print(f"Loading TF-IDF vectorizer: {model_name}")
+            # Initialize TF-IDF vectorizer with a max features limit
+            vectorizer = TfidfVectorizer(
+                max_features=embedding_dim,
+                lowercase=True,
+                ngram_range=(1, 2),
+                min_df=1,
+                max_df=0.95
+            )
+
+        with self._model_lock.switching():
+            previous = self.encoder
+            self.model_path = model_path
+            self.model_name = model_name
+            self.embedding_dim = embedding_dim
+            self.chunk_size = chunk_size
+            # TF-IDF vectors are mostly zeros; sparse=True stores them as pgvector
+            # sparsevec so storage and I/O scale with the non-zero terms. None:
+            # the vector type the model is registered with (see the sparse property)
+            self._sparse = sparse
+            # Identifies the embedding configuration in the index state and the
+            # model registry. Changing it makes `sync` re-embed every document.
+            # A TF-IDF model named by default gets its version from its
+            # vocabulary (see the model_version property)
+            self._model_version = model_version
+            self._base_version = None if model_version else f"{model_name}:{embedding_dim}:{chunk_size}"
+            # sparse storage is a model of its own: "<base>:sparsevec:<hash>"
+            self._version_variant = ":sparsevec" if sparse else ""
+            # content hash of the TF-IDF vocabulary in dgsi_tfidf_vocabularies
+            self._vocab_sha256 = None
+            # (doc vectors, chunks, state) tables, resolved from the registry on first use
+            self._tables = tables
+            # whether the doc vectors table is known to exist (see _ensure_doc_table)
+            self._doc_table_ready = False
+            self.encoder = encoder
+            self.vectorizer = vectorizer
+            self.vectorizer_fitted = encoder is not None
+            # no embedding call is using it now
+            if previous is not None:
+                previous.close()
+
+    @classmethod
+    def from_registry(cls, db_dsn: str, model_version: Optional[str] = None, **kwargs) -> "DocumentRetriever":
+        """Retriever for a registered model (the active one by default)."""
+        retriever = cls(db_dsn=db_dsn, **kwargs)
+        row = retriever._registry_row(model_version)
+        if row is not None:
+            retriever._configure_from_row(row)
+        elif model_version is not None:
+            raise ValueError(f"Model {model_version!r} is not registered")
+        return retriever
+
     def get_connection(self):
         if psycopg is None:
             raise RuntimeError("psycopg is not installed!")
         return psycopg.connect(self.db_dsn)
     
+    REGISTRY_COLUMNS = "model_version, model_name, embedding_dim, chunk_size, vector_type, doc_table, chunk_table, state_table, model_path"
+
+    def _registry_row(self, model_version: Optional[str] = None):
+        """Registry row of model_version, or of the active model when None."""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass('dgsi_embedding_models') IS NOT NULL;")
+                if not cur.fetchone()[0]:
+                    return None
+                if model_version is None:
+                    cur.execute(f"SELECT {self.REGISTRY_COLUMNS} FROM dgsi_embedding_models WHERE is_active;")
+                else:
+                    cur.execute(
+                        f"SELECT {self.REGISTRY_COLUMNS} FROM dgsi_embedding_models WHERE model_version = %s;",
+                        (model_version,)
+                    )
+                return cur.fetchone()
+        finally:
+            conn.close()
+
+    def _configure_from_row(self, row):
+        model_version, model_name, embedding_dim, chunk_size, vector_type, doc_table, chunk_table, state_table, model_path = row
+        self._configure(
+            model_name, embedding_dim, chunk_size, vector_type == "sparsevec", model_version, model_path,
+            self._registered_tables(doc_table, chunk_table, state_table),
+        )
+
+    def _maybe_follow_active(self):
+        if not self.follow_active:
+            return
+        now = time.monotonic()
+        if now - self._active_checked_at < self.active_check_interval:
+            return
+        # another thread is checking or loading the new model; keep serving the current one
+        if not self._follow_lock.acquire(blocking=False):
+            return
+        try:
+            self._active_checked_at = now
+            row = self._registry_row()
+            if row is not None and row[0] != self.model_version:
+                print(f"Active embedding model changed: {self.model_version} -> {row[0]}")
+                self._configure_from_row(row)
+                self.clear_query_cache()
+        finally:
+            self._follow_lock.release()
+
+    @staticmethod
+    def model_tables(model_version: str) -> Tuple[str, str, str]:
+        """Per-model (doc vectors, chunks, state) table names."""
+        slug = re.sub(r"[^a-z0-9]+", "_", model_version.lower()).strip("_")[:24]
+        digest = hashlib.sha256(model_version.encode("utf-8")).hexdigest()[:6]
+        base = f"dgsi_{slug}_{digest}"
+        return f"{base}_docs", f"{base}_chunks", f"{base}_state"
+
+    @staticmethod
+    def _registered_tables(doc_table: str, chunk_table: str, state_table: str) -> Tuple[str, str, str]:
+        """Tables of a registry row; rows written before the vectors left
+        dgsi_documents (still doc_table = 'dgsi_documents' until setup runs)
+        get LEGACY_TABLES[0]."""
+        if doc_table == "dgsi_documents":
+            doc_table = LEGACY_TABLES[0]
+        return doc_table, chunk_table, state_table
+
+    def _lookup_tables(self, cur) -> Tuple[Tuple[str, str, str], bool]:
+        """(tables, registered) for this model.
+
+        An unregistered model gets the legacy tables only while no other
+        model owns them. Unless sparse was passed, the vector type is taken
+        from the registry row here too.
+        """
+        cur.execute("SELECT to_regclass('dgsi_embedding_models') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            if self._sparse is None:
+                self._sparse = False
+            return LEGACY_TABLES, False
+        # a TF-IDF model registered before its vocabulary was saved is still
+        # under its base version (see _adopt_pre_vocabulary_model)
+        cur.execute("""
+            SELECT doc_table, chunk_table, state_table, vector_type FROM dgsi_embedding_models
+            WHERE model_version = ANY(%s) ORDER BY model_version = %s DESC LIMIT 1;
+        """, ([self.model_version, self._pre_vocabulary_version], self.model_version))
+        row = cur.fetchone()
+        if self._sparse is None:
+            self._sparse = row is not None and row[3] == "sparsevec"
+        if row is not None:
+            return self._registered_tables(*row[:3]), True
+        cur.execute("SELECT 1 FROM dgsi_embedding_models WHERE chunk_table = %s;", (LEGACY_TABLES[1],))
+        if cur.fetchone() is None:
+            return LEGACY_TABLES, False
+        return self.model_tables(self.model_version), False
+
+    def _resolve_tables(self) -> Tuple[str, str, str]:
+        if self._tables is None or self._sparse is None:
+            conn = self.get_connection()
+            try:
+                with conn.cursor() as cur:
+                    self._tables = self._lookup_tables(cur)[0]
+            finally:
+                conn.close()
+        return self._tables
+
+    @property
+    def model_version(self) -> str:
+        """Version of this embedding configuration; for a TF-IDF model named by
+        default, "tfidf:<dim>:<chunk_size>:<vocabulary hash>" (see _load_vectorizer)."""
+        if self._model_version is None:
+            self._load_vectorizer()
+        return self._model_version
+
+    @property
+    def sparse(self) -> bool:
+        """Whether vectors are sparsevec: as passed, else as registered (dense when unregistered)."""
+        if self._sparse is None:
+            self._resolve_tables()
+        return self._sparse
+
+    @property
+    def vector_type(self) -> str:
+        return "sparsevec" if self.sparse else "vector"
+
+    @property
+    def doc_table(self) -> str:
+        return self._resolve_tables()[0]
+
+    @property
+    def chunk_table(self) -> str:
+        return self._resolve_tables()[1]
+
+    @property
+    def state_table(self) -> str:
+        return self._resolve_tables()[2]
+
+    @classmethod
+    def dedup_tables_for(cls, chunk_table: str) -> Tuple[str, str]:
+        """(unique chunk vectors, document -> chunk map) tables of a chunk table."""
+        prefix = cls._index_prefix(chunk_table)
+        return f"{prefix}_unique", f"{prefix}_doc_map"
+
+    @property
+    def dedup_tables(self) -> Tuple[str, str]:
+        return self.dedup_tables_for(self.chunk_table)
+
+    @staticmethod
+    def _index_prefix(table: str) -> str:
+        return {"dgsi_document_chunks": "dgsi_chunks"}.get(table, table)
+
+    def _doc_key(self, cur) -> str:
+        """Primary key columns of the document vectors table (source too when partitioned)."""
+        self._ensure_doc_table(cur)
+        return "id, source" if db_is_partitioned(cur, self.doc_table) else "id"
+
+    def _doc_vector_sql(self, cur) -> str:
+        """Statement storing one document vector; params (embedding, doc_id).
+
+        Vectors live in a narrow per-model table, so indexing never writes a
+        new version of the wide dgsi_documents row.
+        """
+        return f"""
+            INSERT INTO {self.doc_table} (id, source, decision_class, embedding)
+            SELECT id, source, decision_class, %s::{self.vector_type} FROM dgsi_documents WHERE id = %s
+            ON CONFLICT ({self._doc_key(cur)}) DO UPDATE SET embedding = EXCLUDED.embedding;
+        """
+
+    @staticmethod
+    def _create_doc_table(cur, table: str, column_type: str):
+        """Document vectors table, partitioned by source like dgsi_documents."""
+        partitioned = db_is_partitioned(cur)
+        if partitioned:
+            key, partition_by = "PRIMARY KEY (id, source)", "PARTITION BY LIST (source)"
+        else:
+            key, partition_by = "PRIMARY KEY (id)", ""
+        # the columns retrieval filters on, next to the vector
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id BIGINT NOT NULL,
+                source TEXT{" NOT NULL" if partitioned else ""},
+                decision_class TEXT,
+                embedding {column_type},
+                {key},
+                {db_document_fk(cur, "id")}
+            ) {partition_by};
+        """)
+        if db_is_partitioned(cur, table):
+            sources = [source for source in db_source_partitions(cur) if source is not None]
+            db_ensure_source_partitions(cur, table, sources)
+
+    def _ensure_doc_table(self, cur):
+        """Create the document vectors table before the first write to it.
+
+        Databases set up before the vectors left dgsi_documents have no such
+        table until setup runs again; the inline vectors are moved to it then
+        too. Runs in the caller's transaction.
+        """
+        if self._doc_table_ready:
+            return
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (self.doc_table,))
+        if not cur.fetchone()[0]:
+            cur.execute("SELECT to_regclass('dgsi_embedding_models') IS NOT NULL;")
+            if cur.fetchone()[0]:
+                # as in _ensure_registry: one migration at a time
+                cur.execute("LOCK TABLE dgsi_embedding_models IN SHARE ROW EXCLUSIVE MODE;")
+            if self.doc_table == LEGACY_TABLES[0]:
+                self._migrate_inline_doc_vectors(cur)
+            self._create_doc_table(cur, self.doc_table, f"{self.vector_type}({self.embedding_dim})")
+            # ready once the caller commits; checked again on the next write
+            return
+        self._doc_table_ready = True
+
+    def _migrate_inline_doc_vectors(self, cur):
+        """Move document vectors kept in dgsi_documents.embedding to LEGACY_TABLES[0].
+
+        Older databases stored the legacy model's vectors inline, so every
+        indexing pass rewrote the wide document rows. The column is dropped
+        afterwards (a catalog change; its space is reclaimed as rows are
+        rewritten or by VACUUM FULL), and with it its ANN index.
+        """
+        cur.execute(
+            "UPDATE dgsi_embedding_models SET doc_table = %s WHERE doc_table = 'dgsi_documents';",
+            (LEGACY_TABLES[0],)
+        )
+        cur.execute("""
+            SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = 'dgsi_documents'::regclass AND attname = 'embedding' AND NOT attisdropped;
+        """)
+        row = cur.fetchone()
+        if row is None:
+            return
+        self._create_doc_table(cur, LEGACY_TABLES[0], row[0])
+        cur.execute(f"""
+            INSERT INTO {LEGACY_TABLES[0]} (id, source, decision_class, embedding)
+            SELECT id, source, decision_class, embedding FROM dgsi_documents
+            WHERE embedding IS NOT NULL
+            ON CONFLICT DO NOTHING;
+        """)
+        moved = cur.rowcount
+        cur.execute("ALTER TABLE dgsi_documents DROP COLUMN embedding;")
+        cur.execute("SELECT to_regclass('dgsi_corpus_stats') IS NOT NULL;")
+        if cur.fetchone()[0]:
+            # indexed_documents is counted on the new table from now on; the
+            # totals carry over, as every moved row was counted already
+            self._ensure_stats(cur)
+        print(f"Moved {moved} document vectors from dgsi_documents.embedding to {LEGACY_TABLES[0]}")
+        print("[WARN] Rebuild the documents ANN index (retriever.py --action build-index --index-target documents)")
+
+    def _ensure_registry(self, cur):
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS dgsi_embedding_models (
+                model_version TEXT PRIMARY KEY,
+                model_name TEXT NOT NULL,
+                embedding_dim INTEGER NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                vector_type TEXT NOT NULL,
+                doc_table TEXT NOT NULL,
+                chunk_table TEXT NOT NULL,
+                state_table TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'building',
+                is_active BOOLEAN NOT NULL DEFAULT false,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                activated_at TIMESTAMPTZ
+            );
+        """)
+        # local model directory of sentence-transformers models
+        cur.execute("ALTER TABLE dgsi_embedding_models ADD COLUMN IF NOT EXISTS model_path TEXT;")
+        # bumped by every write that changes search results; part of the result cache key
+        cur.execute("ALTER TABLE dgsi_embedding_models ADD COLUMN IF NOT EXISTS index_version BIGINT NOT NULL DEFAULT 0;")
+        # TF-IDF vocabulary in dgsi_tfidf_vocabularies
+        cur.execute("ALTER TABLE dgsi_embedding_models ADD COLUMN IF NOT EXISTS vocab_sha256 TEXT;")
+        # at most one active model
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS dgsi_embedding_models_active_idx
+            ON dgsi_embedding_models (is_active) WHERE is_active;
+        """)
+        # serialize registrations so two models can't both claim the legacy tables
+        cur.execute("LOCK TABLE dgsi_embedding_models IN SHARE ROW EXCLUSIVE MODE;")
+        self._migrate_inline_doc_vectors(cur)
+        self._adopt_pre_vocabulary_model(cur)
+        tables, registered = self._lookup_tables(cur)
+        if not registered:
+            legacy = tables == LEGACY_TABLES
+            cur.execute("SELECT NOT EXISTS (SELECT 1 FROM dgsi_embedding_models WHERE is_active);")
+            activate = legacy and cur.fetchone()[0]
+            cur.execute(f"""
+                INSERT INTO dgsi_embedding_models ({self.REGISTRY_COLUMNS}, status, is_active, activated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CASE WHEN %s THEN now() END);
+            """, (
+                self.model_version, self.model_name, self.embedding_dim, self.chunk_size, self.vector_type,
+                *tables, self.model_path,
+                # the legacy tables already hold whatever was indexed before the registry
+                "ready" if legacy else "building",
+                activate, activate,
+            ))
+            print(f"Registered embedding model {self.model_version} (tables: {', '.join(tables)})")
+        else:
+            # sparse was passed and differs: converting the tables in place
+            # would change the vectors the model serves under the same version
+            cur.execute("SELECT vector_type, is_active FROM dgsi_embedding_models WHERE model_version = %s;", (self.model_version,))
+            vector_type, active = cur.fetchone()
+            if vector_type != self.vector_type:
+                raise ValueError(
+                    f"{'Active' if active else 'Registered'} model {self.model_version} is registered as {vector_type}; "
+                    f"build {self.vector_type} vectors as another model version (shadow-reindex)"
+                )
+        if self._vocab_sha256 is not None:
+            cur.execute(
+                "UPDATE dgsi_embedding_models SET vocab_sha256 = %s WHERE model_version = %s AND vocab_sha256 IS NULL;",
+                (self._vocab_sha256, self.model_version)
+            )
+        self._tables = tables
+        return registered
+
+    @property
+    def _pre_vocabulary_version(self) -> Optional[str]:
+        """Version this model was registered under before vocabularies were saved."""
+        return None if self._version_variant else self._base_version
+
+    def _adopt_pre_vocabulary_model(self, cur):
+        """Move a TF-IDF model registered before vocabularies were saved to its hashed version.
+
+        Its vectors came from a vocabulary fitted in some other process; the
+        state rows keep the old version, so sync re-embeds them all with the
+        saved one. The tables stay the same.
+        """
+        if self._pre_vocabulary_version is None:
+            return
+        cur.execute("""
+            UPDATE dgsi_embedding_models SET model_version = %s, vocab_sha256 = %s
+            WHERE model_version = %s AND vocab_sha256 IS NULL
+              AND NOT EXISTS (SELECT 1 FROM dgsi_embedding_models WHERE model_version = %s);
+        """, (self.model_version, self._vocab_sha256, self._base_version, self.model_version))
+        if cur.rowcount:
+            print(f"[WARN] {self._base_version} had no saved TF-IDF vocabulary; registered as {self.model_version}, "
+                  "run sync to re-embed its documents")
+
+    @staticmethod
+    def _require_pgvector(cur, feature: str):
+        """Raise unless the installed pgvector has sparsevec / halfvec (PGVECTOR_TYPES_VERSION)."""
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector';")
+        row = cur.fetchone()
+        installed = row[0] if row else "not installed"
+        if tuple(int(part) for part in re.findall(r"\d+", installed)[:3]) < PGVECTOR_TYPES_VERSION:
+            raise RuntimeError(
+                f"{feature} needs pgvector >= {'.'.join(map(str, PGVECTOR_TYPES_VERSION))} (installed: {installed})"
+            )
+
+    def _ensure_embedding_type(self, cur, table: str):
+        """Convert an existing embedding column between vector and sparsevec.
+
+        Only for tables that held vectors before this model was registered (the
+        legacy tables); a registered model's vector type never changes in place.
+        """
+        cur.execute("""
+            SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attname = 'embedding' AND NOT attisdropped;
+        """, (table,))
+        row = cur.fetchone()
+        wanted = f"{self.vector_type}({self.embedding_dim})"
+        if row is None or row[0] == wanted:
+            return
+        self._require_pgvector(cur, f"converting {table}.embedding to {wanted}")
+        # ANN indexes use type-specific operator classes; rebuild them afterwards
+        cur.execute("""
+            SELECT indexrelid::regclass::text FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indrelid = %s::regclass AND a.attname = 'embedding';
+        """, (table,))
+        for (index_name,) in cur.fetchall():
+            cur.execute(f"DROP INDEX IF EXISTS {index_name};")
+        cur.execute(f"ALTER TABLE {table} ALTER COLUMN embedding TYPE {wanted} USING embedding::{wanted};")
+        print(f"Converted {table}.embedding from {row[0]} to {wanted}; rebuild indexes with build-index")
+
     def ensure_vector_schema(self):
+        # a TF-IDF model's version comes from its vocabulary; load or fit it
+        # before the registry is locked below
+        if self.vectorizer is not None and not self.vectorizer_fitted:
+            self._load_vectorizer()
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+                registered = self._ensure_registry(cur)
+                if self.sparse:
+                    self._require_pgvector(cur, "sparsevec storage")
+                doc_table, chunk_table, state_table = self._tables
+                chunk_prefix = self._index_prefix(chunk_table)
+                partitioned = db_is_partitioned(cur)
+
+                # per-model document vectors; dgsi_documents itself is never
+                # written by indexing
+                self._create_doc_table(cur, doc_table, f"{self.vector_type}({self.embedding_dim})")
+
+                # ANN indexes are built after loading with build_vector_indexes(),
+                # so IVF centroids are trained on real data.
+
+                # chunks table for chunk retrieval; partitioned by source like
+                # dgsi_documents, so keys carry the source and every source
+                # gets its own heap and indexes
+                if partitioned:
+                    keys, partition_by = "PRIMARY KEY (id, source), UNIQUE (doc_id, chunk_index, source)", "PARTITION BY LIST (source)"
+                else:
+                    keys, partition_by = "PRIMARY KEY (id), UNIQUE (doc_id, chunk_index)", ""
                 cur.execute(f"""
-                    DO $$
-                    BEGIN
-                        IF NOT EXISTS (
-                            SELECT 1 FROM information_schema.columns 
-                            WHERE table_name = 'dgsi_documents' 
-                            AND column_name = 'embedding'
-                        ) THEN
-                            ALTER TABLE dgsi_documents 
-                            ADD COLUMN embedding vector({self.embedding_dim});
-                        END IF;
-                    END $$;
-                """)
-                
-                #index for fast similarity search (using cosine distance)
-                cur.execute("""
-                    CREATE INDEX IF NOT EXISTS dgsi_documents_embedding_idx 
-                    ON dgsi_documents 
-                    USING ivfflat (embedding vector_cosine_ops)
-                    WITH (lists = 100);
-                """)
-                
-                # chunks table for chunk retrieval
-                cur.execute(f"""
-                    CREATE TABLE IF NOT EXISTS dgsi_document_chunks (
-                        id SERIAL PRIMARY KEY,
-                        doc_id INTEGER NOT NULL REFERENCES dgsi_documents(id) ON DELETE CASCADE,
+                    CREATE TABLE IF NOT EXISTS {chunk_table} (
+                        id SERIAL,
+                        doc_id INTEGER NOT NULL,
                         chunk_index INTEGER NOT NULL,
                         chunk_text TEXT NOT NULL,
-                        embedding vector({self.embedding_dim}),
-                        UNIQUE(doc_id, chunk_index)
-                    );
+                        embedding {self.vector_type}({self.embedding_dim}),
+                        source TEXT{" NOT NULL" if partitioned else ""},
+                        {keys},
+                        {db_document_fk(cur, "doc_id")}
+                    ) {partition_by};
                 """)
-                
-                # index for chunk embeddings
-                cur.execute("""
-                    CREATE INDEX IF NOT EXISTS dgsi_chunks_embedding_idx 
-                    ON dgsi_document_chunks 
-                    USING ivfflat (embedding vector_cosine_ops)
-                    WITH (lists = 100);
+                if db_is_partitioned(cur, chunk_table):
+                    sources = [source for source in db_source_partitions(cur) if source is not None]
+                    db_ensure_source_partitions(cur, chunk_table, sources)
+                if not registered:
+                    for table, _ in self.vector_indexes().values():
+                        self._ensure_embedding_type(cur, table)
+
+                # chunks are (start_offset, end_offset) spans into text_plain
+                cur.execute(f"ALTER TABLE {chunk_table} ADD COLUMN IF NOT EXISTS start_offset INTEGER;")
+                cur.execute(f"ALTER TABLE {chunk_table} ADD COLUMN IF NOT EXISTS end_offset INTEGER;")
+                cur.execute(f"ALTER TABLE {chunk_table} ALTER COLUMN chunk_text DROP NOT NULL;")
+
+                # lexical side of retrieve_hybrid: tsvector written by the indexer
+                cur.execute(f"ALTER TABLE {chunk_table} ADD COLUMN IF NOT EXISTS text_tsv tsvector;")
+                cur.execute(f"""
+                    CREATE INDEX IF NOT EXISTS {db_index_name(f"{chunk_prefix}_text_tsv_idx")}
+                    ON {chunk_table} USING GIN (text_tsv);
                 """)
-                
+
+                # canonical decision class (filled by load_decision_classes)
+                cur.execute("ALTER TABLE dgsi_documents ADD COLUMN IF NOT EXISTS decision_class TEXT;")
+                cur.execute(f"ALTER TABLE {chunk_table} ADD COLUMN IF NOT EXISTS decision_class TEXT;")
+                for table in dict.fromkeys(("dgsi_documents", doc_table, chunk_table)):
+                    cur.execute(f"""
+                        CREATE INDEX IF NOT EXISTS {db_index_name(f"{self._index_prefix(table)}_decision_class_idx")}
+                        ON {table}(decision_class);
+                    """)
+
                 # index for doc_id lookups
+                cur.execute(f"""
+                    CREATE INDEX IF NOT EXISTS {db_index_name(f"{chunk_prefix}_doc_id_idx")}
+                    ON {chunk_table}(doc_id);
+                """)
+
+                # chunks carry their document's source so stats need no join
                 cur.execute("""
-                    CREATE INDEX IF NOT EXISTS dgsi_chunks_doc_id_idx 
-                    ON dgsi_document_chunks(doc_id);
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = %s AND column_name = 'source';
+                """, (chunk_table,))
+                if cur.fetchone() is None:
+                    cur.execute(f"ALTER TABLE {chunk_table} ADD COLUMN source TEXT;")
+                    cur.execute(f"""
+                        UPDATE {chunk_table} c SET source = d.source
+                        FROM dgsi_documents d WHERE c.doc_id = d.id;
+                    """)
+
+                # text hash + model version used for each document's embedding and chunks
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {state_table} (
+                        doc_id BIGINT PRIMARY KEY,
+                        source TEXT,
+                        doc_sha256 TEXT,
+                        doc_model_version TEXT,
+                        doc_indexed_at TIMESTAMPTZ,
+                        chunks_sha256 TEXT,
+                        chunks_model_version TEXT,
+                        chunks_indexed_at TIMESTAMPTZ,
+                        {db_document_fk(cur, "doc_id")}
+                    );
                 """)
-                
+                cur.execute(f"ALTER TABLE {state_table} ADD COLUMN IF NOT EXISTS source TEXT;")
+
+                # dgsi_corpus_stats tracks the corpus and the legacy tables
+                if chunk_table == LEGACY_TABLES[1]:
+                    self._ensure_stats(cur)
+
             conn.commit()
-            print("Vector schema initialized successfully (including chunks table)")
+            print(f"Vector schema initialized successfully for {self.model_version} (including chunks table)")
         finally:
             conn.close()
-    
-    def _chunk_text(self, text: str, max_length: int = 512) -> List[str]:
-        # Simple chunking by sentences/paragraphs
-        words = text.split()
-        chunks = []
-        current_chunk = []
-        current_length = 0
-        
-        for word in words:
-            word_len = len(word) + 1
-            if current_length + word_len > max_length and current_chunk:
-                chunks.append(" ".join(current_chunk))
-                current_chunk = [word]
-                current_length = word_len
-            else:
-                current_chunk.append(word)
-                current_length += word_len
-        
-        if current_chunk:
-            chunks.append(" ".join(current_chunk))
-        
-        return chunks if chunks else [text[:max_length]]
-    
-    def _fit_vectorizer_on_corpus(self):
-        """Fit TF-IDF vectorizer on all documents in the database."""
-        if self.vectorizer_fitted:
-            return
-        
+
+    def list_models(self) -> List[dict]:
+        """Registered embedding models, with the planner's row estimate of their chunk tables."""
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
-                cur.execute("SELECT text_plain FROM dgsi_documents WHERE text_plain IS NOT NULL LIMIT 5000;")
-                docs = cur.fetchall()
-                if docs:
-                    texts = [doc[0][:self.chunk_size * 3] for doc in docs]
-                    self.vectorizer.fit(texts)
-                    print(f"Vectorizer fitted on {len(texts)} documents")
-                else:
-                    print("Warning: No documents found to fit vectorizer, fitting on empty")
-                    self.vectorizer.fit([""])
-            self.vectorizer_fitted = True
+                cur.execute(f"""
+                    SELECT {self.REGISTRY_COLUMNS}, status, is_active, created_at, activated_at,
+                           COALESCE(
+                               (SELECT SUM(GREATEST(c.reltuples, 0))::bigint
+                                FROM pg_partition_tree(to_regclass(chunk_table)) t
+                                JOIN pg_class c ON c.oid = t.relid WHERE t.isleaf),
+                               (SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(chunk_table))
+                           )
+                    FROM dgsi_embedding_models
+                    ORDER BY created_at;
+                """)
+                names = self.REGISTRY_COLUMNS.split(", ") + [
+                    "status", "is_active", "created_at", "activated_at", "approx_chunks"
+                ]
+                return [dict(zip(names, row)) for row in cur.fetchall()]
         finally:
             conn.close()
-    
-    def generate_embedding(self, text: str, use_chunking: bool = True) -> np.ndarray:
-        if not text or not text.strip():
-            return np.zeros(self.embedding_dim, dtype=np.float32)
-        
-        # Ensure vectorizer is fitted
-        if not self.vectorizer_fitted:
-            self._fit_vectorizer_on_corpus()
-        
-        # Transform text to sparse TF-IDF vector
-        sparse_vec = self.vectorizer.transform([text[:self.chunk_size * 3]])
-        # Convert to dense array
-        dense_vec = sparse_vec.toarray()[0].astype(np.float32)
-        
-        # Pad or truncate to embedding_dim
-        if len(dense_vec) < self.embedding_dim:
-            dense_vec = np.pad(dense_vec, (0, self.embedding_dim - len(dense_vec)), mode='constant')
-        else:
-            dense_vec = dense_vec[:self.embedding_dim]
-        
-        return dense_vec
-    
-    def index_document(self, doc_id: int, text: str) -> bool:
-        embedding = self.generate_embedding(text)
+
+    def set_model_status(self, status: str, model_version: Optional[str] = None):
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute(
-                    "UPDATE dgsi_documents SET embedding = %s WHERE id = %s;",
-                    (embedding.tolist(), doc_id)
+                    "UPDATE dgsi_embedding_models SET status = %s WHERE model_version = %s;",
+                    (status, model_version or self.model_version)
                 )
             conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error indexing document {doc_id}: {e}")
-            return False
         finally:
             conn.close()
-    
-    def index_document_chunks(self, doc_id: int, text: str) -> bool:
-        if not text or not text.strip():
-            return False
-        
-        chunks = self._chunk_text(text, self.chunk_size)
+
+    def activate_model(self, model_version: Optional[str] = None, force: bool = False):
+        """Make a model the one serving retrieval.
+
+        The switch is one transaction on dgsi_embedding_models, so readers see
+        either the old or the new model. Retrievers created with
+        follow_active=True pick it up on their next check.
+        """
+        model_version = model_version or self.model_version
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
-                # Delete existing chunks for this document
-                cur.execute("DELETE FROM dgsi_document_chunks WHERE doc_id = %s;", (doc_id,))
-                
-                # Insert new chunks with TF-IDF embeddings
-                for i, chunk in enumerate(chunks):
-                    embedding = self.generate_embedding(chunk, use_chunking=False)
-                    cur.execute(
-                        """INSERT INTO dgsi_document_chunks 
-                           (doc_id, chunk_index, chunk_text, embedding) 
-                           VALUES (%s, %s, %s, %s);""",
-                        (doc_id, i, chunk, embedding.tolist())
-                    )
+                cur.execute(
+                    "SELECT status FROM dgsi_embedding_models WHERE model_version = %s FOR UPDATE;",
+                    (model_version,)
+                )
+                row = cur.fetchone()
+                if row is None:
+                    raise ValueError(f"Model {model_version!r} is not registered")
+                if row[0] != "ready" and not force:
+                    raise ValueError(f"Model {model_version!r} is {row[0]}, not ready")
+                # two statements: the unique index on is_active is checked row by row
+                cur.execute("UPDATE dgsi_embedding_models SET is_active = false WHERE is_active;")
+                cur.execute("""
+                    UPDATE dgsi_embedding_models
+                    SET is_active = true, status = 'ready', activated_at = now()
+                    WHERE model_version = %s;
+                """, (model_version,))
             conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error indexing document chunks {doc_id}: {e}")
-            return False
+            print(f"Active embedding model: {model_version}")
         finally:
             conn.close()
-    
-    def index_all_documents(self, batch_size: int = 100, limit: Optional[int] = None):
+
+    def retire_model(self, model_version: str, drop_tables: bool = False):
+        """Unregister an inactive model and optionally drop its tables (never the legacy ones)."""
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
-                query = "SELECT id, text_plain FROM dgsi_documents WHERE embedding IS NULL"
-                if limit:
-                    query += f" LIMIT {limit}"
-                cur.execute(query)
-                docs = cur.fetchall()
-            
-            total = len(docs)
-            print(f"Found {total} documents to index")
-        
-            for i in range(0, total, batch_size):
-                batch = docs[i:i + batch_size]
-                print(f"Processing batch {i // batch_size + 1}/{(total + batch_size - 1) // batch_size}")
-                texts = [doc[1] for doc in batch]
-                doc_ids = [doc[0] for doc in batch]
-                embeddings = []
-                for text in texts:
-                    emb = self.generate_embedding(text)
-                    embeddings.append(emb.tolist())
-                
+                cur.execute("""
+                    DELETE FROM dgsi_embedding_models
+                    WHERE model_version = %s AND NOT is_active
+                    RETURNING doc_table, chunk_table, state_table;
+                """, (model_version,))
+                row = cur.fetchone()
+                if row is None:
+                    raise ValueError(f"Model {model_version!r} is active or not registered")
+                row = self._registered_tables(*row)
+                if drop_tables and row != LEGACY_TABLES:
+                    for table in (*self.dedup_tables_for(row[1]), *row):
+                        cur.execute(f"DROP TABLE IF EXISTS {table};")
+            conn.commit()
+            print(f"Retired embedding model {model_version}")
+        finally:
+            conn.close()
+
+    def shadow_reindex(
+        self,
+        batch_size: int = 100,
+        limit: Optional[int] = None,
+        index_method: Optional[str] = "ivfflat",
+        activate: bool = False,
+        **index_kwargs,
+    ) -> dict:
+        """Index every document for this model in its own tables.
+
+        The active model keeps serving meanwhile. This model is marked ready
+        once its vectors and ANN indexes are built, and only starts serving
+        through activate_model() (or activate=True).
+        """
+        self.ensure_vector_schema()
+        if self.chunk_table == LEGACY_TABLES[1]:
+            raise RuntimeError(
+                f"{self.model_version} owns the legacy tables; use sync to re-embed it in place"
+            )
+        self.set_model_status("building")
+        start = time.perf_counter()
+        self.index_all_documents(batch_size=batch_size, limit=limit)
+        self.index_all_documents_chunks(batch_size=batch_size, limit=limit)
+        built = {}
+        if index_method:
+            built = self.build_vector_indexes(method=index_method, **index_kwargs)
+        self.set_model_status("ready")
+        if activate:
+            self.activate_model()
+        return {"model_version": self.model_version, "seconds": time.perf_counter() - start, "indexes": built}
+
+    # Counters kept in dgsi_corpus_stats per (source, decision_class), with
+    # the expression each row of the table contributes.
+    STATS_COUNTERS = {
+        "dgsi_documents": {
+            "documents": "1",
+        },
+        "dgsi_document_vectors": {
+            "indexed_documents": "(embedding IS NOT NULL)::int",
+        },
+        "dgsi_document_chunks": {
+            "chunks": "1",
+            "indexed_chunks": "(embedding IS NOT NULL)::int",
+            # every chunked document has exactly one chunk 0
+            "docs_with_chunks": "(chunk_index = 0)::int",
+        },
+    }
+
+    @staticmethod
+    def _stats_upsert_sql(counters: dict, rows_sql: str) -> str:
+        sums = [f"SUM(sign * {expr})" for expr in counters.values()]
+        return f"""
+            INSERT INTO dgsi_corpus_stats AS s (source, decision_class, {", ".join(counters)})
+            SELECT COALESCE(source, ''), COALESCE(decision_class, ''), {", ".join(sums)}
+            FROM ({rows_sql}) r
+            GROUP BY 1, 2
+            HAVING {" OR ".join(f"{total} <> 0" for total in sums)}
+            ORDER BY 1, 2
+            ON CONFLICT (source, decision_class) DO UPDATE SET
+                {", ".join(f"{name} = s.{name} + EXCLUDED.{name}" for name in counters)};
+        """
+
+    def _stats_tables(self, cur) -> dict:
+        """STATS_COUNTERS of the tables that exist (the vectors table comes with the legacy model)."""
+        cur.execute("SELECT name FROM unnest(%s::text[]) name WHERE to_regclass(name) IS NOT NULL;", (list(self.STATS_COUNTERS),))
+        existing = {row[0] for row in cur.fetchall()}
+        return {table: counters for table, counters in self.STATS_COUNTERS.items() if table in existing}
+
+    def _ensure_stats(self, cur):
+        """Create dgsi_corpus_stats and the statement-level triggers that maintain it.
+
+        The triggers aggregate each statement's transition tables, so a bulk
+        UPDATE costs one upsert per (source, class) group, not one per row.
+        TRUNCATE is not tracked; run refresh_stats() after one.
+        """
+        cur.execute("SELECT to_regclass('dgsi_corpus_stats') IS NULL;")
+        created = cur.fetchone()[0]
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS dgsi_corpus_stats (
+                source TEXT NOT NULL,
+                decision_class TEXT NOT NULL DEFAULT '',
+                documents BIGINT NOT NULL DEFAULT 0,
+                indexed_documents BIGINT NOT NULL DEFAULT 0,
+                chunks BIGINT NOT NULL DEFAULT 0,
+                indexed_chunks BIGINT NOT NULL DEFAULT 0,
+                docs_with_chunks BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (source, decision_class)
+            );
+        """)
+        for table, counters in self._stats_tables(cur).items():
+            function = f"{table}_stats_fn"
+            cur.execute(f"""
+                CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $fn$
+                BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        {self._stats_upsert_sql(counters, "SELECT *, 1 AS sign FROM new_rows")}
+                    ELSIF TG_OP = 'DELETE' THEN
+                        {self._stats_upsert_sql(counters, "SELECT *, -1 AS sign FROM old_rows")}
+                    ELSE
+                        {self._stats_upsert_sql(counters, "SELECT *, 1 AS sign FROM new_rows UNION ALL SELECT *, -1 FROM old_rows")}
+                    END IF;
+                    RETURN NULL;
+                END
+                $fn$;
+            """)
+            for op, referencing in (
+                ("INSERT", "NEW TABLE AS new_rows"),
+                ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                ("DELETE", "OLD TABLE AS old_rows"),
+            ):
+                cur.execute(f"""
+                    CREATE OR REPLACE TRIGGER {table}_stats_{op.lower()}
+                    AFTER {op} ON {table}
+                    REFERENCING {referencing}
+                    FOR EACH STATEMENT EXECUTE FUNCTION {function}();
+                """)
+        if created:
+            self._refresh_stats(cur)
+
+    def _refresh_stats(self, cur, source: Optional[str] = None):
+        # SHARE locks block writers, so no trigger delta lands between the recount and the swap
+        tables = self._stats_tables(cur)
+        cur.execute(f"LOCK TABLE {', '.join(tables)} IN SHARE MODE;")
+        if source is None:
+            cur.execute("DELETE FROM dgsi_corpus_stats;")
+            for table, counters in tables.items():
+                cur.execute(self._stats_upsert_sql(counters, f"SELECT *, 1 AS sign FROM {table}"))
+            return
+        cur.execute("DELETE FROM dgsi_corpus_stats WHERE source = %s;", (source,))
+        for table, counters in tables.items():
+            cur.execute(self._stats_upsert_sql(counters, f"SELECT *, 1 AS sign FROM {table} WHERE source = %s"), (source,))
+
+    def refresh_stats(self) -> dict:
+        """Recount dgsi_corpus_stats from scratch (after TRUNCATE or to verify drift)."""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                self._refresh_stats(cur)
+            conn.commit()
+        finally:
+            conn.close()
+        return self.get_document_stats()
+
+    def vector_indexes(self) -> dict:
+        """target -> (table, ANN index name) for this model."""
+        return {
+            target: (table, db_index_name(f"{self._index_prefix(table)}_embedding_idx"))
+            for target, table in (("documents", self.doc_table), ("chunks", self.chunk_table))
+        }
+
+    @staticmethod
+    def ivfflat_lists_for(rows: int) -> int:
+        """pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) above."""
+        if rows <= 1_000_000:
+            return max(1, rows // 1000)
+        return int(math.sqrt(rows))
+
+    def class_index_name(self, decision: str) -> str:
+        slug = re.sub(r"[^a-z0-9]+", "_", decision.lower()).strip("_")
+        return db_index_name(f"{self._index_prefix(self.chunk_table)}_embedding_cls_{slug}_idx")
+
+    def _index_options(self, cur, method: str, table: str, where: str, lists: Optional[int], m: int, ef_construction: int) -> str:
+        if method == "hnsw":
+            return f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+        if lists is None:
+            cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {where};")
+            lists = self.ivfflat_lists_for(int(cur.fetchone()[0]))
+        return f"lists = {int(lists)}"
+
+    def _swap_build_index(
+        self,
+        cur,
+        table: str,
+        index_name: str,
+        method: str,
+        lists: Optional[int],
+        m: int,
+        ef_construction: int,
+        where: Optional[str] = None,
+        key: Optional[str] = None,
+    ) -> str:
+        """Build under a temporary name, then replace the old index in the same transaction.
+
+        On a table partitioned by source each partition gets its own index,
+        with ivfflat lists sized from that partition's rows, attached to an
+        index on the parent. Returns the index options.
+        """
+        where_sql = f"WHERE {where}" if where else ""
+        key = key or f"embedding {self.vector_type}_cosine_ops"
+        rows_where = where or "embedding IS NOT NULL"
+        cur.execute(f"DROP INDEX IF EXISTS {index_name}_new;")
+        if not db_is_partitioned(cur, table):
+            options = self._index_options(cur, method, table, rows_where, lists, m, ef_construction)
+            cur.execute(f"""
+                CREATE INDEX {index_name}_new
+                ON {table}
+                USING {method} ({key})
+                WITH ({options})
+                {where_sql};
+            """)
+        else:
+            cur.execute(f"CREATE INDEX {index_name}_new ON ONLY {table} USING {method} ({key}) {where_sql};")
+            partition_options = []
+            for partition in sorted(set(db_source_partitions(cur, table).values())):
+                part_options = self._index_options(cur, method, partition, rows_where, lists, m, ef_construction)
+                # Postgres names the partition index; find it to attach it
+                cur.execute("SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = %s::regclass;", (partition,))
+                existing = {row[0] for row in cur.fetchall()}
+                cur.execute(f"CREATE INDEX ON {partition} USING {method} ({key}) WITH ({part_options}) {where_sql};")
+                cur.execute("SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = %s::regclass;", (partition,))
+                (part_index,) = {row[0] for row in cur.fetchall()} - existing
+                cur.execute(f"ALTER INDEX {index_name}_new ATTACH PARTITION {part_index};")
+                partition_options.append(f"{partition}: {part_options}")
+            options = "; ".join(partition_options)
+        cur.execute(f"DROP INDEX IF EXISTS {index_name};")
+        cur.execute(f"ALTER INDEX {index_name}_new RENAME TO {index_name};")
+        return options
+
+    def build_vector_indexes(
+        self,
+        method: str = "ivfflat",
+        targets: Tuple[str, ...] = ("documents", "chunks"),
+        lists: Optional[int] = None,
+        m: int = 16,
+        ef_construction: int = 64,
+        maintenance_work_mem: Optional[str] = None,
+        per_class: bool = False,
+    ) -> dict:
+        """(Re)build the ANN indexes on the embedding columns.
+
+        The new index is built under a temporary name and swapped in afterwards,
+        so the old index keeps serving queries while the build runs. With
+        per_class=True, a partial chunk index is also built for every decision
+        class, which makes retrieve_by_class index-backed.
+        """
+        if method not in ("ivfflat", "hnsw"):
+            raise ValueError("method must be one of: ivfflat, hnsw")
+        if self.sparse and method != "hnsw":
+            raise ValueError("sparsevec columns only support hnsw indexes")
+
+        built = {}
+        conn = self.get_connection()
+        try:
+            if maintenance_work_mem:
                 with conn.cursor() as cur:
-                    for doc_id, embedding in zip(doc_ids, embeddings):
-                        cur.execute(
-                            "UPDATE dgsi_documents SET embedding = %s WHERE id = %s;",
-                            (embedding, doc_id)
-                        )
+                    cur.execute("SELECT set_config('maintenance_work_mem', %s, false);", (maintenance_work_mem,))
+
+            for target in targets:
+                table, index_name = self.vector_indexes()[target]
+                start = time.perf_counter()
+                with conn.cursor() as cur:
+                    options = self._swap_build_index(cur, table, index_name, method, lists, m, ef_construction)
                 conn.commit()
-                print(f"Indexed {min(i + batch_size, total)}/{total} documents")
-                
+                self._bump_index_version(conn)
+                elapsed = time.perf_counter() - start
+                built[target] = {"index": index_name, "method": method, "options": options, "seconds": elapsed}
+                print(f"Built {method} index {index_name} ({options}) in {elapsed:.1f}s")
+
+            if per_class:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT DISTINCT decision_class FROM {self.chunk_table}
+                        WHERE decision_class IS NOT NULL AND embedding IS NOT NULL;
+                    """)
+                    classes = [row[0] for row in cur.fetchall()]
+                for decision in classes:
+                    index_name = self.class_index_name(decision)
+                    # Literal predicate so the planner can match it to the query
+                    where = pg_sql.SQL("embedding IS NOT NULL AND decision_class = {}").format(
+                        pg_sql.Literal(decision)
+                    ).as_string(conn)
+                    start = time.perf_counter()
+                    with conn.cursor() as cur:
+                        options = self._swap_build_index(
+                            cur, self.chunk_table, index_name, method, lists, m, ef_construction, where
+                        )
+                    conn.commit()
+                    self._bump_index_version(conn)
+                    elapsed = time.perf_counter() - start
+                    built[f"class:{decision}"] = {"index": index_name, "method": method, "options": options, "seconds": elapsed}
+                    print(f"Built {method} index {index_name} ({options}) in {elapsed:.1f}s")
+            return built
         finally:
             conn.close()
-    
-    def index_all_documents_chunks(self, batch_size: int = 100, limit: Optional[int] = None):
+
+    # Size of a table or index, summed over its partitions when it is
+    # partitioned (the parent stores nothing); NULL when it doesn't exist.
+    RELATION_SIZE_SQL = """
+        SELECT COALESCE(
+            (SELECT SUM({size}(relid)) FROM pg_partition_tree(to_regclass(%(relation)s))),
+            {size}(to_regclass(%(relation)s))
+        )::bigint;
+    """
+
+    def _quantized_sql(self, kind: str, column: str, query_param: str) -> Tuple[str, str, str]:
+        """(indexed expression, operator class, distance to the query) for a quantization."""
+        if self.sparse:
+            raise ValueError("quantized search needs dense vector columns")
+        dim = self.embedding_dim
+        if kind == "halfvec":
+            expr = f"({column}::halfvec({dim}))"
+            return expr, "halfvec_cosine_ops", f"{expr} <=> {query_param}::vector::halfvec({dim})"
+        if kind == "binary":
+            expr = f"(binary_quantize({column})::bit({dim}))"
+            return expr, "bit_hamming_ops", f"{expr} <~> binary_quantize({query_param}::vector)::bit({dim})"
+        raise ValueError(f"quantization must be one of: {', '.join(QUANTIZATIONS)}")
+
+    def quantized_index_name(self, kind: str) -> str:
+        return db_index_name(f"{self._index_prefix(self.chunk_table)}_embedding_{kind}_idx")
+
+    def build_quantized_index(
+        self,
+        kind: str = "binary",
+        method: str = "hnsw",
+        lists: Optional[int] = None,
+        m: int = 16,
+        ef_construction: int = 64,
+        maintenance_work_mem: Optional[str] = None,
+    ) -> dict:
+        """Build an ANN index over a quantized expression of the chunk embeddings.
+
+        Nothing extra is stored in the table: halfvec keeps 2 bytes and binary
+        1 bit per dimension, in the index only. retrieve_chunks_quantized
+        searches this index and re-scores the candidates with the float column.
+        """
+        expr, opclass, _ = self._quantized_sql(kind, "embedding", "")
+        index_name = self.quantized_index_name(kind)
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                self._require_pgvector(cur, f"{kind} quantization")
+                if maintenance_work_mem:
+                    cur.execute("SELECT set_config('maintenance_work_mem', %s, false);", (maintenance_work_mem,))
+                start = time.perf_counter()
+                options = self._swap_build_index(
+                    cur, self.chunk_table, index_name, method, lists, m, ef_construction, key=f"{expr} {opclass}"
+                )
+            conn.commit()
+            self._bump_index_version(conn)
+            elapsed = time.perf_counter() - start
+            print(f"Built {method} index {index_name} ({options}) in {elapsed:.1f}s")
+            return {"index": index_name, "method": method, "options": options, "seconds": elapsed}
+        finally:
+            conn.close()
+
+    def load_decision_classes(self, json_path: str = DEFAULT_DECISION_JSON) -> dict:
+        """Store the canonical decision class of each document on documents and chunks
+        (and the deduplicated layout's document map, when there is one).
+
+        Reads decision_ids_by_class_ALLSOURCES.json once; only rows whose class
+        actually changes are updated.
+        """
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        ids: List[int] = []
+        classes: List[str] = []
+        for cls, items in data["ids_by_class"].items():
+            for item in items:
+                ids.append(int(item["id"]))
+                classes.append(cls)
+
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE dgsi_documents d
+                    SET decision_class = v.cls
+                    FROM unnest(%s::bigint[], %s::text[]) AS v(id, cls)
+                    WHERE d.id = v.id AND d.decision_class IS DISTINCT FROM v.cls;
+                """, (ids, classes))
+                documents_updated = cur.rowcount
+                cur.execute("""
+                    UPDATE dgsi_documents
+                    SET decision_class = NULL
+                    WHERE decision_class IS NOT NULL AND NOT (id = ANY(%s::bigint[]));
+                """, (ids,))
+                documents_updated += cur.rowcount
+                self._ensure_doc_table(cur)
+                cur.execute(f"""
+                    UPDATE {self.doc_table} v
+                    SET decision_class = d.decision_class
+                    FROM dgsi_documents d
+                    WHERE v.id = d.id AND v.decision_class IS DISTINCT FROM d.decision_class;
+                """)
+                cur.execute(f"""
+                    UPDATE {self.chunk_table} c
+                    SET decision_class = d.decision_class
+                    FROM dgsi_documents d
+                    WHERE c.doc_id = d.id AND c.decision_class IS DISTINCT FROM d.decision_class;
+                """)
+                chunks_updated = cur.rowcount
+                # the deduplicated layout filters on its own copy of the class
+                _, map_table = self.dedup_tables
+                cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (map_table,))
+                if cur.fetchone()[0]:
+                    cur.execute(f"""
+                        UPDATE {map_table} m
+                        SET decision_class = d.decision_class
+                        FROM dgsi_documents d
+                        WHERE m.doc_id = d.id AND m.decision_class IS DISTINCT FROM d.decision_class;
+                    """)
+            conn.commit()
+            self._bump_index_version(conn)
+            print(f"Decision classes loaded: {documents_updated} documents, {chunks_updated} chunks updated")
+            return {"documents_updated": documents_updated, "chunks_updated": chunks_updated}
+        finally:
+            conn.close()
+
+    def _search_param_statements(self, probes: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[str, tuple]]:
+        probes = probes if probes is not None else self.probes
+        ef_search = ef_search if ef_search is not None else self.ef_search
+        statements = []
+        if probes is not None:
+            statements.append(("SELECT set_config('ivfflat.probes', %s, true);", (str(int(probes)),)))
+        if ef_search is not None:
+            statements.append(("SELECT set_config('hnsw.ef_search', %s, true);", (str(int(ef_search)),)))
+        return statements
+
+    def _apply_search_params(self, cur, probes: Optional[int] = None, ef_search: Optional[int] = None):
+        """Set ANN search parameters for the current transaction only."""
+        for statement, params in self._search_param_statements(probes, ef_search):
+            cur.execute(statement, params)
+
+    # seconds a planner snapshot of dgsi_corpus_stats and the ANN indexes is reused
+    PLANNER_STATS_TTL = 60.0
+
+    # ANN indexes of a table: (name, method, ivfflat lists); a partitioned
+    # index reports the largest lists of its partitions
+    ANN_INDEXES_SQL = """
+        SELECT c.relname, am.amname, (
+            SELECT MAX(substring(opt FROM '^lists=([0-9]+)$')::int)
+            FROM pg_class l, unnest(l.reloptions) opt
+            WHERE l.oid = c.oid OR l.oid IN (SELECT relid FROM pg_partition_tree(c.oid) WHERE isleaf)
+        )
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE i.indrelid = %s::regclass AND am.amname IN ('ivfflat', 'hnsw');
+    """
+
+    def _planner_snapshot(self) -> Optional[dict]:
+        """Per-(source, class) counts and ANN index metadata, cached for PLANNER_STATS_TTL seconds.
+
+        Counts are indexed chunks for the legacy chunk table (the one
+        dgsi_corpus_stats tracks) and documents for other models, scaled to
+        the chunk table's row estimate. None without dgsi_corpus_stats.
+        """
+        now = time.monotonic()
+        if self._planner_stats_at and now - self._planner_stats_at < self.PLANNER_STATS_TTL:
+            return self._planner_stats
+        legacy = self.chunk_table == LEGACY_TABLES[1]
+        snapshot = None
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass('dgsi_corpus_stats') IS NOT NULL;")
+                if cur.fetchone()[0]:
+                    cur.execute(f"""
+                        SELECT source, decision_class, {"indexed_chunks" if legacy else "documents"}
+                        FROM dgsi_corpus_stats;
+                    """)
+                    counts = {(source, decision or None): int(n) for source, decision, n in cur.fetchall()}
+                    cur.execute(self.ANN_INDEXES_SQL, (self.chunk_table,))
+                    indexes = {name: (method, lists) for name, method, lists in cur.fetchall()}
+                    if legacy:
+                        chunk_rows = sum(counts.values())
+                    else:
+                        cur.execute("""
+                            SELECT COALESCE(
+                                (SELECT SUM(GREATEST(c.reltuples, 0))::bigint
+                                 FROM pg_partition_tree(%(table)s::regclass) t
+                                 JOIN pg_class c ON c.oid = t.relid WHERE t.isleaf),
+                                (SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE oid = %(table)s::regclass)
+                            );
+                        """, {"table": self.chunk_table})
+                        chunk_rows = int(cur.fetchone()[0] or 0)
+                    snapshot = {
+                        "counts": counts,
+                        "chunk_rows": chunk_rows,
+                        "indexes": indexes,
+                        "partitioned": db_is_partitioned(cur, self.chunk_table),
+                    }
+        finally:
+            conn.close()
+        self._planner_stats = snapshot
+        self._planner_stats_at = now
+        return snapshot
+
+    def _plan_filtered(
+        self,
+        top_k: int,
+        filter_source: Optional[str],
+        decision: Optional[str],
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> dict:
+        """Exact scan or ANN search for a chunk search filtered by source and/or class.
+
+        Filters estimated to match at most exact_scan_rows chunks are scanned
+        exactly (index scans off: the filter's btree index or a sequential
+        scan, then a sort). Otherwise the ANN index is used, with probes or
+        ef_search divided by the share of the index's rows passing the filter,
+        so about as many matching candidates are visited as without a filter.
+        """
+        plan = {"plan": "ann", "probes": probes, "ef_search": ef_search}
+        snapshot = self._planner_snapshot() if (filter_source or decision) else None
+        if snapshot is None:
+            return plan
+
+        def count(source: Optional[str] = None, cls: Optional[str] = None) -> int:
+            return sum(
+                n for (s, c), n in snapshot["counts"].items()
+                if (source is None or s == source) and (cls is None or c == cls)
+            )
+
+        total = count()
+        matched = count(filter_source, decision)
+        plan["estimated_rows"] = int(snapshot["chunk_rows"] * matched / total) if total else 0
+
+        # the index the ANN scan reads, and the rows it covers: a per-class
+        # partial index holds one class, a partition one source
+        by_partition = filter_source if snapshot["partitioned"] else None
+        index = self.class_index_name(decision) if decision else None
+        if index in snapshot["indexes"]:
+            scope = count(by_partition, decision)
+        else:
+            index = self.vector_indexes()["chunks"][1]
+            scope = count(by_partition)
+        if plan["estimated_rows"] <= self.exact_scan_rows or index not in snapshot["indexes"]:
+            plan["plan"] = "exact"
+            return plan
+
+        selectivity = matched / scope if scope else 1.0
+        method, lists = snapshot["indexes"][index]
+        plan.update({"index": index, "selectivity": round(selectivity, 6)})
+        if method == "ivfflat":
+            base = probes or self.probes or 1
+            plan["probes"] = max(base, min(lists or math.inf, math.ceil(base / max(selectivity, 1e-6))))
+        else:
+            base = ef_search or self.ef_search or 40
+            # pgvector caps hnsw.ef_search at 1000
+            plan["ef_search"] = max(base, min(1000, math.ceil(base / max(selectivity, 1e-6))))
+        return plan
+
+    def _log_plan(self, method: str, plan: dict, started: float, rows: int):
+        plan["ms"] = round((time.perf_counter() - started) * 1000, 3)
+        plan["rows"] = rows
+        self.last_plan = plan
+        logger.info("%s plan: %s", method, json.dumps(plan))
+
+    def _sample_explain(self) -> bool:
+        return self.explain_sample_rate > 0 and random.random() < self.explain_sample_rate
+
+    def _execute_search(self, cur, method: str, sql, params) -> list:
+        """Run a similarity query, timed as the sql span.
+
+        A sample of calls (explain_sample_rate) is handed to plan_sampler with
+        this transaction's search settings; it runs the query again under
+        EXPLAIN (ANALYZE, BUFFERS) in the background and logs the plan to
+        dgsi_query_plans.
+        """
+        with span("sql"):
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+        if self._sample_explain():
+            cur.execute(query_log.SETTINGS_SQL)
+            settings = cur.fetchone()
+            sql_text = sql if isinstance(sql, str) else sql.as_string(cur)
+            self.plan_sampler.submit(method, self.model_version, sql_text, params, settings, query_log.current_spans())
+        return rows
+
+    def flush_query_plans(self):
+        """Wait for the sampled plans still being captured (see explain_sample_rate)."""
+        self.plan_sampler.flush()
+
+    def query_plan_summary(self, limit: int = 20, since_hours: Optional[float] = None, method: Optional[str] = None) -> List[dict]:
+        """Captured plans (see explain_sample_rate) grouped by statement, slowest p95 first."""
+        conn = self.get_connection()
+        try:
+            return query_log.slowest_plans(conn, limit, since_hours, method)
+        finally:
+            conn.close()
+
+    def _sample_exact_neighbours(self, conn, num_queries: int, top_k: int) -> Tuple[list, List[set]]:
+        """Embeddings of sampled chunk texts, and their exact top_k chunk ids."""
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT {CHUNK_TEXT_SQL}
+                FROM {self.chunk_table} c
+                JOIN dgsi_documents d ON c.doc_id = d.id
+                WHERE c.embedding IS NOT NULL
+                ORDER BY random() LIMIT %s;
+            """, (num_queries,))
+            queries = [row[0] for row in cur.fetchall()]
+        embeddings = [self._vector_param(self.generate_embedding(q, use_chunking=False)) for q in queries]
+
+        exact = []
+        with conn.cursor() as cur:
+            cur.execute(EXACT_SCAN_SQL)
+            for emb in embeddings:
+                cur.execute(f"""
+                    SELECT id FROM {self.chunk_table}
+                    WHERE embedding IS NOT NULL
+                    ORDER BY embedding <=> %s::{self.vector_type} LIMIT %s;
+                """, (emb, top_k))
+                exact.append({row[0] for row in cur.fetchall()})
+        conn.rollback()
+        return embeddings, exact
+
+    def index_method(self, target: str = "chunks") -> Optional[str]:
+        """Method (ivfflat or hnsw) of the target's ANN index; None when it isn't built."""
+        table, index_name = self.vector_indexes()[target]
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+                if not cur.fetchone()[0]:
+                    return None
+                cur.execute(self.ANN_INDEXES_SQL, (table,))
+                return next((method for name, method, _ in cur.fetchall() if name == index_name), None)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def search_params_for(method: Optional[str], probes: Optional[int] = None, ef_search: Optional[int] = None) -> dict:
+        """The search parameters an index method reads (probes for ivfflat, ef_search for hnsw), unset ones left out."""
+        values = {"probes": probes, "ef_search": ef_search}
+        name = SEARCH_PARAMS.get(method)
+        return {name: values[name]} if name and values[name] is not None else {}
+
+    def index_report(
+        self,
+        probes_values: Optional[List[int]] = None,
+        ef_search_values: Optional[List[int]] = None,
+        num_queries: int = 50,
+        top_k: int = 10,
+    ) -> List[dict]:
+        """Recall@k and latency of chunk search for each probes / ef_search value.
+
+        Only the parameter the chunk index reads is varied: probes for an
+        ivfflat index, ef_search for hnsw (INDEX_REPORT_DEFAULTS when no
+        values are given). Queries are sampled chunk texts; the ground truth
+        is an exact scan with index scans disabled.
+        """
+        method = self.index_method("chunks")
+        if method is None:
+            raise ValueError(f"No ANN index on {self.chunk_table}; run build-index first")
+        name = SEARCH_PARAMS[method]
+        values = {"probes": probes_values, "ef_search": ef_search_values}[name] or INDEX_REPORT_DEFAULTS[name]
+
+        conn = self.get_connection()
+        try:
+            embeddings, exact = self._sample_exact_neighbours(conn, num_queries, top_k)
+            sql = f"""
+                SELECT id FROM {self.chunk_table}
+                WHERE embedding IS NOT NULL
+                ORDER BY embedding <=> %s::{self.vector_type} LIMIT %s;
+            """
+
+            configs = [{name: value} for value in values]
+            report = []
+            for config in configs:
+                latencies = []
+                recalls = []
+                for emb, truth in zip(embeddings, exact):
+                    with conn.cursor() as cur:
+                        self._apply_search_params(cur, **config)
+                        start = time.perf_counter()
+                        cur.execute(sql, (emb, top_k))
+                        found = {row[0] for row in cur.fetchall()}
+                        latencies.append((time.perf_counter() - start) * 1000)
+                    conn.rollback()
+                    if truth:
+                        recalls.append(len(found & truth) / len(truth))
+                report.append({
+                    "method": method,
+                    **config,
+                    "queries": len(embeddings),
+                    "recall_at_k": float(np.mean(recalls)) if recalls else 0.0,
+                    "p50_ms": float(np.percentile(latencies, 50)) if latencies else 0.0,
+                    "p95_ms": float(np.percentile(latencies, 95)) if latencies else 0.0,
+                })
+            return report
+        finally:
+            conn.close()
+    
+    def quantization_report(
+        self,
+        kinds: Tuple[str, ...] = QUANTIZATIONS,
+        rerank_factors: Tuple[int, ...] = (1, 4, 10),
+        num_queries: int = 50,
+        top_k: int = 10,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[dict]:
+        """Recall@k, latency and index size of quantized search vs. the float index.
+
+        Uses the indexes built by build_vector_indexes / build_quantized_index;
+        a kind whose index is missing is measured as a sequential scan and
+        reported with index_bytes = None.
+        """
+        if self.sparse:
+            raise ValueError("quantized search needs dense vector columns")
+        conn = self.get_connection()
+        try:
+            embeddings, exact = self._sample_exact_neighbours(conn, num_queries, top_k)
+            with conn.cursor() as cur:
+                cur.execute(self.RELATION_SIZE_SQL.format(size="pg_table_size"), {"relation": self.chunk_table})
+                table_bytes = int(cur.fetchone()[0] or 0)
+
+            runs = [("float", 1, self.vector_indexes()["chunks"][1])]
+            runs += [(kind, f, self.quantized_index_name(kind)) for kind in kinds for f in rerank_factors]
+            report = []
+            for kind, factor, index_name in runs:
+                with conn.cursor() as cur:
+                    cur.execute(self.RELATION_SIZE_SQL.format(size="pg_relation_size"), {"relation": index_name})
+                    size = cur.fetchone()[0]
+                conn.rollback()
+                latencies = []
+                recalls = []
+                for emb, truth in zip(embeddings, exact):
+                    if kind == "float":
+                        sql, params = self._retrieve_chunks_query(np.asarray(emb, dtype=np.float32), top_k, None, "ids")
+                        candidates = top_k
+                    else:
+                        sql, params = self._retrieve_chunks_quantized_query(
+                            np.asarray(emb, dtype=np.float32), top_k, None, kind, factor, "ids"
+                        )
+                        candidates = params["candidates"]
+                    with conn.cursor() as cur:
+                        self._apply_search_params(cur, probes, max(ef_search or self.ef_search or 40, candidates))
+                        start = time.perf_counter()
+                        cur.execute(sql, params)
+                        found = {row[0] for row in cur.fetchall()}
+                        latencies.append((time.perf_counter() - start) * 1000)
+                    conn.rollback()
+                    if truth:
+                        recalls.append(len(found & truth) / len(truth))
+                report.append({
+                    "representation": kind,
+                    "rerank_factor": factor,
+                    "queries": len(embeddings),
+                    "recall_at_k": float(np.mean(recalls)) if recalls else 0.0,
+                    "p50_ms": float(np.percentile(latencies, 50)) if latencies else 0.0,
+                    "p95_ms": float(np.percentile(latencies, 95)) if latencies else 0.0,
+                    "p99_ms": float(np.percentile(latencies, 99)) if latencies else 0.0,
+                    "index": index_name,
+                    "index_bytes": int(size) if size is not None else None,
+                    "table_bytes": table_bytes,
+                })
+            return report
+        finally:
+            conn.close()
+
+    def two_stage_report(
+        self,
+        candidate_docs: Tuple[int, ...] = (10, 25, 50, 100),
+        num_queries: int = 50,
+        top_k: int = 10,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[dict]:
+        """Recall@k and latency of two-stage chunk search vs. one-stage retrieve_chunks.
+
+        Ground truth is the exact chunk scan (see index_report). The "one-stage"
+        row searches the chunk index directly; the others first pick N
+        documents from the document index.
+        """
+        conn = self.get_connection()
+        try:
+            embeddings, exact = self._sample_exact_neighbours(conn, num_queries, top_k)
+            report = []
+            for n in (None, *candidate_docs):
+                latencies = []
+                recalls = []
+                for emb, truth in zip(embeddings, exact):
+                    vec = np.asarray(emb, dtype=np.float32)
+                    if n is None:
+                        sql, params = self._retrieve_chunks_query(vec, top_k, None, "ids")
+                    else:
+                        sql, params = self._retrieve_chunks_two_stage_query(vec, top_k, None, n, "ids")
+                    with conn.cursor() as cur:
+                        self._apply_search_params(cur, probes, max(ef_search or self.ef_search or 40, n or top_k))
+                        start = time.perf_counter()
+                        cur.execute(sql, params)
+                        found = {row[0] for row in cur.fetchall()}
+                        latencies.append((time.perf_counter() - start) * 1000)
+                    conn.rollback()
+                    if truth:
+                        recalls.append(len(found & truth) / len(truth))
+                report.append({
+                    "search": "one-stage" if n is None else "two-stage",
+                    "candidate_docs": n,
+                    "queries": len(embeddings),
+                    "recall_at_k": float(np.mean(recalls)) if recalls else 0.0,
+                    "p50_ms": float(np.percentile(latencies, 50)) if latencies else 0.0,
+                    "p95_ms": float(np.percentile(latencies, 95)) if latencies else 0.0,
+                    "p99_ms": float(np.percentile(latencies, 99)) if latencies else 0.0,
+                })
+            return report
+        finally:
+            conn.close()
+
+    def _chunk_spans(self, text: str, max_length: int = 512) -> List[Tuple[int, int]]:
+        """Split text into word-aligned (start, end) character spans of ~max_length."""
+        spans = []
+        span_start = None
+        span_end = 0
+        current_length = 0
+
+        for match in re.finditer(r"\S+", text):
+            word_len = len(match.group()) + 1
+            if span_start is not None and current_length + word_len > max_length:
+                spans.append((span_start, span_end))
+                span_start = None
+                current_length = 0
+            if span_start is None:
+                span_start = match.start()
+            span_end = match.end()
+            current_length += word_len
+
+        if span_start is not None:
+            spans.append((span_start, span_end))
+
+        return spans if spans else [(0, min(len(text), max_length))]
+
+    def _chunk_text(self, text: str, max_length: int = 512) -> List[str]:
+        return [text[start:end] for start, end in self._chunk_spans(text, max_length)]
+
+    @staticmethod
+    def _text_sha256(text: str) -> str:
+        # Same digest the scraper stores in dgsi_documents.text_sha256
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _record_doc_state(self, cur, doc_id: int, text: str):
+        cur.execute(
+            f"""INSERT INTO {self.state_table} (doc_id, source, doc_sha256, doc_model_version, doc_indexed_at)
+               SELECT id, source, %s, %s, now() FROM dgsi_documents WHERE id = %s
+               ON CONFLICT (doc_id) DO UPDATE SET
+                 doc_sha256 = EXCLUDED.doc_sha256,
+                 doc_model_version = EXCLUDED.doc_model_version,
+                 doc_indexed_at = EXCLUDED.doc_indexed_at;""",
+            (self._text_sha256(text or ""), self.model_version, doc_id)
+        )
+
+    def _record_chunks_state(self, cur, doc_id: int, text: str):
+        cur.execute(
+            f"""INSERT INTO {self.state_table} (doc_id, source, chunks_sha256, chunks_model_version, chunks_indexed_at)
+               SELECT id, source, %s, %s, now() FROM dgsi_documents WHERE id = %s
+               ON CONFLICT (doc_id) DO UPDATE SET
+                 chunks_sha256 = EXCLUDED.chunks_sha256,
+                 chunks_model_version = EXCLUDED.chunks_model_version,
+                 chunks_indexed_at = EXCLUDED.chunks_indexed_at;""",
+            (self._text_sha256(text or ""), self.model_version, doc_id)
+        )
+
+    @staticmethod
+    def vocabulary_sha256(terms: List[str], idf: List[float]) -> str:
+        return hashlib.sha256(json.dumps([terms, idf]).encode("utf-8")).hexdigest()
+
+    def _saved_vocabulary(self, cur):
+        """(vocab_sha256, terms, idf) of this model's saved vocabulary, or None.
+
+        A model named by default takes the vocabulary of a registered model
+        with the same settings (dense or sparse), the active one first.
+        """
+        cur.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'dgsi_embedding_models' AND column_name = 'vocab_sha256'
+            );
+        """)
+        if not cur.fetchone()[0]:
+            return None
+        if self._base_version is None:
+            cur.execute("""
+                SELECT v.vocab_sha256, v.terms, v.idf
+                FROM dgsi_embedding_models m JOIN dgsi_tfidf_vocabularies v USING (vocab_sha256)
+                WHERE m.model_version = %s;
+            """, (self._model_version,))
+        else:
+            cur.execute("""
+                SELECT v.vocab_sha256, v.terms, v.idf
+                FROM dgsi_embedding_models m JOIN dgsi_tfidf_vocabularies v USING (vocab_sha256)
+                WHERE m.model_name = %s AND m.embedding_dim = %s AND m.chunk_size = %s
+                  AND m.model_version IN (%s || ':' || left(v.vocab_sha256, 12), %s || ':sparsevec:' || left(v.vocab_sha256, 12))
+                ORDER BY m.is_active DESC, m.created_at DESC LIMIT 1;
+            """, (self.model_name, self.embedding_dim, self.chunk_size, self._base_version, self._base_version))
+        return cur.fetchone()
+
+    def _load_vectorizer(self):
+        """Load this model's saved TF-IDF vocabulary, or fit and save one (once, by one thread).
+
+        Fitting reads the first VOCABULARY_FIT_DOCUMENTS documents by id, so
+        processes fitting the same corpus get the same vocabulary. It is saved
+        in dgsi_tfidf_vocabularies under a hash of its terms and idf weights;
+        a model named by default is "<base version>[:sparsevec]:<hash>", so a
+        different fit is a different model and sync re-embeds every document
+        under it.
+        """
+        with self._fit_lock:
+            if self.vectorizer_fitted:
+                return
+            conn = self.get_connection()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(VOCABULARY_TABLE_SQL)
+                    saved = self._saved_vocabulary(cur)
+                    if saved is not None:
+                        digest, terms, idf = saved
+                        self.vectorizer.vocabulary_ = {term: i for i, term in enumerate(terms)}
+                        self.vectorizer.idf_ = np.asarray(idf, dtype=np.float64)
+                    else:
+                        cur.execute(
+                            "SELECT text_plain FROM dgsi_documents WHERE text_plain IS NOT NULL ORDER BY id LIMIT %s;",
+                            (VOCABULARY_FIT_DOCUMENTS,)
+                        )
+                        texts = [doc[0][:self.chunk_size * 3] for doc in cur.fetchall()]
+                        if not texts:
+                            raise RuntimeError("No documents to fit the TF-IDF vectorizer on; scrape some first")
+                        self.vectorizer.fit(texts)
+                        terms = self.vectorizer.get_feature_names_out().tolist()
+                        idf = self.vectorizer.idf_.tolist()
+                        digest = self.vocabulary_sha256(terms, idf)
+                        cur.execute("""
+                            INSERT INTO dgsi_tfidf_vocabularies (vocab_sha256, terms, idf, documents)
+                            VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING;
+                        """, (digest, terms, idf, len(texts)))
+                        print(f"Vectorizer fitted on {len(texts)} documents (vocabulary {digest[:12]})")
+                conn.commit()
+            finally:
+                conn.close()
+            self._vocab_sha256 = digest
+            self._model_version = self._model_version or f"{self._base_version}{self._version_variant}:{digest[:12]}"
+            self.vectorizer_fitted = True
+
+    @_uses_model
+    def generate_embedding(self, text: str, use_chunking: bool = True) -> np.ndarray:
+        if not text or not text.strip():
+            return np.zeros(self.embedding_dim, dtype=np.float32)
+        if use_chunking and self.doc_pooling:
+            return self._pooled_embeddings([text])[0]
+        if self.encoder is not None:
+            return self.encoder.encode([text])[0]
+        
+        # Ensure vectorizer is fitted
+        if not self.vectorizer_fitted:
+            self._load_vectorizer()
+        
+        # Transform text to sparse TF-IDF vector
+        sparse_vec = self.vectorizer.transform([text[:self.chunk_size * 3]])
+        # Convert to dense array
+        dense_vec = sparse_vec.toarray()[0].astype(np.float32)
+        
+        # Pad or truncate to embedding_dim
+        if len(dense_vec) < self.embedding_dim:
+            dense_vec = np.pad(dense_vec, (0, self.embedding_dim - len(dense_vec)), mode='constant')
+        else:
+            dense_vec = dense_vec[:self.embedding_dim]
+        
+        return dense_vec
+    
+    @_uses_model
+    def generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """generate_embedding for many texts with a single vectorizer call."""
+        out = np.zeros((len(texts), self.embedding_dim), dtype=np.float32)
+        todo = [i for i, text in enumerate(texts) if text and text.strip()]
+        if not todo:
+            return out
+        if self.encoder is not None:
+            return self.encoder.encode(texts)
+
+        if not self.vectorizer_fitted:
+            self._load_vectorizer()
+
+        matrix = self.vectorizer.transform([texts[i][:self.chunk_size * 3] for i in todo])
+        width = min(matrix.shape[1], self.embedding_dim)
+        out[todo, :width] = matrix[:, :width].toarray()
+        return out
+
+    @staticmethod
+    def pool_embeddings(embeddings: np.ndarray, lengths: Optional[np.ndarray] = None, method: str = "mean") -> np.ndarray:
+        """One vector from a document's chunk vectors.
+
+        "weighted" weights each chunk by its length in characters, so a short
+        trailing chunk counts less than a full one.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if method == "max":
+            return embeddings.max(axis=0)
+        if method == "weighted" and lengths is not None and float(np.sum(lengths)) > 0:
+            weights = np.asarray(lengths, dtype=np.float32)
+            return (weights[:, None] * embeddings).sum(axis=0) / weights.sum()
+        if method not in DOC_POOLINGS:
+            raise ValueError(f"pooling must be one of: {', '.join(DOC_POOLINGS)}")
+        return embeddings.mean(axis=0)
+
+    def _pooled_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Document vectors pooled (doc_pooling) from embeddings of their chunks."""
+        spans = [self._chunk_spans(text, self.chunk_size) if text and text.strip() else [] for text in texts]
+        chunk_vectors = self.generate_embeddings([text[a:b] for text, doc_spans in zip(texts, spans) for a, b in doc_spans])
+        out = np.zeros((len(texts), self.embedding_dim), dtype=np.float32)
+        offset = 0
+        for i, doc_spans in enumerate(spans):
+            if doc_spans:
+                lengths = np.array([b - a for a, b in doc_spans], dtype=np.float32)
+                out[i] = self.pool_embeddings(chunk_vectors[offset:offset + len(doc_spans)], lengths, self.doc_pooling)
+            offset += len(doc_spans)
+        return out
+
+    @_uses_model
+    def generate_sparse_embedding(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Same vector as generate_embedding, as (indices, values) of the non-zero terms."""
+        if not text or not text.strip():
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        if not self.vectorizer_fitted:
+            self._load_vectorizer()
+
+        row = self.vectorizer.transform([text[:self.chunk_size * 3]]).tocsr()
+        row.sort_indices()
+        keep = row.indices < self.embedding_dim
+        return row.indices[keep].astype(np.int32), row.data[keep].astype(np.float32)
+
+    def _sparsevec_literal(self, indices: np.ndarray, values: np.ndarray) -> str:
+        # pgvector sparsevec text format: {index:value,...}/dim with 1-based indices
+        terms = ",".join(f"{int(i) + 1}:{float(v):.8g}" for i, v in zip(indices, values))
+        return f"{{{terms}}}/{self.embedding_dim}"
+
+    def _vector_param(self, embedding: np.ndarray):
+        """Query parameter for a dense embedding, in the column's vector type."""
+        if self.sparse:
+            indices = np.flatnonzero(embedding)
+            return self._sparsevec_literal(indices, embedding[indices])
+        return embedding.tolist()
+
+    def _vector_text(self, embedding: np.ndarray) -> str:
+        """Text literal of an embedding (for vector arrays, which can't take lists)."""
+        if self.sparse:
+            return self._vector_param(embedding)
+        return "[" + ",".join(f"{float(v):.8g}" for v in embedding) + "]"
+
+    def _storage_vector(self, text: str):
+        """Embed text for storage without densifying when the column is sparse."""
+        if self.sparse and not self.doc_pooling:
+            return self._sparsevec_literal(*self.generate_sparse_embedding(text))
+        return self._vector_param(self.generate_embedding(text))
+
+    def _storage_vectors(self, texts: List[str]) -> list:
+        """Chunk vectors for storage; dense vectors are embedded in one call."""
+        if self.sparse:
+            return [self._sparsevec_literal(*self.generate_sparse_embedding(text)) for text in texts]
+        return [row.tolist() for row in self.generate_embeddings(texts)]
+
+    def _document_vectors(self, texts: List[str]) -> list:
+        """Document vectors for storage (pooled from their chunks with doc_pooling)."""
+        if not self.doc_pooling:
+            return [self._storage_vector(text) for text in texts] if self.sparse else self._storage_vectors(texts)
+        return [self._vector_param(vec) for vec in self._pooled_embeddings(texts)]
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """generate_embedding with a bounded LRU cache for repeated queries.
+
+        The returned array is shared with the cache and marked read-only.
+        """
+        self._maybe_follow_active()
+        with self._model_lock.reading():
+            key = (self._text_sha256(text or ""), self.model_version)
+            with self._query_cache_lock:
+                cached = self._query_cache.get(key)
+                if cached is not None:
+                    self._query_cache.move_to_end(key)
+                    self.query_cache_hits += 1
+                    return cached
+                self.query_cache_misses += 1
+
+            with span("embedding"):
+                embedding = self.generate_embedding(text, use_chunking=False)
+            embedding.setflags(write=False)
+            if self.query_cache_size > 0:
+                with self._query_cache_lock:
+                    self._query_cache[key] = embedding
+                    if len(self._query_cache) > self.query_cache_size:
+                        self._query_cache.popitem(last=False)
+            return embedding
+
+    def embed_queries(self, texts: List[str]) -> List[np.ndarray]:
+        """embed_query for a batch; cache misses are vectorized together."""
+        self._maybe_follow_active()
+        with self._model_lock.reading():
+            keys = [(self._text_sha256(text or ""), self.model_version) for text in texts]
+            embeddings: List[Optional[np.ndarray]] = [None] * len(texts)
+            with self._query_cache_lock:
+                for i, key in enumerate(keys):
+                    cached = self._query_cache.get(key)
+                    if cached is not None:
+                        self._query_cache.move_to_end(key)
+                        self.query_cache_hits += 1
+                        embeddings[i] = cached
+                    else:
+                        self.query_cache_misses += 1
+
+            missing = [i for i, emb in enumerate(embeddings) if emb is None]
+            if missing:
+                with span("embedding"):
+                    generated = self.generate_embeddings([texts[i] for i in missing])
+                with self._query_cache_lock:
+                    for row, i in enumerate(missing):
+                        embedding = generated[row].copy()
+                        embedding.setflags(write=False)
+                        embeddings[i] = embedding
+                        if self.query_cache_size > 0:
+                            self._query_cache[keys[i]] = embedding
+                    while len(self._query_cache) > self.query_cache_size:
+                        self._query_cache.popitem(last=False)
+            return embeddings
+
+    def query_cache_stats(self) -> dict:
+        lookups = self.query_cache_hits + self.query_cache_misses
+        return {
+            "size": len(self._query_cache),
+            "max_size": self.query_cache_size,
+            "hits": self.query_cache_hits,
+            "misses": self.query_cache_misses,
+            "hit_rate": (self.query_cache_hits / lookups) if lookups else 0.0,
+        }
+
+    def clear_query_cache(self):
+        with self._query_cache_lock:
+            self._query_cache.clear()
+            self.query_cache_hits = 0
+            self.query_cache_misses = 0
+
+    def _index_version_due(self) -> bool:
+        return self._index_version is None or time.monotonic() - self._index_version_checked_at >= self.version_check_interval
+
+    def _observe_index_version(self, version: int):
+        if self.result_cache is not None and self._index_version is not None and version != self._index_version:
+            # entries of the old version can't be hit any more
+            self.result_cache.clear()
+        self._index_version = version
+        self._index_version_checked_at = time.monotonic()
+
+    def index_version(self) -> int:
+        """This model's index version, as of at most version_check_interval seconds ago.
+
+        Writes through this retriever are seen at once; writes by other
+        processes (sync, reindex-source) within the interval.
+        """
+        self._maybe_follow_active()
+        if self._index_version_due():
+            conn = self.get_connection()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(INDEX_VERSION_COLUMN_SQL)
+                    row = None
+                    if cur.fetchone()[0]:
+                        cur.execute(INDEX_VERSION_SQL, (self.model_version,))
+                        row = cur.fetchone()
+            finally:
+                conn.close()
+            self._observe_index_version(row[0] if row else 0)
+        return self._index_version
+
+    def _bump_index_version(self, conn):
+        """Make cached results of this model stale.
+
+        Called once per batch (or per run) after the data committed, in its
+        own short transaction, so the model's registry row is not locked for
+        the length of every indexing transaction.
+        """
+        with conn.cursor() as cur:
+            cur.execute(INDEX_VERSION_COLUMN_SQL)
+            if cur.fetchone()[0]:
+                cur.execute(
+                    "UPDATE dgsi_embedding_models SET index_version = index_version + 1 WHERE model_version = %s;",
+                    (self.model_version,)
+                )
+        conn.commit()
+        self._index_version = None
+
+    def index_document(self, doc_id: int, text: str) -> bool:
+        embedding = self._storage_vector(text)
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(self._doc_vector_sql(cur), (embedding, doc_id))
+                self._record_doc_state(cur, doc_id, text)
+            conn.commit()
+            self._bump_index_version(conn)
+            return True
+        except Exception as e:
+            print(f"Error indexing document {doc_id}: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def _write_document_chunks(self, cur, doc_id: int, text: str, spans: List[Tuple[int, int]], embeddings: list):
+        cur.execute("SELECT decision_class, source FROM dgsi_documents WHERE id = %s;", (doc_id,))
+        row = cur.fetchone()
+        decision_class, source = row if row else (None, None)
+
+        # Delete existing chunks for this document (the source prunes to its partition)
+        cur.execute(f"DELETE FROM {self.chunk_table} WHERE doc_id = %s AND source = %s;", (doc_id, source))
+
+        # Insert new chunks with their embeddings; the text itself stays in text_plain
+        for i, ((start, end), embedding) in enumerate(zip(spans, embeddings)):
+            cur.execute(
+                f"""INSERT INTO {self.chunk_table} 
+                   (doc_id, chunk_index, start_offset, end_offset, embedding, decision_class, source, text_tsv) 
+                   VALUES (%s, %s, %s, %s, %s::{self.vector_type}, %s, %s, to_tsvector('{FTS_CONFIG}', %s));""",
+                (doc_id, i, start, end, embedding, decision_class, source, text[start:end])
+            )
+        self._record_chunks_state(cur, doc_id, text)
+
+    def index_document_chunks(self, doc_id: int, text: str, bump_version: bool = True) -> bool:
+        """Chunk and embed one document; bump_version=False leaves the index version to the caller."""
+        if not text or not text.strip():
+            return False
+        
+        spans = self._chunk_spans(text, self.chunk_size)
+        conn = self.get_connection()
+        try:
+            embeddings = self._storage_vectors([text[start:end] for start, end in spans])
+            with conn.cursor() as cur:
+                self._write_document_chunks(cur, doc_id, text, spans, embeddings)
+            conn.commit()
+            if bump_version:
+                self._bump_index_version(conn)
+            return True
+        except Exception as e:
+            print(f"Error indexing document chunks {doc_id}: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def index_all_documents(self, batch_size: int = 100, limit: Optional[int] = None):
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                self._ensure_doc_table(cur)
+                query = f"""
+                    SELECT d.id, d.text_plain FROM dgsi_documents d
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {self.doc_table} v WHERE v.id = d.id AND v.embedding IS NOT NULL
+                    )
+                """
+                if limit:
+                    query += f" LIMIT {limit}"
+                cur.execute(query)
+                docs = cur.fetchall()
+            
+            total = len(docs)
+            print(f"Found {total} documents to index")
+        
+            for i in range(0, total, batch_size):
+                batch = docs[i:i + batch_size]
+                print(f"Processing batch {i // batch_size + 1}/{(total + batch_size - 1) // batch_size}")
+                texts = [doc[1] for doc in batch]
+                doc_ids = [doc[0] for doc in batch]
+                embeddings = self._document_vectors(texts)
+                
+                with conn.cursor() as cur:
+                    doc_vector_sql = self._doc_vector_sql(cur)
+                    for doc_id, text, embedding in zip(doc_ids, texts, embeddings):
+                        cur.execute(doc_vector_sql, (embedding, doc_id))
+                        self._record_doc_state(cur, doc_id, text)
+                conn.commit()
+                self._bump_index_version(conn)
+                print(f"Indexed {min(i + batch_size, total)}/{total} documents")
+                
+        finally:
+            conn.close()
+    
+    def index_all_documents_chunks(self, batch_size: int = 100, limit: Optional[int] = None):
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                #documents that have no chunks indexed
+                query = f"""
+                    SELECT d.id, d.text_plain 
+                    FROM dgsi_documents d
+                    LEFT JOIN {self.chunk_table} c ON d.id = c.doc_id
+                    WHERE c.id IS NULL
+                    GROUP BY d.id, d.text_plain
+                """
+                if limit:
+                    query += f" LIMIT {limit}"
+                cur.execute(query)
+                docs = cur.fetchall()
+            
+            total = len(docs)
+            print(f"Found {total} documents to index as chunks")
+        
+            for i in range(0, total, batch_size):
+                batch = docs[i:i + batch_size]
+                print(f"Processing batch {i // batch_size + 1}/{(total + batch_size - 1) // batch_size}")
+                
+                docs_spans = [
+                    (doc_id, text, self._chunk_spans(text, self.chunk_size))
+                    for doc_id, text in batch if text and text.strip()
+                ]
+                # one embedding call per batch, so length bucketing and encoder
+                # worker processes work across documents
+                embeddings = self._storage_vectors([text[start:end] for _, text, spans in docs_spans for start, end in spans])
+                offset = 0
+                for doc_id, text, spans in docs_spans:
+                    try:
+                        with conn.cursor() as cur:
+                            self._write_document_chunks(cur, doc_id, text, spans, embeddings[offset:offset + len(spans)])
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        print(f"Error indexing document chunks {doc_id}: {e}")
+                    offset += len(spans)
+                self._bump_index_version(conn)
+                    
+                print(f"Indexed {min(i + batch_size, total)}/{total} documents as chunks")
+                
+        finally:
+            conn.close()
+    
+    def sync(self, batch_size: int = 100, limit: Optional[int] = None, chunks: bool = True, source: Optional[str] = None) -> dict:
+        """Re-embed only documents whose text_sha256 or model version changed.
+
+        Documents without an index state row (never indexed, or indexed before
+        the state table existed) are treated as changed. source limits the
+        sync to one source.
+        """
+        source_filter = "AND d.source = %s" if source else ""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                query = f"""
+                    SELECT d.id, d.text_plain
+                    FROM dgsi_documents d
+                    LEFT JOIN {self.state_table} s ON s.doc_id = d.id
+                    WHERE (s.doc_id IS NULL
+                       OR s.doc_sha256 IS DISTINCT FROM d.text_sha256
+                       OR s.doc_model_version IS DISTINCT FROM %s)
+                      {source_filter}
+                    ORDER BY d.id
+                """
+                params: list = [self.model_version, source] if source else [self.model_version]
+                if limit:
+                    query += " LIMIT %s"
+                    params.append(limit)
+                cur.execute(query, params)
+                stale_docs = cur.fetchall()
+
+                stale_chunks = []
+                if chunks:
+                    query = f"""
+                        SELECT d.id, d.text_plain
+                        FROM dgsi_documents d
+                        LEFT JOIN {self.state_table} s ON s.doc_id = d.id
+                        WHERE (s.doc_id IS NULL
+                           OR s.chunks_sha256 IS DISTINCT FROM d.text_sha256
+                           OR s.chunks_model_version IS DISTINCT FROM %s)
+                          {source_filter}
+                        ORDER BY d.id
+                    """
+                    params = [self.model_version, source] if source else [self.model_version]
+                    if limit:
+                        query += " LIMIT %s"
+                        params.append(limit)
+                    cur.execute(query, params)
+                    stale_chunks = cur.fetchall()
+
+            print(f"Found {len(stale_docs)} stale document embeddings, {len(stale_chunks)} stale chunk sets")
+
+            synced_chunks = 0
+            for n, (doc_id, text) in enumerate(stale_chunks, 1):
+                if self.index_document_chunks(doc_id, text, bump_version=False):
+                    synced_chunks += 1
+                if n % batch_size == 0 or n == len(stale_chunks):
+                    self._bump_index_version(conn)
+                    print(f"Synced chunks for {n}/{len(stale_chunks)} documents")
+
+            documents_synced = len(stale_docs)
+            if self.doc_pooling and stale_docs:
+                # chunks are current now: pool them instead of embedding again
+                pooled = set(self._pool_documents(conn, self.doc_pooling, [doc_id for doc_id, _ in stale_docs]))
+                stale_docs = [(doc_id, text) for doc_id, text in stale_docs if doc_id not in pooled]
+
+            for i in range(0, len(stale_docs), batch_size):
+                batch = stale_docs[i:i + batch_size]
+                with conn.cursor() as cur:
+                    doc_vector_sql = self._doc_vector_sql(cur)
+                    for doc_id, text in batch:
+                        cur.execute(doc_vector_sql, (self._storage_vector(text), doc_id))
+                        self._record_doc_state(cur, doc_id, text)
+                conn.commit()
+                self._bump_index_version(conn)
+                print(f"Synced {min(i + batch_size, len(stale_docs))}/{len(stale_docs)} documents")
+
+            return {
+                "documents_synced": documents_synced,
+                "chunk_sets_synced": synced_chunks,
+            }
+        finally:
+            conn.close()
+
+    def pooled_document_embeddings(
+        self,
+        doc_ids: Optional[List[int]] = None,
+        method: Optional[str] = None,
+        batch_size: int = 1000,
+    ):
+        """Yield (doc_id, vector) pooled from the chunk vectors already stored.
+
+        Nothing is embedded again; documents without chunks are skipped.
+        """
+        method = method or self.doc_pooling or "mean"
+        id_filter = "AND c.doc_id = ANY(%s)" if doc_ids is not None else ""
+        conn = self.get_connection()
+        try:
+            with conn.cursor(name="dgsi_pool_chunks") as cur:
+                cur.itersize = batch_size
+                cur.execute(f"""
+                    SELECT c.doc_id, c.embedding::vector::real[],
+                           COALESCE(c.end_offset - c.start_offset, length(c.chunk_text), 1)
+                    FROM {self.chunk_table} c
+                    WHERE c.embedding IS NOT NULL {id_filter}
+                    ORDER BY c.doc_id, c.chunk_index;
+                """, (list(doc_ids),) if doc_ids is not None else None)
+                current = None
+                vectors: list = []
+                lengths: list = []
+                for doc_id, embedding, length in cur:
+                    if doc_id != current and vectors:
+                        yield current, self.pool_embeddings(np.asarray(vectors), np.asarray(lengths), method)
+                        vectors, lengths = [], []
+                    current = doc_id
+                    vectors.append(embedding)
+                    lengths.append(length)
+                if vectors:
+                    yield current, self.pool_embeddings(np.asarray(vectors), np.asarray(lengths), method)
+            conn.rollback()
+        finally:
+            conn.close()
+
+    def _pool_documents(self, conn, method: str, doc_ids: Optional[List[int]] = None, batch_size: int = 1000) -> List[int]:
+        """Store pooled chunk vectors as document vectors; returns the pooled ids."""
+        pooled: List[int] = []
+        if method == "mean" and not self.sparse:
+            # pgvector's avg(vector) pools in one statement
+            id_filter = "AND c.doc_id = ANY(%(ids)s)" if doc_ids is not None else ""
+            pooled_sql = f"""
+                SELECT c.doc_id, avg(c.embedding) AS embedding
+                FROM {self.chunk_table} c
+                WHERE c.embedding IS NOT NULL {id_filter}
+                GROUP BY c.doc_id
+            """
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    INSERT INTO {self.doc_table} (id, source, decision_class, embedding)
+                    SELECT d.id, d.source, d.decision_class, p.embedding
+                    FROM ({pooled_sql}) p
+                    JOIN dgsi_documents d ON d.id = p.doc_id
+                    ON CONFLICT ({self._doc_key(cur)}) DO UPDATE SET embedding = EXCLUDED.embedding
+                    RETURNING id;
+                """, {"ids": doc_ids})
+                pooled = [row[0] for row in cur.fetchall()]
+                self._record_pooled_state(cur, pooled)
+            conn.commit()
+            self._bump_index_version(conn)
+            return pooled
+
+        batch: List[Tuple] = []
+        for doc_id, vector in self.pooled_document_embeddings(doc_ids, method, batch_size):
+            batch.append((self._vector_param(vector), doc_id))
+            if len(batch) >= batch_size:
+                pooled += self._write_pooled(conn, batch)
+                batch = []
+        if batch:
+            pooled += self._write_pooled(conn, batch)
+        return pooled
+
+    def _write_pooled(self, conn, batch: List[Tuple]) -> List[int]:
+        with conn.cursor() as cur:
+            cur.executemany(self._doc_vector_sql(cur), batch)
+            ids = [doc_id for _, doc_id in batch]
+            self._record_pooled_state(cur, ids)
+        conn.commit()
+        self._bump_index_version(conn)
+        return ids
+
+    def _record_pooled_state(self, cur, doc_ids: List[int]):
+        # a pooled vector reflects the text its chunks were built from
+        cur.execute(f"""
+            UPDATE {self.state_table}
+            SET doc_sha256 = chunks_sha256, doc_model_version = chunks_model_version, doc_indexed_at = now()
+            WHERE doc_id = ANY(%s);
+        """, (doc_ids,))
+
+    def pool_document_embeddings(self, method: Optional[str] = None, doc_ids: Optional[List[int]] = None) -> dict:
+        """Recompute document vectors by pooling the stored chunk vectors.
+
+        Covers the full text of every chunked document, unlike the default
+        document vector, and embeds nothing. Mean pooling of dense vectors
+        runs in SQL; max, weighted and sparse pooling stream the chunks
+        through NumPy.
+        """
+        method = method or self.doc_pooling or "mean"
+        if method not in DOC_POOLINGS:
+            raise ValueError(f"pooling must be one of: {', '.join(DOC_POOLINGS)}")
+        start = time.perf_counter()
+        conn = self.get_connection()
+        try:
+            pooled = self._pool_documents(conn, method, doc_ids)
+        finally:
+            conn.close()
+        elapsed = time.perf_counter() - start
+        print(f"Pooled ({method}) {len(pooled)} document embeddings from chunks in {elapsed:.1f}s")
+        return {"pooling": method, "documents": len(pooled), "seconds": elapsed}
+
+    @staticmethod
+    def _chunk_hash(text: str) -> str:
+        # whitespace-insensitive, so boilerplate differing only in layout is shared
+        return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+    def ensure_dedup_schema(self):
+        unique_table, map_table = self.dedup_tables
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {unique_table} (
+                        id BIGSERIAL PRIMARY KEY,
+                        chunk_sha256 TEXT NOT NULL UNIQUE,
+                        embedding {self.vector_type}({self.embedding_dim}),
+                        doc_count INTEGER NOT NULL DEFAULT 0
+                    );
+                """)
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {map_table} (
+                        doc_id BIGINT NOT NULL,
+                        chunk_index INTEGER NOT NULL,
+                        unique_id BIGINT NOT NULL REFERENCES {unique_table}(id),
+                        start_offset INTEGER NOT NULL,
+                        end_offset INTEGER NOT NULL,
+                        source TEXT,
+                        decision_class TEXT,
+                        doc_sha256 TEXT,
+                        PRIMARY KEY (doc_id, chunk_index),
+                        {db_document_fk(cur, "doc_id")}
+                    );
+                """)
+                # text hash the offsets were computed on (added after the table shipped)
+                cur.execute(f"ALTER TABLE {map_table} ADD COLUMN IF NOT EXISTS doc_sha256 TEXT;")
+                # fan-out from winning chunks to their documents
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {db_index_name(f'{map_table}_unique_id_idx')} ON {map_table}(unique_id);")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def index_dedup_chunks(self, batch_size: int = 100, limit: Optional[int] = None) -> dict:
+        """Chunk documents into the deduplicated layout.
+
+        Chunks are keyed by the hash of their text; only hashes not stored yet
+        are embedded, so headers, costs formulas and other boilerplate shared
+        across documents get one row and one vector. Documents already mapped
+        from their current text are skipped; documents whose text changed
+        since are mapped again, and unique chunks no document maps to any
+        more are deleted.
+        """
+        self.ensure_dedup_schema()
+        unique_table, map_table = self.dedup_tables
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                query = f"""
+                    SELECT d.id, d.text_plain, d.source, d.decision_class, d.text_sha256
+                    FROM dgsi_documents d
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {map_table} m
+                        WHERE m.doc_id = d.id AND m.chunk_index = 0 AND m.doc_sha256 = d.text_sha256
+                    )
+                    ORDER BY d.id
+                """
+                if limit:
+                    query += f" LIMIT {int(limit)}"
+                cur.execute(query)
+                docs = cur.fetchall()
+
+            total = len(docs)
+            print(f"Found {total} documents to index as deduplicated chunks")
+            mapped = 0
+            embedded = 0
+            for i in range(0, total, batch_size):
+                batch = [doc for doc in docs[i:i + batch_size] if doc[1] and doc[1].strip()]
+                rows = []
+                texts = {}
+                for doc_id, text, source, decision_class, text_sha256 in batch:
+                    for chunk_index, (start, end) in enumerate(self._chunk_spans(text, self.chunk_size)):
+                        digest = self._chunk_hash(text[start:end])
+                        texts.setdefault(digest, text[start:end])
+                        rows.append((doc_id, chunk_index, digest, start, end, source, decision_class, text_sha256))
+
+                with conn.cursor() as cur:
+                    # mappings of an older text have stale offsets
+                    cur.execute(
+                        f"DELETE FROM {map_table} WHERE doc_id = ANY(%s) RETURNING unique_id;",
+                        ([doc[0] for doc in docs[i:i + batch_size]],)
+                    )
+                    released = list({row[0] for row in cur.fetchall()})
+                    cur.execute(
+                        f"SELECT chunk_sha256 FROM {unique_table} WHERE chunk_sha256 = ANY(%s);", (list(texts),)
+                    )
+                    known = {row[0] for row in cur.fetchall()}
+                    new = [digest for digest in texts if digest not in known]
+                    vectors = self._storage_vectors([texts[digest] for digest in new])
+                    cur.executemany(f"""
+                        INSERT INTO {unique_table} (chunk_sha256, embedding)
+                        VALUES (%s, %s::{self.vector_type})
+                        ON CONFLICT (chunk_sha256) DO NOTHING;
+                    """, list(zip(new, vectors)))
+                    cur.executemany(f"""
+                        INSERT INTO {map_table}
+                            (doc_id, chunk_index, unique_id, start_offset, end_offset, source, decision_class, doc_sha256)
+                        SELECT %s, %s, u.id, %s, %s, %s, %s, %s FROM {unique_table} u WHERE u.chunk_sha256 = %s
+                        ON CONFLICT (doc_id, chunk_index) DO NOTHING;
+                    """, [(d, n, a, b, src, cls, sha, digest) for d, n, digest, a, b, src, cls, sha in rows])
+                    cur.execute(f"""
+                        UPDATE {unique_table} u SET doc_count = (
+                            SELECT COUNT(DISTINCT m.doc_id) FROM {map_table} m WHERE m.unique_id = u.id
+                        )
+                        WHERE u.chunk_sha256 = ANY(%s) OR u.id = ANY(%s);
+                    """, (list(texts), released))
+                    cur.execute(f"DELETE FROM {unique_table} WHERE id = ANY(%s) AND doc_count = 0;", (released,))
+                conn.commit()
+                self._bump_index_version(conn)
+                mapped += len(rows)
+                embedded += len(new)
+                print(f"Indexed {min(i + batch_size, total)}/{total} documents "
+                      f"({embedded} chunks embedded for {mapped} mapped)")
+            return {"documents": total, "chunks_mapped": mapped, "chunks_embedded": embedded}
+        finally:
+            conn.close()
+
+    def build_dedup_index(
+        self,
+        method: str = "ivfflat",
+        lists: Optional[int] = None,
+        m: int = 16,
+        ef_construction: int = 64,
+    ) -> dict:
+        """ANN index over the unique chunk vectors (see index_dedup_chunks)."""
+        unique_table, _ = self.dedup_tables
+        unique_index = db_index_name(f"{unique_table}_embedding_idx")
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                start = time.perf_counter()
+                options = self._swap_build_index(cur, unique_table, unique_index, method, lists, m, ef_construction)
+            conn.commit()
+            self._bump_index_version(conn)
+            elapsed = time.perf_counter() - start
+            print(f"Built {method} index {unique_index} ({options}) in {elapsed:.1f}s")
+            return {"index": unique_index, "method": method, "options": options, "seconds": elapsed}
+        finally:
+            conn.close()
+
+    def dedup_report(self) -> dict:
+        """Dedup ratio of the chunk layout and table/index sizes next to the per-document chunks."""
+        unique_table, map_table = self.dedup_tables
+        chunk_index = self.vector_indexes()["chunks"][1]
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT (SELECT COUNT(*) FROM {map_table}),
+                           (SELECT COUNT(*) FROM {unique_table}),
+                           (SELECT COUNT(*) FROM {unique_table} WHERE doc_count > 1),
+                           (SELECT COALESCE(MAX(doc_count), 0) FROM {unique_table});
+                """)
+                mapped, unique, shared, max_owners = cur.fetchone()
+                sizes = {}
+                for name, relation in (
+                    ("chunk_table_bytes", self.chunk_table),
+                    ("chunk_index_bytes", chunk_index),
+                    ("unique_table_bytes", unique_table),
+                    ("unique_index_bytes", db_index_name(f"{unique_table}_embedding_idx")),
+                    ("map_table_bytes", map_table),
+                ):
+                    cur.execute(self.RELATION_SIZE_SQL.format(size="pg_total_relation_size"), {"relation": relation})
+                    sizes[name] = cur.fetchone()[0]
+            conn.rollback()
+        finally:
+            conn.close()
+
+        report = {
+            "chunks": mapped,
+            "unique_chunks": unique,
+            "shared_chunks": shared,
+            "max_documents_per_chunk": max_owners,
+            "dedup_ratio": (1 - unique / mapped) if mapped else 0.0,
+            **sizes,
+        }
+        if sizes["chunk_index_bytes"] and sizes["unique_index_bytes"] is not None:
+            report["index_size_reduction"] = 1 - sizes["unique_index_bytes"] / sizes["chunk_index_bytes"]
+        return report
+
+    def _retrieve_query(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int,
+        filter_source: Optional[str],
+        projection: str = "full",
+        snippet_chars: int = 600,
+    ) -> Tuple[str, dict]:
+        if projection not in PROJECTIONS:
+            raise ValueError(f"projection must be one of: {', '.join(PROJECTIONS)}")
+        # <=> is cosine distance; the top-k ids are found first and text is
+        # only read for those rows, according to the projection.
+        source_filter = "AND source = %(source)s" if filter_source else ""
+        text_sql = "d.text_plain" if projection == "full" else "NULL::text"
+        snippet_sql = "NULL::text"
+        snippet_join = ""
+        if projection == "snippet":
+            # best chunk of each hit, then a window of text_plain around it
+            snippet_join = f"""
+                LEFT JOIN LATERAL (
+                    SELECT c.start_offset, c.end_offset, c.chunk_text
+                    FROM {self.chunk_table} c
+                    WHERE c.doc_id = d.id AND c.embedding IS NOT NULL
+                    ORDER BY c.embedding <=> %(vec)s::{self.vector_type}
+                    LIMIT 1
+                ) bc ON true
+            """
+            snippet_sql = """
+                CASE WHEN bc.start_offset IS NOT NULL THEN substr(
+                    d.text_plain,
+                    GREATEST(bc.start_offset - GREATEST(%(snippet_chars)s - (bc.end_offset - bc.start_offset), 0) / 2, 0) + 1,
+                    GREATEST(%(snippet_chars)s, bc.end_offset - bc.start_offset)
+                ) ELSE left(COALESCE(bc.chunk_text, d.text_plain), %(snippet_chars)s) END
+            """
+        sql = f"""
+            SELECT 
+                d.id, d.url, d.processo, {text_sql}, d.source, 
+                d.sessao_date, d.descritores, top.distance, {snippet_sql}
+            FROM (
+                SELECT id, embedding <=> %(vec)s::{self.vector_type} AS distance
+                FROM {self.doc_table}
+                WHERE embedding IS NOT NULL {source_filter}
+                ORDER BY distance LIMIT %(top_k)s
+            ) top
+            JOIN dgsi_documents d ON d.id = top.id
+            {snippet_join}
+            ORDER BY top.distance;
+        """
+        params = {
+            "vec": self._vector_param(query_embedding),
+            "source": filter_source,
+            "top_k": top_k,
+            "snippet_chars": snippet_chars,
+        }
+        return sql, params
+
+    def _document_results(self, rows, min_similarity: float) -> List[RetrievalResult]:
+        results = []
+        with span("materialize"):
+            for row in rows:
+                similarity = 1 - float(row[7])
+                if similarity >= min_similarity:
+                    results.append(RetrievalResult(
+                        id=row[0],
+                        url=row[1],
+                        processo=row[2],
+                        text_plain=row[3],
+                        source=row[4],
+                        sessao_date=row[5],
+                        descritores=row[6] or [],
+                        similarity=similarity,
+                        snippet=row[8],
+                    ))
+        return results
+
+    @instrumented
+    @cached_results
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        projection: str = "full",
+        snippet_chars: int = 600,
+    ) -> List[RetrievalResult]:
+        """Document-level search.
+
+        projection: "full" returns text_plain, "snippet" a window of about
+        snippet_chars around the best-matching chunk, "ids" metadata only.
+        Use load_texts() to fetch full text later for the hits that need it.
+        """
+        query_embedding = self.embed_query(query)
+        sql, params = self._retrieve_query(query_embedding, top_k, filter_source, projection, snippet_chars)
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                self._apply_search_params(cur, probes, ef_search)
+                rows = self._execute_search(cur, "retrieve", sql, params)
+            return self._document_results(rows, min_similarity)
+            
+        finally:
+            conn.close()
+
+    def load_texts(self, results: List[RetrievalResult]) -> List[RetrievalResult]:
+        """Fill text_plain in place for results retrieved without it."""
+        missing = [r.id for r in results if r.text_plain is None]
+        if missing:
+            conn = self.get_connection()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT id, text_plain FROM dgsi_documents WHERE id = ANY(%s);", (missing,))
+                    texts = dict(cur.fetchall())
+            finally:
+                conn.close()
+            for r in results:
+                if r.text_plain is None:
+                    r.text_plain = texts.get(r.id)
+        return results
+    
+    def _chunk_results(self, rows, min_similarity: float, decision: Optional[str] = None) -> List[ChunkRetrievalResult]:
+        results = []
+        with span("materialize"):
+            for row in rows:
+                similarity = 1 - float(row[8])
+                if similarity >= min_similarity:
+                    results.append(ChunkRetrievalResult(
+                        chunk_id=row[0],
+                        doc_id=row[1],
+                        chunk_index=row[2],
+                        chunk_text=row[3],
+                        url=row[4],
+                        processo=row[5],
+                        source=row[6],
+                        sessao_date=row[7],
+                        similarity=similarity,
+                        decision=decision,
+                        start_offset=row[9],
+                        end_offset=row[10],
+                        score=float(row[11]) if len(row) > 11 else None,
+                    ))
+        return results
+
+    def _retrieve_chunks_query(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int,
+        filter_source: Optional[str],
+        projection: str = "full",
+        group_by_document: bool = False,
+        group_candidates: Optional[int] = None,
+    ) -> Tuple[str, list]:
+        if projection not in PROJECTIONS:
+            raise ValueError(f"projection must be one of: {', '.join(PROJECTIONS)}")
+        # top-k ids first; chunk text is sliced from text_plain only for the winners
+        sql = f"""
+            SELECT c.id, c.doc_id, c.embedding <=> %s::{self.vector_type} AS distance
+            FROM {self.chunk_table} c
+        """
+        params = [self._vector_param(query_embedding)]
+        if filter_source:
+            sql += " WHERE c.embedding IS NOT NULL AND c.source = %s"
+            params.append(filter_source)
+        else:
+            sql += " WHERE c.embedding IS NOT NULL"
+        sql += " ORDER BY distance LIMIT %s"
+
+        if group_by_document:
+            # Over-fetch chunks, keep each document's best one
+            params.append(group_candidates or top_k * 10)
+            sql = f"""
+                SELECT id, distance FROM (
+                    SELECT id, distance,
+                           row_number() OVER (PARTITION BY doc_id ORDER BY distance) AS doc_rank
+                    FROM ({sql}) candidates
+                ) ranked
+                WHERE doc_rank = 1
+                ORDER BY distance LIMIT %s
+            """
+        params.append(top_k)
+
+        columns = CHUNK_ID_COLUMNS if projection == "ids" else CHUNK_RESULT_COLUMNS
+        return f"""
+            SELECT {columns}
+            FROM ({sql}) top
+            JOIN {self.chunk_table} c ON c.id = top.id
+            JOIN dgsi_documents d ON c.doc_id = d.id
+            ORDER BY top.distance;
+        """, params
+
+    @instrumented
+    @cached_results
+    def retrieve_chunks(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        projection: str = "full",
+        group_by_document: bool = False,
+        group_candidates: Optional[int] = None,
+    ) -> List[ChunkRetrievalResult]:
+        """Chunk-level search.
+
+        projection="ids" skips the chunk text. With group_by_document=True each
+        document appears once, scored by its best chunk among the
+        group_candidates (default top_k * 10) nearest chunks.
+        """
+        query_embedding = self.embed_query(query)
+        sql, params = self._retrieve_chunks_query(
+            query_embedding, top_k, filter_source, projection, group_by_document, group_candidates
+        )
+        plan = self._plan_filtered(top_k, filter_source, None, probes, ef_search)
+        conn = self.get_connection()
+        try:
+            start = time.perf_counter()
+            with conn.cursor() as cur:
+                if plan["plan"] == "exact":
+                    cur.execute(EXACT_SCAN_SQL)
+                else:
+                    self._apply_search_params(cur, plan["probes"], plan["ef_search"])
+                rows = self._execute_search(cur, "retrieve_chunks", sql, params)
+            if filter_source:
+                self._log_plan("retrieve_chunks", plan, start, len(rows))
+
+            return self._chunk_results(rows, min_similarity)
+            
+        finally:
+            conn.close()
+
+    def _retrieve_chunks_quantized_query(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int,
+        filter_source: Optional[str],
+        quantization: str,
+        rerank_factor: int,
+        projection: str = "full",
+    ) -> Tuple[str, dict]:
+        _, _, quantized_distance = self._quantized_sql(quantization, "c.embedding", "%(vec)s")
+        source_filter = "AND c.source = %(source)s" if filter_source else ""
+        columns = CHUNK_ID_COLUMNS if projection == "ids" else CHUNK_RESULT_COLUMNS
+        # quantized index picks the candidates; the float column orders them
+        sql = f"""
+            SELECT {columns}
+            FROM (
+                SELECT cand.id, f.embedding <=> %(vec)s::vector AS distance
+                FROM (
+                    SELECT c.id
+                    FROM {self.chunk_table} c
+                    WHERE c.embedding IS NOT NULL {source_filter}
+                    ORDER BY {quantized_distance} LIMIT %(candidates)s
+                ) cand
+                JOIN {self.chunk_table} f ON f.id = cand.id
+                ORDER BY distance LIMIT %(top_k)s
+            ) top
+            JOIN {self.chunk_table} c ON c.id = top.id
+            JOIN dgsi_documents d ON c.doc_id = d.id
+            ORDER BY top.distance;
+        """
+        params = {
+            "vec": self._vector_param(query_embedding),
+            "source": filter_source,
+            "candidates": top_k * max(1, rerank_factor),
+            "top_k": top_k,
+        }
+        return sql, params
+
+    def _retrieve_chunks_two_stage_query(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int,
+        filter_source: Optional[str],
+        candidate_docs: int,
+        projection: str = "full",
+    ) -> Tuple[str, dict]:
+        source_filter = "AND source = %(source)s" if filter_source else ""
+        chunk_source_filter = "AND c.source = %(source)s" if filter_source else ""
+        columns = CHUNK_ID_COLUMNS if projection == "ids" else CHUNK_RESULT_COLUMNS
+        # the document index picks candidate_docs documents; their chunks are
+        # fetched through the doc_id index (= ANY of an array, not a join the
+        # planner may hash) and scored exactly. MATERIALIZED keeps the chunk
+        # ANN index out of the second stage.
+        sql = f"""
+            WITH docs AS MATERIALIZED (
+                SELECT id
+                FROM {self.doc_table}
+                WHERE embedding IS NOT NULL {source_filter}
+                ORDER BY embedding <=> %(vec)s::{self.vector_type} LIMIT %(candidate_docs)s
+            ), scored AS MATERIALIZED (
+                SELECT c.id, c.embedding <=> %(vec)s::{self.vector_type} AS distance
+                FROM {self.chunk_table} c
+                WHERE c.doc_id = ANY(ARRAY(SELECT id FROM docs))
+                  AND c.embedding IS NOT NULL {chunk_source_filter}
+            )
+            SELECT {columns}
+            FROM (
+                SELECT id, distance FROM scored
+                ORDER BY distance LIMIT %(top_k)s
+            ) top
+            JOIN {self.chunk_table} c ON c.id = top.id
+            JOIN dgsi_documents d ON c.doc_id = d.id
+            ORDER BY top.distance;
+        """
+        params = {
+            "vec": self._vector_param(query_embedding),
+            "source": filter_source,
+            "candidate_docs": candidate_docs,
+            "top_k": top_k,
+        }
+        return sql, params
+
+    @instrumented
+    @cached_results
+    def retrieve_chunks_two_stage(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        candidate_docs: int = 50,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        projection: str = "full",
+    ) -> List[ChunkRetrievalResult]:
+        """Chunk search restricted to the chunks of the candidate_docs nearest documents.
+
+        The approximate step runs over document vectors (about 20x fewer rows
+        than chunks); the chunks of those documents are then ranked exactly.
+        A relevant chunk in a document outside the candidates is missed, see
+        two_stage_report for the recall / latency trade-off.
+        """
+        query_embedding = self.embed_query(query)
+        sql, params = self._retrieve_chunks_two_stage_query(
+            query_embedding, top_k, filter_source, candidate_docs, projection
+        )
+        # hnsw returns at most ef_search rows
+        ef_search = max(ef_search or self.ef_search or 40, candidate_docs)
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                self._apply_search_params(cur, probes, ef_search)
+                rows = self._execute_search(cur, "retrieve_chunks_two_stage", sql, params)
+            return self._chunk_results(rows, min_similarity)
+        finally:
+            conn.close()
+
+    @instrumented
+    @cached_results
+    def retrieve_chunks_quantized(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_source: Optional[str] = None,
+        min_similarity: float = 0.0,
+        quantization: str = "binary",
+        rerank_factor: int = 4,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[ChunkRetrievalResult]:
+        """Chunk search over a quantized index (see build_quantized_index).
+
+        top_k * rerank_factor candidates come from the halfvec or binary index
+        and are re-scored with the float embeddings, so similarities are exact.
+        """
+        query_embedding = self.embed_query(query)
+        sql, params = self._retrieve_chunks_quantized_query(
+            query_embedding, top_k, filter_source, quantization, rerank_factor
+        )
+        # hnsw returns at most ef_search rows
+        ef_search = max(ef_search or self.ef_search or 40, params["candidates"])
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
-                #documents that have no chunks indexed
-                query = """
-                    SELECT d.id, d.text_plain 
-                    FROM dgsi_documents d
-                    LEFT JOIN dgsi_document_chunks c ON d.id = c.doc_id
-                    WHERE c.id IS NULL
-                    GROUP BY d.id, d.text_plain
-                """
-                if limit:
-                    query += f" LIMIT {limit}"
-                cur.execute(query)
-                docs = cur.fetchall()
-            
-            total = len(docs)
-            print(f"Found {total} documents to index as chunks")
-        
-            for i in range(0, total, batch_size):
-                batch = docs[i:i + batch_size]
-                print(f"Processing batch {i // batch_size + 1}/{(total + batch_size - 1) // batch_size}")
-                
-                for doc_id, text in batch:
-                    self.index_document_chunks(doc_id, text)
-                    
-                print(f"Indexed {min(i + batch_size, total)}/{total} documents as chunks")
-                
+                self._apply_search_params(cur, probes, ef_search)
+                rows = self._execute_search(cur, "retrieve_chunks_quantized", sql, params)
+            return self._chunk_results(rows, min_similarity)
         finally:
             conn.close()
-    
-    def retrieve(
+
+    def _retrieve_chunks_dedup_query(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int,
+        filter_source: Optional[str],
+        decision: Optional[str] = None,
+        candidate_factor: int = 4,
+        projection: str = "full",
+        max_documents_per_chunk: int = 3,
+    ) -> Tuple[str, dict]:
+        unique_table, map_table = self.dedup_tables
+        text_sql = "NULL::text" if projection == "ids" else "substr(d.text_plain, m.start_offset + 1, m.end_offset - m.start_offset)"
+        owner_filter = ""
+        if filter_source:
+            owner_filter += " AND m.source = %(source)s"
+        if decision:
+            owner_filter += " AND m.decision_class = %(decision)s"
+        # only unique chunks some matching document owns compete for the limit
+        candidate_filter = (
+            f"AND EXISTS (SELECT 1 FROM {map_table} m WHERE m.unique_id = u.id{owner_filter})" if owner_filter else ""
+        )
+        # nearest unique chunks first, then at most max_documents_per_chunk owners of each
+        sql = f"""
+            SELECT top.id, m.doc_id, m.chunk_index, {text_sql},
+                   d.url, d.processo, d.source, d.sessao_date,
+                   top.distance, m.start_offset, m.end_offset
+            FROM (
+                SELECT u.id, u.embedding <=> %(vec)s::{self.vector_type} AS distance
+                FROM {unique_table} u
+                WHERE u.embedding IS NOT NULL {candidate_filter}
+                ORDER BY u.embedding <=> %(vec)s::{self.vector_type} LIMIT %(candidates)s
+            ) top
+            CROSS JOIN LATERAL (
+                -- first occurrence in each document: repeats within one document add nothing
+                SELECT DISTINCT ON (m.doc_id) m.doc_id, m.chunk_index, m.start_offset, m.end_offset
+                FROM {map_table} m
+                WHERE m.unique_id = top.id{owner_filter}
+                ORDER BY m.doc_id, m.chunk_index
+                LIMIT %(per_chunk)s
+            ) m
+            JOIN dgsi_documents d ON d.id = m.doc_id
+            ORDER BY top.distance, m.doc_id, m.chunk_index
+            LIMIT %(top_k)s;
+        """
+        params = {
+            "vec": self._vector_param(query_embedding),
+            "candidates": top_k * max(1, candidate_factor),
+            "source": filter_source,
+            "decision": decision,
+            "per_chunk": max(1, max_documents_per_chunk),
+            "top_k": top_k,
+        }
+        return sql, params
+
+    @instrumented
+    @cached_results
+    def retrieve_chunks_dedup(
         self,
         query: str,
         top_k: int = 5,
         filter_source: Optional[str] = None,
-        min_similarity: float = 0.0
-    ) -> List[RetrievalResult]:
-        query_embedding = self.generate_embedding(query)
+        decision: Optional[str] = None,
+        min_similarity: float = 0.0,
+        candidate_factor: int = 4,
+        projection: str = "full",
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        max_documents_per_chunk: int = 3,
+    ) -> List[ChunkRetrievalResult]:
+        """Chunk search over the deduplicated layout (see index_dedup_chunks).
+
+        The ANN search runs over unique chunks owned by at least one document
+        passing the source / decision class filters; the document map is read
+        just for the top_k * candidate_factor winners, each fanning out to at
+        most max_documents_per_chunk of its documents, so one boilerplate
+        chunk can't fill the whole result. If fewer than top_k rows come back
+        the query is repeated as an exact scan. chunk_id is the unique chunk id.
+        """
+        query_embedding = self.embed_query(query)
+        sql, params = self._retrieve_chunks_dedup_query(
+            query_embedding, top_k, filter_source, decision, candidate_factor, projection, max_documents_per_chunk
+        )
+        plan = {"plan": "ann", "probes": probes, "ef_search": ef_search}
         conn = self.get_connection()
         try:
+            start = time.perf_counter()
             with conn.cursor() as cur:
-                # Use cosine similarity (1 - cosine_distance)
-                # <=>  is cosine distance
-                sql = """
-                    SELECT 
-                        id, url, processo, text_plain, source, 
-                        sessao_date, descritores,
-                        1 - (embedding <=> %s::vector) AS similarity
-                    FROM dgsi_documents
-                    WHERE embedding IS NOT NULL
-                """
-                params = [query_embedding.tolist()]
-                if filter_source:
-                    sql += " AND source = %s"
-                    params.append(filter_source)
-                
-                sql += " ORDER BY embedding <=> %s::vector LIMIT %s;"
-                params.extend([query_embedding.tolist(), top_k])
-                cur.execute(sql, params)
-                rows = cur.fetchall()
-
-            results = []
-            for row in rows:
-                similarity = float(row[7])
-                if similarity >= min_similarity:
-                    results.append(RetrievalResult(
-                        id=row[0],
-                        url=row[1],
-                        processo=row[2],
-                        text_plain=row[3],
-                        source=row[4],
-                        sessao_date=row[5],
-                        descritores=row[6] or [],
-                        similarity=similarity
-                    ))
-            
-            return results
-            
+                self._apply_search_params(cur, probes, ef_search)
+                rows = self._execute_search(cur, "retrieve_chunks_dedup", sql, params)
+                if len(rows) < top_k:
+                    plan["plan"] = "ann+exact"
+                    cur.execute(EXACT_SCAN_SQL)
+                    rows = self._execute_search(cur, "retrieve_chunks_dedup", sql, params)
+            conn.rollback()
+            self._log_plan("retrieve_chunks_dedup", plan, start, len(rows))
+            return self._chunk_results(rows, min_similarity, decision)
         finally:
             conn.close()
-    
-    def retrieve_chunks(
+
+    def _retrieve_hybrid_query(
+        self,
+        query: str,
+        query_embedding: np.ndarray,
+        top_k: int,
+        filter_source: Optional[str],
+        candidates: int,
+        rrf_k: int,
+    ) -> Tuple[str, dict]:
+        source_filter = "AND c.source = %(source)s" if filter_source else ""
+        sql = f"""
+            WITH vec AS (
+                SELECT id, row_number() OVER (ORDER BY distance) AS rank
+                FROM (
+                    SELECT c.id, c.embedding <=> %(vec)s::{self.vector_type} AS distance
+                    FROM {self.chunk_table} c
+                    WHERE c.embedding IS NOT NULL {source_filter}
+                    ORDER BY distance LIMIT %(candidates)s
+                ) v
+            ),
+            lex AS (
+                SELECT id, row_number() OVER (ORDER BY lex_rank DESC) AS rank
+                FROM (
+                    SELECT c.id, ts_rank_cd(c.text_tsv, tsq) AS lex_rank
+                    FROM {self.chunk_table} c
+                    CROSS JOIN websearch_to_tsquery('{FTS_CONFIG}', %(query)s) AS tsq
+                    WHERE c.text_tsv @@ tsq {source_filter}
+                    ORDER BY lex_rank DESC LIMIT %(candidates)s
+                ) l
+            ),
+            fused AS (
+                SELECT id, SUM(1.0 / (%(rrf_k)s + rank)) AS score
+                FROM (SELECT id, rank FROM vec UNION ALL SELECT id, rank FROM lex) ranked
+                GROUP BY id
+                ORDER BY score DESC LIMIT %(top_k)s
+            )
+            SELECT {CHUNK_RESULT_COLUMNS}, top.score
+            FROM (
+                SELECT f.id, f.score, c.embedding <=> %(vec)s::{self.vector_type} AS distance
+                FROM fused f JOIN {self.chunk_table} c ON c.id = f.id
+            ) top
+            JOIN {self.chunk_table} c ON c.id = top.id
+            JOIN dgsi_documents d ON c.doc_id = d.id
+            ORDER BY top.score DESC;
+        """
+        params = {
+            "vec": self._vector_param(query_embedding),
+            "query": query,
+            "source": filter_source,
+            "candidates": max(candidates, top_k),
+            "rrf_k": rrf_k,
+            "top_k": top_k,
+        }
+        return sql, params
+
+    @instrumented
+    @cached_results
+    def retrieve_hybrid(
         self,
         query: str,
         top_k: int = 5,
         filter_source: Optional[str] = None,
-        min_similarity: float = 0.0
+        min_similarity: float = 0.0,
+        candidates: int = 50,
+        rrf_k: int = 60,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
     ) -> List[ChunkRetrievalResult]:
-        query_embedding = self.generate_embedding(query, use_chunking=False)
+        """Full-text + vector chunk search fused with reciprocal-rank fusion.
+
+        Both candidate sets and the fusion run as CTEs in one statement. Results
+        are ordered by the fused score (ChunkRetrievalResult.score); similarity
+        is still the cosine similarity of each chunk.
+        """
+        query_embedding = self.embed_query(query)
+        sql, params = self._retrieve_hybrid_query(query, query_embedding, top_k, filter_source, candidates, rrf_k)
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
-                # join with document metadata
-                sql = """
-                    SELECT 
-                        c.id, c.doc_id, c.chunk_index, c.chunk_text,
-                        d.url, d.processo, d.source, d.sessao_date,
-                        1 - (c.embedding <=> %s::vector) AS similarity
-                    FROM dgsi_document_chunks c
-                    JOIN dgsi_documents d ON c.doc_id = d.id
-                    WHERE c.embedding IS NOT NULL
-                """
-                params = [query_embedding.tolist()]
-                if filter_source:
-                    sql += " AND d.source = %s"
-                    params.append(filter_source)
-                
-                sql += " ORDER BY c.embedding <=> %s::vector LIMIT %s;"
-                params.extend([query_embedding.tolist(), top_k])
-                cur.execute(sql, params)
-                rows = cur.fetchall()
+                self._apply_search_params(cur, probes, ef_search)
+                rows = self._execute_search(cur, "retrieve_hybrid", sql, params)
+            return self._chunk_results(rows, min_similarity)
+        finally:
+            conn.close()
 
-            results = []
-            for row in rows:
-                similarity = float(row[8])
-                if similarity >= min_similarity:
-                    results.append(ChunkRetrievalResult(
-                        chunk_id=row[0],
-                        doc_id=row[1],
-                        chunk_index=row[2],
-                        chunk_text=row[3],
-                        url=row[4],
-                        processo=row[5],
-                        source=row[6],
-                        sessao_date=row[7],
-                        similarity=similarity
-                    ))
-            
-            return results
-            
+    def _retrieve_many_query(self, query_embeddings: List[np.ndarray], top_k: int, filters: Optional[dict]):
+        filters = filters or {}
+        clauses = [pg_sql.SQL("c.embedding IS NOT NULL")]
+        if filters.get("source"):
+            clauses.append(pg_sql.SQL("c.source = %(source)s"))
+        if filters.get("decision"):
+            # a literal, as in retrieve_by_class, so a per-class partial index can match
+            clauses.append(pg_sql.SQL("c.decision_class = {}").format(pg_sql.Literal(filters["decision"])))
+        # One LATERAL top-k per query vector; q.ord keeps the input order
+        sql = pg_sql.SQL("""
+            SELECT q.ord, {columns}
+            FROM unnest(%(vecs)s::text[]::{vector_type}[]) WITH ORDINALITY AS q(vec, ord)
+            CROSS JOIN LATERAL (
+                SELECT c.id, c.embedding <=> q.vec AS distance
+                FROM {chunk_table} c
+                WHERE {where}
+                ORDER BY distance LIMIT %(top_k)s
+            ) top
+            JOIN {chunk_table} c ON c.id = top.id
+            JOIN dgsi_documents d ON c.doc_id = d.id
+            ORDER BY q.ord, top.distance;
+        """).format(
+            columns=pg_sql.SQL(CHUNK_RESULT_COLUMNS),
+            vector_type=pg_sql.SQL(self.vector_type),
+            chunk_table=pg_sql.Identifier(self.chunk_table),
+            where=pg_sql.SQL(" AND ").join(clauses),
+        )
+        params = {
+            "vecs": [self._vector_text(emb) for emb in query_embeddings],
+            "source": filters.get("source"),
+            "top_k": top_k,
+        }
+        return sql, params
+
+    @staticmethod
+    def _rows_by_query(rows, n_queries: int) -> List[list]:
+        """retrieve_many rows split per query (by q.ord), without the ord column."""
+        grouped: List[list] = [[] for _ in range(n_queries)]
+        for row in rows:
+            grouped[int(row[0]) - 1].append(row[1:])
+        return grouped
+
+    @staticmethod
+    def _short_queries(per_query: List[list], top_k: int) -> List[int]:
+        """Positions of the queries the approximate scan returned fewer than top_k rows for."""
+        return [i for i, rows in enumerate(per_query) if len(rows) < top_k]
+
+    @staticmethod
+    def _refill(per_query: List[list], short: List[int], rows) -> None:
+        """Replace the rows of the short queries with those of their exact re-run."""
+        for i, query_rows in zip(short, DocumentRetriever._rows_by_query(rows, len(short))):
+            per_query[i] = query_rows
+
+    def _group_by_query(self, per_query: List[list], min_similarity: float, decision: Optional[str]) -> List[List[ChunkRetrievalResult]]:
+        return [self._chunk_results(rows, min_similarity, decision) for rows in per_query]
+
+    @instrumented
+    @cached_results
+    def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        filters: Optional[dict] = None,
+        min_similarity: float = 0.0,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[List[ChunkRetrievalResult]]:
+        """Chunk top-k for many queries with one embedding batch and one statement.
+
+        filters may hold "source" and/or "decision"; they are planned like
+        retrieve_by_class (see _plan_filtered). Queries the approximate scan
+        returns fewer than top_k chunks for are run again, together, as an
+        exact scan. Returns one result list per query, in input order.
+        """
+        if not queries:
+            return []
+        filters = filters or {}
+        query_embeddings = self.embed_queries(queries)
+        sql, params = self._retrieve_many_query(query_embeddings, top_k, filters)
+        plan = self._plan_filtered(top_k, filters.get("source"), filters.get("decision"), probes, ef_search)
+        conn = self.get_connection()
+        try:
+            start = time.perf_counter()
+            with conn.cursor() as cur:
+                if plan["plan"] == "exact":
+                    cur.execute(EXACT_SCAN_SQL)
+                else:
+                    self._apply_search_params(cur, plan["probes"], plan["ef_search"])
+                per_query = self._rows_by_query(self._execute_search(cur, "retrieve_many", sql, params), len(queries))
+                short = self._short_queries(per_query, top_k) if plan["plan"] != "exact" else []
+                if short:
+                    plan.update({"plan": "ann+exact", "refilled": len(short)})
+                    cur.execute(EXACT_SCAN_SQL)
+                    sql, params = self._retrieve_many_query([query_embeddings[i] for i in short], top_k, filters)
+                    self._refill(per_query, short, self._execute_search(cur, "retrieve_many", sql, params))
+            conn.rollback()
+            self._log_plan("retrieve_many", plan, start, sum(len(rows) for rows in per_query))
+            return self._group_by_query(per_query, min_similarity, filters.get("decision"))
         finally:
             conn.close()
-    
+
+    def fill_chunk_tsvectors(self, batch_size: int = 1000) -> int:
+        """Compute text_tsv for chunks indexed before it existed.
+
+        Chunks are visited once, in id order; a chunk without text gets an
+        empty tsvector, so every visited row leaves the text_tsv IS NULL set.
+        """
+        conn = self.get_connection()
+        total = 0
+        last_id = 0
+        try:
+            while True:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT id FROM {self.chunk_table}
+                        WHERE text_tsv IS NULL AND id > %s
+                        ORDER BY id LIMIT %s;
+                    """, (last_id, batch_size))
+                    ids = [row[0] for row in cur.fetchall()]
+                    if not ids:
+                        break
+                    cur.execute(f"""
+                        UPDATE {self.chunk_table} c
+                        SET text_tsv = to_tsvector('{FTS_CONFIG}', COALESCE({CHUNK_TEXT_SQL}, ''))
+                        FROM dgsi_documents d
+                        WHERE c.doc_id = d.id AND c.id = ANY(%s);
+                    """, (ids,))
+                    updated = cur.rowcount
+                conn.commit()
+                total += updated
+                last_id = ids[-1]
+                print(f"Filled text_tsv for {total} chunks")
+            conn.rollback()
+            if total:
+                self._bump_index_version(conn)
+            return total
+        finally:
+            conn.close()
+
     def get_document_stats(self) -> dict:
+        """Corpus and index counts, read from dgsi_corpus_stats (no table scans)."""
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute("""
-                    SELECT 
-                        COUNT(*) as total,
-                        COUNT(embedding) as indexed,
-                        COUNT(*) - COUNT(embedding) as not_indexed
-                    FROM dgsi_documents;
-                """)
-                row = cur.fetchone()
-                doc_stats = {
-                    "total_documents": row[0],
-                    "indexed_documents": row[1],
-                    "not_indexed": row[2],
-                    "index_percentage": (row[1] / row[0] * 100) if row[0] > 0 else 0
-                }
-                
-                #chunk stats
-                cur.execute("""
-                    SELECT 
-                        COUNT(DISTINCT doc_id) as docs_with_chunks,
-                        COUNT(*) as total_chunks,
-                        AVG(chunk_count) as avg_chunks_per_doc
-                    FROM (
-                        SELECT doc_id, COUNT(*) as chunk_count
-                        FROM dgsi_document_chunks
-                        GROUP BY doc_id
-                    ) as chunk_counts;
+                    SELECT source, decision_class, documents, indexed_documents,
+                           chunks, indexed_chunks, docs_with_chunks
+                    FROM dgsi_corpus_stats;
                 """)
-                chunk_row = cur.fetchone()
-                
-                if chunk_row and chunk_row[0]:
-                    doc_stats["docs_with_chunks"] = chunk_row[0]
-                    doc_stats["total_chunks"] = chunk_row[1]
-                    doc_stats["avg_chunks_per_doc"] = float(chunk_row[2]) if chunk_row[2] else 0
-                else:
-                    doc_stats["docs_with_chunks"] = 0
-                    doc_stats["total_chunks"] = 0
-                    doc_stats["avg_chunks_per_doc"] = 0
-                
-                return doc_stats
+                rows = cur.fetchall()
         finally:
             conn.close()
 
+        def totals(group_rows) -> dict:
+            documents = sum(r[2] for r in group_rows)
+            indexed = sum(r[3] for r in group_rows)
+            chunks = sum(r[4] for r in group_rows)
+            docs_with_chunks = sum(r[6] for r in group_rows)
+            return {
+                "total_documents": documents,
+                "indexed_documents": indexed,
+                "not_indexed": documents - indexed,
+                "index_percentage": (indexed / documents * 100) if documents > 0 else 0,
+                "docs_with_chunks": docs_with_chunks,
+                "total_chunks": chunks,
+                "indexed_chunks": sum(r[5] for r in group_rows),
+                "avg_chunks_per_doc": (chunks / docs_with_chunks) if docs_with_chunks > 0 else 0,
+            }
+
+        by_source: dict = {}
+        by_class: dict = {}
+        for row in rows:
+            by_source.setdefault(row[0], []).append(row)
+            by_class.setdefault(row[1] or None, []).append(row)
+
+        doc_stats = totals(rows)
+        doc_stats["by_source"] = {source: totals(group) for source, group in sorted(by_source.items())}
+        doc_stats["by_class"] = {cls: totals(group) for cls, group in by_class.items()}
+        return doc_stats
+
     def clear_all_chunks(self) -> bool:
         """Delete all chunks from the database."""
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
-                cur.execute("DELETE FROM dgsi_document_chunks;")
+                cur.execute(f"DELETE FROM {self.chunk_table};")
+                cur.execute(f"""
+                    UPDATE {self.state_table}
+                    SET chunks_sha256 = NULL, chunks_model_version = NULL, chunks_indexed_at = NULL;
+                """)
             conn.commit()
+            self._bump_index_version(conn)
             print("All chunks deleted successfully")
             return True
         except Exception as e:
@@ -467,13 +3405,83 @@ class DocumentRetriever:
         finally:
             conn.close()
 
+    def compact_chunks(self, batch_size: int = 100) -> dict:
+        """Convert chunks stored with a chunk_text copy into offset spans.
+
+        Spans are recomputed from text_plain and checked chunk by chunk against
+        the stored text (whitespace-normalized, as it was stored). Documents
+        whose text no longer matches their chunks are left alone and marked
+        stale, so the next sync re-embeds their chunks.
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT d.id, d.text_plain,
+                           array_agg(c.chunk_text ORDER BY c.chunk_index),
+                           array_agg(c.start_offset ORDER BY c.chunk_index),
+                           array_agg(c.end_offset ORDER BY c.chunk_index)
+                    FROM dgsi_documents d
+                    JOIN {self.chunk_table} c ON c.doc_id = d.id
+                    WHERE d.id IN (SELECT DISTINCT doc_id FROM {self.chunk_table} WHERE chunk_text IS NOT NULL)
+                    GROUP BY d.id, d.text_plain;
+                """)
+                docs = cur.fetchall()
+
+            compacted = 0
+            skipped = 0
+            for i in range(0, len(docs), batch_size):
+                stale = []
+                with conn.cursor() as cur:
+                    for doc_id, text, chunk_texts, starts, ends in docs[i:i + batch_size]:
+                        text = text or ""
+                        spans = self._chunk_spans(text, self.chunk_size)
+                        matches = len(spans) == len(chunk_texts) and all(
+                            " ".join(text[start:end].split()) == " ".join(stored.split())
+                            if stored is not None else (start, end) == stored_span
+                            for (start, end), stored, stored_span in zip(spans, chunk_texts, zip(starts, ends))
+                        )
+                        if not matches:
+                            stale.append(doc_id)
+                            continue
+                        cur.execute(f"""
+                            UPDATE {self.chunk_table} c
+                            SET start_offset = v.start_offset, end_offset = v.end_offset, chunk_text = NULL
+                            FROM unnest(%s::int[], %s::int[], %s::int[]) AS v(chunk_index, start_offset, end_offset)
+                            WHERE c.doc_id = %s AND c.chunk_index = v.chunk_index;
+                        """, (
+                            list(range(len(spans))),
+                            [start for start, _ in spans],
+                            [end for _, end in spans],
+                            doc_id,
+                        ))
+                        compacted += 1
+                    if stale:
+                        cur.execute(
+                            f"UPDATE {self.state_table} SET chunks_sha256 = NULL WHERE doc_id = ANY(%s);", (stale,)
+                        )
+                        skipped += len(stale)
+                conn.commit()
+                print(f"Compacted {compacted} documents ({skipped} skipped; sync re-embeds their chunks)")
+            return {"documents_compacted": compacted, "documents_skipped": skipped}
+        finally:
+            conn.close()
+
     def clear_all_embeddings(self) -> bool:
-        """Delete all embeddings from documents table."""
+        """Delete all document vectors of this model (a TRUNCATE; dgsi_documents is not touched)."""
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
-                cur.execute("UPDATE dgsi_documents SET embedding = NULL;")
+                cur.execute(f"TRUNCATE {self.doc_table};")
+                if self.doc_table == LEGACY_TABLES[0]:
+                    # TRUNCATE bypasses the stats triggers
+                    cur.execute("UPDATE dgsi_corpus_stats SET indexed_documents = 0 WHERE indexed_documents <> 0;")
+                cur.execute(f"""
+                    UPDATE {self.state_table}
+                    SET doc_sha256 = NULL, doc_model_version = NULL, doc_indexed_at = NULL;
+                """)
             conn.commit()
+            self._bump_index_version(conn)
             print("All document embeddings cleared successfully")
             return True
         except Exception as e:
@@ -491,92 +3499,219 @@ class DocumentRetriever:
             print("All data cleared successfully")
         return success
 
+    def _source_partition(self, cur, table: str, source: str) -> Optional[str]:
+        """The partition of table holding source, if table is partitioned and has one."""
+        if not db_is_partitioned(cur, table):
+            return None
+        return db_source_partitions(cur, table).get(source)
+
+    def clear_source(self, source: str) -> dict:
+        """Delete this model's chunks, document vectors and index state for one source.
+
+        With partitioned chunk and document vector tables the source's
+        partitions are truncated instead of deleted row by row; other sources
+        are not touched.
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                partition = self._source_partition(cur, self.chunk_table, source)
+                if partition:
+                    cur.execute(f"TRUNCATE {partition};")
+                else:
+                    cur.execute(f"DELETE FROM {self.chunk_table} WHERE source = %s;", (source,))
+                doc_partition = self._source_partition(cur, self.doc_table, source)
+                if doc_partition:
+                    cur.execute(f"TRUNCATE {doc_partition};")
+                else:
+                    cur.execute(f"DELETE FROM {self.doc_table} WHERE source = %s;", (source,))
+                cur.execute(f"""
+                    DELETE FROM {self.state_table} s USING dgsi_documents d
+                    WHERE s.doc_id = d.id AND d.source = %s;
+                """, (source,))
+                if (partition or doc_partition) and self.chunk_table == LEGACY_TABLES[1]:
+                    # TRUNCATE bypasses the stats triggers
+                    self._refresh_stats(cur, source)
+            conn.commit()
+            self._bump_index_version(conn)
+            self.clear_query_cache()
+            truncated = [name for name in (partition, doc_partition) if name]
+            print(f"Cleared {self.model_version} vectors of {source}" + (f" (truncated {', '.join(truncated)})" if truncated else ""))
+            return {"source": source, "truncated_partition": partition, "truncated_doc_partition": doc_partition}
+        finally:
+            conn.close()
+
+    def reindex_source(self, source: str, batch_size: int = 100) -> dict:
+        """Re-embed one source from scratch.
+
+        clear_source() and sync(source=...) run first; then the source's chunk
+        partition is REINDEXed, so its ivfflat lists are trained on the new
+        vectors. The other partitions keep their indexes and keep serving.
+        """
+        start = time.perf_counter()
+        self.clear_source(source)
+        result = self.sync(batch_size=batch_size, source=source)
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                partition = self._source_partition(cur, self.chunk_table, source)
+                if partition:
+                    cur.execute(f"REINDEX TABLE {partition};")
+                doc_partition = self._source_partition(cur, self.doc_table, source)
+                if doc_partition:
+                    cur.execute(f"REINDEX TABLE {doc_partition};")
+            conn.commit()
+        finally:
+            conn.close()
+        return {
+            **result, "source": source, "reindexed_partition": partition,
+            "reindexed_doc_partition": doc_partition, "seconds": time.perf_counter() - start,
+        }
+
+    def _retrieve_by_class_query(self, decision: str, query_embedding: np.ndarray, top_k: int, filter_source: Optional[str]):
+        # The class is a literal, not a parameter, so the planner can match
+        # the per-class partial index predicate.
+        query_sql = pg_sql.SQL("""
+            SELECT {columns}
+            FROM (
+                SELECT c.id, c.embedding <=> %s::{vector_type} AS distance
+                FROM {chunk_table} c
+                WHERE c.embedding IS NOT NULL AND c.decision_class = {decision}
+                {source_filter}
+                ORDER BY distance LIMIT %s
+            ) top
+            JOIN {chunk_table} c ON c.id = top.id
+            JOIN dgsi_documents d ON c.doc_id = d.id
+            ORDER BY top.distance;
+        """).format(
+            chunk_table=pg_sql.Identifier(self.chunk_table),
+            columns=pg_sql.SQL(CHUNK_RESULT_COLUMNS),
+            vector_type=pg_sql.SQL(self.vector_type),
+            decision=pg_sql.Literal(decision),
+            source_filter=pg_sql.SQL("AND c.source = %s" if filter_source else ""),
+        )
+        params = [self._vector_param(query_embedding)]
+        if filter_source:
+            params.append(filter_source)
+        params.append(top_k)
+        return query_sql, params
+
+    @instrumented
+    @cached_results
     def retrieve_by_class(
         self,
         decision: str,
         query: str,
         top_k: int = 5,
         filter_source: Optional[str] = None,
-        min_similarity: float = 0.0
+        min_similarity: float = 0.0,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
         )-> List[ChunkRetrievalResult]:
-        query_embedding = self.generate_embedding(query, use_chunking=False)
-        conn = self.get_connection()
+        """Chunk search restricted to one decision class.
 
-        # Use absolute path to JSON file
-        json_path = os.path.join(os.path.dirname(__file__), "..", "agent", "decision_ids_by_class_ALLSOURCES.json")
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    
-        doc_ids = []
-        for cls, items in data["ids_by_class"].items():
-            if cls == decision:
-                for item in items:
-                    doc_ids.append({
-                        "deci": cls,
-                        "id": int(item["id"]),
-                        "source": item.get("source"),
-                        "variant": item.get("variant"),
-                    })
-
-        try:
-            with conn.cursor() as cur:
-                # join with document metadata
-                sql = """
-                    SELECT 
-                        c.id, c.doc_id, c.chunk_index, c.chunk_text,
-                        d.url, d.processo, d.source, d.sessao_date,
-                        1 - (c.embedding <=> %s::vector) AS similarity
-                    FROM dgsi_document_chunks c
-                    JOIN dgsi_documents d ON c.doc_id = d.id
-                    WHERE c.embedding IS NOT NULL AND d.id = ANY(%s)
-                """
-                params = [query_embedding.tolist(), [item["id"] for item in doc_ids]]
-                if filter_source:
-                    sql += " AND d.source = %s"
-                    params.append(filter_source)
-                
-                sql += " ORDER BY c.embedding <=> %s::vector LIMIT %s;"
-                params.extend([query_embedding.tolist(), top_k])
-                cur.execute(sql, params)
-                rows = cur.fetchall()
+        Rare classes are scanned exactly; common ones use the matching
+        per-class partial index when one exists (see
+        build_vector_indexes(per_class=True)) or the chunk index with raised
+        probes / ef_search (see _plan_filtered). If the approximate scan comes
+        back short of top_k, the query is repeated as an exact scan.
+        """
+        query_embedding = self.embed_query(query)
+        query_sql, params = self._retrieve_by_class_query(decision, query_embedding, top_k, filter_source)
+        plan = self._plan_filtered(top_k, filter_source, decision, probes, ef_search)
+        conn = self.get_connection()
+        try:
+            start = time.perf_counter()
+            with conn.cursor() as cur:
+                if plan["plan"] == "exact":
+                    cur.execute(EXACT_SCAN_SQL)
+                else:
+                    self._apply_search_params(cur, plan["probes"], plan["ef_search"])
+                rows = self._execute_search(cur, "retrieve_by_class", query_sql, params)
+                if len(rows) < top_k and plan["plan"] != "exact":
+                    plan["plan"] = "ann+exact"
+                    cur.execute(EXACT_SCAN_SQL)
+                    rows = self._execute_search(cur, "retrieve_by_class", query_sql, params)
+            conn.rollback()
+            self._log_plan("retrieve_by_class", plan, start, len(rows))
 
-            results = []
-            for row in rows:
-                similarity = float(row[8])
-                if similarity >= min_similarity:
-                    results.append(ChunkRetrievalResult(
-                        chunk_id=row[0],
-                        doc_id=row[1],
-                        chunk_index=row[2],
-                        chunk_text=row[3],
-                        url=row[4],
-                        processo=row[5],
-                        source=row[6],
-                        sessao_date=row[7],
-                        similarity=similarity,
-                        decision=decision
-                    ))
-            
-            return results        
+            return self._chunk_results(rows, min_similarity, decision)
         finally:
             conn.close()
 
 
 def main():
     load_dotenv()
-    parser = argparse.ArgumentParser(description="AI4Juris Document Retriever")
+    parser = argparse.ArgumentParser(
+        description="AI4Juris Document Retriever",
+        epilog="stats reads dgsi_corpus_stats, which triggers keep in step with every INSERT, UPDATE and "
+               "DELETE on dgsi_documents and the legacy vector and chunk tables. A TRUNCATE fires no such "
+               "trigger: after truncating one of them by hand, run --action refresh-stats "
+               "(clear-embeddings, clear-chunks and clear-source already adjust the counts).",
+    )
     parser.add_argument("--db-dsn", type=str, 
                        default=os.getenv("DGSISCRAPER_DB_DSN"),
                        help="PostgreSQL connection string")
     parser.add_argument("--action", type=str, required=True,
-                       choices=["setup", "index", "index-chunks", "search", "search-chunks", "stats", "clear", "clear-chunks", "clear-embeddings"],
+                       choices=["setup", "index", "index-chunks", "sync", "build-index", "index-report", "load-classes", "compact-chunks", "search", "search-chunks", "search-hybrid", "search-many", "index-fts", "stats", "refresh-stats", "pool-documents", "index-dedup", "build-dedup-index", "dedup-report", "search-dedup", "build-quantized-index", "quantization-report", "search-quantized", "two-stage-report", "search-two-stage", "shadow-reindex", "activate-model", "list-models", "retire-model", "clear", "clear-chunks", "clear-embeddings", "clear-source", "reindex-source", "query-plans"],
                        help="Action to perform")
     parser.add_argument("--query", type=str, help="Search query (for search action)")
+    parser.add_argument("--queries-file", type=str, help="File with one query per line (for search-many action)")
     parser.add_argument("--top-k", type=int, default=5, help="Number of results")
     parser.add_argument("--limit", type=int, help="Limit number of docs to index")
-    parser.add_argument("--model", type=str, 
-                       default="neuralmind/bert-base-portuguese-cased",
-                       help="Embedding model name")
+    parser.add_argument("--index-method", type=str, default="ivfflat", choices=["ivfflat", "hnsw"],
+                       help="ANN index type (for build-index action)")
+    parser.add_argument("--index-target", type=str, default="all", choices=["all", "documents", "chunks"],
+                       help="Which embedding column to index (for build-index action)")
+    parser.add_argument("--per-class", action="store_true",
+                       help="Also build per-decision-class partial chunk indexes (for build-index action)")
+    parser.add_argument("--decision-json", type=str, default=DEFAULT_DECISION_JSON,
+                       help="Path to decision_ids_by_class_ALLSOURCES.json (for load-classes action)")
+    parser.add_argument("--lists", type=int, help="ivfflat lists (default: derived from row count)")
+    parser.add_argument("--hnsw-m", type=int, default=16, help="HNSW m")
+    parser.add_argument("--hnsw-ef-construction", type=int, default=64, help="HNSW ef_construction")
+    parser.add_argument("--probes", type=str, help="ivfflat.probes; comma-separated list for index-report on an ivfflat index")
+    parser.add_argument("--ef-search", type=str, help="hnsw.ef_search; comma-separated list for index-report on an hnsw index")
+    parser.add_argument("--quantization", type=str, default="binary", choices=list(QUANTIZATIONS),
+                        help="First-stage representation for build-quantized-index / search-quantized")
+    parser.add_argument("--rerank-factor", type=int, default=4,
+                        help="search-quantized: candidates per result re-scored with float vectors")
+    parser.add_argument("--candidate-docs", type=str,
+                        help="search-two-stage: documents whose chunks are ranked; comma-separated list for two-stage-report")
+    parser.add_argument("--projection", type=str, default="full", choices=list(PROJECTIONS),
+                        help="Result payload for search/search-chunks: full text, snippet or ids only")
+    parser.add_argument("--group-by-document", action="store_true",
+                        help="search-chunks: best chunk per document only")
+    parser.add_argument("--doc-pooling", type=str, choices=list(DOC_POOLINGS),
+                       help="Pool document vectors from chunk vectors (pool-documents; index/sync/search with it)")
+    parser.add_argument("--sparse", action="store_true", default=None,
+                       help="Store TF-IDF embeddings as pgvector sparsevec (pgvector >= 0.7), as a model version "
+                            "of its own (tfidf:<dim>:<chunk_size>:sparsevec:<hash>; build it with shadow-reindex); "
+                            "without it the model's registered vector type is used")
+    parser.add_argument("--model", type=str, choices=list(SUPPORTED_MODELS),
+                       help="Embedding model (default: the registry's active model, else tfidf)")
+    parser.add_argument("--model-path", type=str,
+                       help="Local model directory (with --model sentence-transformers)")
+    parser.add_argument("--encode-batch-size", type=int, default=32, help="sentence-transformers batch size")
+    parser.add_argument("--encode-processes", type=int, default=1,
+                       help="sentence-transformers worker processes for bulk indexing")
+    parser.add_argument("--quantize", type=str, choices=["int8"],
+                       help="sentence-transformers: int8 dynamic quantization (torch backend)")
+    parser.add_argument("--encoder-backend", type=str, default="torch", choices=["torch", "onnx"],
+                       help="sentence-transformers inference backend")
+    parser.add_argument("--embedding-dim", type=int, default=768, help="Embedding dimension (with --model)")
+    parser.add_argument("--chunk-size", type=int, default=512, help="Chunk size in characters (with --model)")
+    parser.add_argument("--model-version", type=str,
+                       help="Registered model version to use; for shadow-reindex, the version to build")
+    parser.add_argument("--activate", action="store_true",
+                       help="shadow-reindex: make the new model active once it is ready")
+    parser.add_argument("--drop-tables", action="store_true",
+                       help="retire-model: also drop the model's tables")
+    parser.add_argument("--source", type=str, help="Source id (for clear-source / reindex-source), e.g. dgsi_stj")
+    parser.add_argument("--explain-sample-rate", type=float, default=0.0,
+                        help="Fraction of similarity queries replayed in the background with EXPLAIN (ANALYZE, BUFFERS) "
+                             "into dgsi_query_plans (default 0: none)")
+    parser.add_argument("--since-hours", type=float, help="query-plans: only plans captured in the last N hours")
     
     args = parser.parse_args()
     
@@ -584,7 +3719,41 @@ def main():
         print("Error: Database DSN not provided.")
         return
     
-    retriever = DocumentRetriever(db_dsn=args.db_dsn, model_name=args.model)
+    probes_values = [int(p) for p in args.probes.split(",") if p.strip()] if args.probes else []
+    ef_search_values = [int(e) for e in args.ef_search.split(",") if e.strip()] if args.ef_search else []
+
+    search_params = {
+        "probes": probes_values[0] if probes_values else None,
+        "ef_search": ef_search_values[0] if ef_search_values else None,
+    }
+    encoder_options = {
+        "batch_size": args.encode_batch_size,
+        "processes": args.encode_processes,
+        "quantize": args.quantize,
+        "backend": args.encoder_backend,
+    }
+    if args.model:
+        retriever = DocumentRetriever(
+            db_dsn=args.db_dsn,
+            model_name=args.model,
+            embedding_dim=args.embedding_dim,
+            chunk_size=args.chunk_size,
+            model_version=args.model_version,
+            sparse=args.sparse,
+            model_path=args.model_path,
+            encoder_options=encoder_options,
+            doc_pooling=args.doc_pooling,
+            explain_sample_rate=args.explain_sample_rate,
+            **search_params,
+        )
+    else:
+        retriever = DocumentRetriever.from_registry(
+            args.db_dsn, model_version=args.model_version, sparse=args.sparse,
+            encoder_options=encoder_options, doc_pooling=args.doc_pooling,
+            explain_sample_rate=args.explain_sample_rate, **search_params
+        )
+    # sampled plans are captured in the background; let them finish before exiting
+    atexit.register(retriever.flush_query_plans)
     
     if args.action == "setup":
         print("Setting up vector schema...")
@@ -601,6 +3770,88 @@ def main():
         retriever.index_all_documents_chunks(limit=args.limit)
         print("Chunk indexing complete!")
         
+    elif args.action == "sync":
+        print("Syncing embeddings with document text...")
+        result = retriever.sync(limit=args.limit)
+        print(f"Documents re-embedded: {result['documents_synced']}")
+        print(f"Chunk sets re-embedded: {result['chunk_sets_synced']}")
+        print("Sync complete!")
+
+    elif args.action == "build-index":
+        targets = ("documents", "chunks") if args.index_target == "all" else (args.index_target,)
+        print(f"Building {args.index_method} index...")
+        retriever.build_vector_indexes(
+            method=args.index_method,
+            targets=targets,
+            lists=args.lists,
+            m=args.hnsw_m,
+            ef_construction=args.hnsw_ef_construction,
+            per_class=args.per_class,
+        )
+        print("Index build complete!")
+
+    elif args.action == "build-quantized-index":
+        print(f"Building {args.quantization} {args.index_method} index...")
+        retriever.build_quantized_index(
+            kind=args.quantization,
+            method=args.index_method,
+            lists=args.lists,
+            m=args.hnsw_m,
+            ef_construction=args.hnsw_ef_construction,
+        )
+        print("Index build complete!")
+
+    elif args.action == "quantization-report":
+        report = retriever.quantization_report(top_k=args.top_k)
+        print(json.dumps(report, indent=2))
+
+    elif args.action == "search-quantized":
+        if not args.query:
+            print("Error: --query required for search-quantized action")
+            return
+        results = retriever.retrieve_chunks_quantized(
+            args.query, top_k=args.top_k, quantization=args.quantization, rerank_factor=args.rerank_factor
+        )
+        for i, result in enumerate(results, 1):
+            print(f"{i}. [Similarity: {result.similarity:.3f}] Chunk {result.chunk_index + 1} from Doc {result.doc_id}")
+            print(f"   Source: {result.source}")
+            print(f"   URL: {result.url}")
+            print(f"   Chunk text: {(result.chunk_text or '')[:300]}...")
+            print()
+
+    elif args.action in ("two-stage-report", "search-two-stage"):
+        candidate_docs = [int(n) for n in args.candidate_docs.split(",") if n.strip()] if args.candidate_docs else []
+        if args.action == "two-stage-report":
+            report = retriever.two_stage_report(candidate_docs=tuple(candidate_docs or (10, 25, 50, 100)), top_k=args.top_k)
+            print(json.dumps(report, indent=2))
+            return
+        if not args.query:
+            print("Error: --query required for search-two-stage action")
+            return
+        results = retriever.retrieve_chunks_two_stage(
+            args.query, top_k=args.top_k, candidate_docs=candidate_docs[0] if candidate_docs else 50,
+            projection=args.projection,
+        )
+        for i, result in enumerate(results, 1):
+            print(f"{i}. [Similarity: {result.similarity:.3f}] Chunk {result.chunk_index + 1} from Doc {result.doc_id}")
+            print(f"   Source: {result.source}")
+            print(f"   URL: {result.url}")
+            print(f"   Chunk text: {(result.chunk_text or '')[:300]}...")
+            print()
+
+    elif args.action == "load-classes":
+        print("Loading decision classes...")
+        retriever.load_decision_classes(args.decision_json)
+        print("Load complete!")
+
+    elif args.action == "index-report":
+        report = retriever.index_report(
+            probes_values=probes_values,
+            ef_search_values=ef_search_values,
+            top_k=args.top_k,
+        )
+        print(json.dumps(report, indent=2))
+
     elif args.action == "stats":
         stats = retriever.get_document_stats()
         print(f"\nDocument Statistics")
@@ -611,6 +3862,44 @@ def main():
         print(f"Documents with chunks: {stats['docs_with_chunks']}")
         print(f"Total chunks: {stats['total_chunks']}")
         print(f"Average chunks per doc: {stats['avg_chunks_per_doc']:.1f}")
+        print(f"\nBy source")
+        for source, source_stats in stats["by_source"].items():
+            print(f"  {source}: {source_stats['total_documents']} docs, "
+                  f"{source_stats['indexed_documents']} indexed, {source_stats['total_chunks']} chunks")
+        print(f"\nBy decision class")
+        for cls, class_stats in sorted(stats["by_class"].items(), key=lambda item: item[0] or ""):
+            print(f"  {cls or '(none)'}: {class_stats['total_documents']} docs, {class_stats['total_chunks']} chunks")
+
+    elif args.action == "index-dedup":
+        print("Indexing deduplicated chunks...")
+        print(json.dumps(retriever.index_dedup_chunks(limit=args.limit), indent=2))
+
+    elif args.action == "build-dedup-index":
+        retriever.build_dedup_index(
+            method=args.index_method, lists=args.lists, m=args.hnsw_m, ef_construction=args.hnsw_ef_construction
+        )
+
+    elif args.action == "dedup-report":
+        print(json.dumps(retriever.dedup_report(), indent=2))
+
+    elif args.action == "search-dedup":
+        if not args.query:
+            print("Error: --query required for search-dedup action")
+            return
+        results = retriever.retrieve_chunks_dedup(args.query, top_k=args.top_k, projection=args.projection)
+        for i, result in enumerate(results, 1):
+            print(f"{i}. [Similarity: {result.similarity:.3f}] Chunk {result.chunk_index + 1} from Doc {result.doc_id} (unique chunk {result.chunk_id})")
+            print(f"   Source: {result.source}")
+            print(f"   URL: {result.url}")
+            print(f"   Chunk text: {(result.chunk_text or '')[:300]}...")
+            print()
+
+    elif args.action == "pool-documents":
+        retriever.pool_document_embeddings(method=args.doc_pooling)
+
+    elif args.action == "refresh-stats":
+        retriever.refresh_stats()
+        print("Corpus statistics recounted")
         
     elif args.action == "search":
         if not args.query:
@@ -618,7 +3907,7 @@ def main():
             return
         
         print(f"\nSearching for: {args.query}")
-        results = retriever.retrieve(args.query, top_k=args.top_k)
+        results = retriever.retrieve(args.query, top_k=args.top_k, projection=args.projection)
         
         print(f"\nTop {len(results)} Results\n")
         for i, result in enumerate(results, 1):
@@ -627,7 +3916,7 @@ def main():
             print(f"   Processo: {result.processo or 'N/A'}")
             print(f"   Date: {result.sessao_date or 'N/A'}")
             print(f"   URL: {result.url}")
-            print(f"   Preview: {result.text_plain[:200]}...")
+            print(f"   Preview: {(result.text_plain or result.snippet or '')[:200]}...")
             print()
     
     elif args.action == "search-chunks":
@@ -636,7 +3925,9 @@ def main():
             return
         
         print(f"\nSearching chunks for: {args.query}")
-        results = retriever.retrieve_chunks(args.query, top_k=args.top_k)
+        results = retriever.retrieve_chunks(
+            args.query, top_k=args.top_k, projection=args.projection, group_by_document=args.group_by_document
+        )
         
         print(f"\nTop {len(results)} Chunk Results\n")
         for i, result in enumerate(results, 1):
@@ -645,9 +3936,79 @@ def main():
             print(f"   Processo: {result.processo or 'N/A'}")
             print(f"   Date: {result.sessao_date or 'N/A'}")
             print(f"   URL: {result.url}")
-            print(f"   Chunk text: {result.chunk_text[:300]}...")
+            print(f"   Chunk text: {(result.chunk_text or '')[:300]}...")
             print()
     
+    elif args.action == "compact-chunks":
+        print("Replacing stored chunk text with offsets...")
+        retriever.compact_chunks()
+        print(f"Compaction complete! Run VACUUM (FULL) {retriever.chunk_table} to return the space.")
+
+    elif args.action == "search-hybrid":
+        if not args.query:
+            print("Error: --query required for search-hybrid action")
+            return
+
+        print(f"\nHybrid search for: {args.query}")
+        results = retriever.retrieve_hybrid(args.query, top_k=args.top_k)
+
+        print(f"\nTop {len(results)} Hybrid Results\n")
+        for i, result in enumerate(results, 1):
+            print(f"{i}. [RRF: {result.score:.4f} | Similarity: {result.similarity:.3f}] Chunk {result.chunk_index + 1} from Doc {result.doc_id}")
+            print(f"   Source: {result.source}")
+            print(f"   Processo: {result.processo or 'N/A'}")
+            print(f"   URL: {result.url}")
+            print(f"   Chunk text: {result.chunk_text[:300]}...")
+            print()
+
+    elif args.action == "search-many":
+        if not args.queries_file:
+            print("Error: --queries-file required for search-many action")
+            return
+
+        with open(args.queries_file, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+        results = retriever.retrieve_many(queries, top_k=args.top_k)
+        for query, query_results in zip(queries, results):
+            print(f"\n{query[:80]}")
+            for i, result in enumerate(query_results, 1):
+                print(f"  {i}. [Similarity: {result.similarity:.3f}] Chunk {result.chunk_index + 1} from Doc {result.doc_id} ({result.source})")
+
+    elif args.action == "index-fts":
+        print("Filling chunk tsvectors...")
+        retriever.fill_chunk_tsvectors()
+        print("Full-text indexing complete!")
+
+    elif args.action == "shadow-reindex":
+        if not args.model:
+            print("Error: --model (and optionally --embedding-dim/--chunk-size/--model-version) required for shadow-reindex")
+            return
+        print(f"Building {retriever.model_version} alongside the active model...")
+        result = retriever.shadow_reindex(
+            limit=args.limit,
+            index_method=args.index_method,
+            activate=args.activate,
+            lists=args.lists,
+            m=args.hnsw_m,
+            ef_construction=args.hnsw_ef_construction,
+        )
+        print(f"Shadow reindex of {result['model_version']} done in {result['seconds']:.1f}s")
+
+    elif args.action == "activate-model":
+        retriever.activate_model(args.model_version)
+
+    elif args.action == "list-models":
+        for model in retriever.list_models():
+            marker = "*" if model["is_active"] else " "
+            print(f"{marker} {model['model_version']} [{model['status']}] dim={model['embedding_dim']} "
+                  f"{model['vector_type']} chunks~{model['approx_chunks']} ({model['chunk_table']})")
+
+    elif args.action == "retire-model":
+        if not args.model_version:
+            print("Error: --model-version required for retire-model")
+            return
+        retriever.retire_model(args.model_version, drop_tables=args.drop_tables)
+
     elif args.action == "clear":
         print("Clearing all chunks and embeddings...")
         retriever.clear_all()
@@ -663,6 +4024,20 @@ def main():
         retriever.clear_all_embeddings()
         print("Clear embeddings complete!")
 
+    elif args.action in ("clear-source", "reindex-source"):
+        if not args.source:
+            print(f"Error: --source required for {args.action}")
+            return
+        if args.action == "clear-source":
+            retriever.clear_source(args.source)
+        else:
+            result = retriever.reindex_source(args.source)
+            print(json.dumps(result, indent=2))
+
+    elif args.action == "query-plans":
+        summary = retriever.query_plan_summary(limit=args.limit or 20, since_hours=args.since_hours)
+        print(json.dumps(summary, indent=2))
+
 
 if __name__ == "__main__":
     main()
@@ -15,8 +15,10 @@ from bs4 import BeautifulSoup
 
 try:
     import psycopg
+    from psycopg import sql as pg_sql
 except Exception: 
     psycopg = None
+    pg_sql = None
 
 HEADERS = {
     "User-Agent": "AI4Juris-DGSI-Scraper/1.0"
@@ -37,16 +39,109 @@ def db_connect():
     return psycopg.connect(DB_DSN)
 
 
+def db_is_partitioned(cur, table: str = "dgsi_documents") -> bool:
+    """True when table exists and is a partitioned table."""
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def partition_name(table: str, source: str) -> str:
+    """Name of the LIST partition of table holding one source (e.g. dgsi_documents_stj)."""
+    slug = re.sub(r"[^a-z0-9]+", "_", source.lower()).strip("_")
+    slug = slug[len("dgsi_"):] if slug.startswith("dgsi_") else slug
+    name = f"{table}_{slug or 'source'}"
+    if len(name) > 63:
+        # Postgres truncates identifiers at 63 bytes; keep names distinct
+        name = f"{name[:56]}_{hashlib.sha256(source.encode('utf-8')).hexdigest()[:6]}"
+    return name
+
+
+# Postgres truncates identifiers at 63 bytes; index names leave room for the
+# "_new" suffix they are rebuilt under (retriever._swap_build_index)
+MAX_INDEX_NAME = 63 - len("_new")
+
+
+def db_index_name(name: str) -> str:
+    """name, or its first bytes and a short hash of it when longer than MAX_INDEX_NAME."""
+    if len(name) <= MAX_INDEX_NAME:
+        return name
+    return f"{name[:MAX_INDEX_NAME - 7]}_{hashlib.sha256(name.encode('utf-8')).hexdigest()[:6]}"
+
+
+def db_source_partitions(cur, table: str = "dgsi_documents") -> dict[Optional[str], str]:
+    """source -> partition of a table LIST-partitioned by source (None for the DEFAULT partition)."""
+    cur.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s);
+        """,
+        (table,),
+    )
+    partitions: dict[Optional[str], str] = {}
+    for name, bound in cur.fetchall():
+        if bound == "DEFAULT":
+            partitions[None] = name
+            continue
+        for value in re.findall(r"'((?:[^']|'')*)'", bound):
+            partitions[value.replace("''", "'")] = name
+    return partitions
+
+
+def db_ensure_source_partitions(cur, table: str, sources: Iterable[str]) -> list[str]:
+    """Create the missing partitions of table for sources, and its DEFAULT partition.
+
+    Rows of a source that landed in the DEFAULT partition make its CREATE fail;
+    they have to be removed (partitioning.py drop-source) before the source gets
+    its own partition.
+    """
+    existing = db_source_partitions(cur, table)
+    created = []
+    for source in dict.fromkeys(sources):
+        if source in existing:
+            continue
+        name = partition_name(table, source)
+        cur.execute(
+            pg_sql.SQL("CREATE TABLE {} PARTITION OF {} FOR VALUES IN ({});").format(
+                pg_sql.Identifier(name), pg_sql.Identifier(table), pg_sql.Literal(source)
+            )
+        )
+        created.append(name)
+    if None not in existing:
+        name = f"{table}_default"
+        cur.execute(f"CREATE TABLE {name} PARTITION OF {table} DEFAULT;")
+        created.append(name)
+    return created
+
+
+def db_document_fk(cur, column: str) -> str:
+    """Table constraint making column reference dgsi_documents.
+
+    A partitioned dgsi_documents is only unique on (id, source), so the
+    referencing table also needs a source column.
+    """
+    if db_is_partitioned(cur):
+        return f"FOREIGN KEY ({column}, source) REFERENCES dgsi_documents(id, source) ON DELETE CASCADE"
+    return f"FOREIGN KEY ({column}) REFERENCES dgsi_documents(id) ON DELETE CASCADE"
+
+
 def db_ensure_schema(conn) -> None:
-    """Create table/indexes if they do not exist."""
+    """Create table/indexes if they do not exist.
+
+    A new dgsi_documents is LIST-partitioned by source, one partition per
+    entry of SOURCES plus a DEFAULT one, so source-filtered queries only read
+    their partition. An existing unpartitioned table is left as it is
+    (partitioning.py converts it).
+    """
     with conn.cursor() as cur:
         cur.execute(
             """
             CREATE TABLE IF NOT EXISTS dgsi_documents (
-              id BIGSERIAL PRIMARY KEY,
+              id BIGSERIAL,
               source TEXT NOT NULL,
               base_name TEXT NOT NULL,
-              url TEXT NOT NULL UNIQUE,
+              url TEXT NOT NULL,
               processo TEXT,
               sessao_date TEXT,
               relator TEXT,
@@ -55,11 +150,16 @@ def db_ensure_schema(conn) -> None:
               text_plain TEXT NOT NULL,
               text_gzip BYTEA NOT NULL,
               extra JSONB NOT NULL DEFAULT '{}'::jsonb,
-              fetched_at TIMESTAMPTZ NOT NULL DEFAULT now()
-            );
+              fetched_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+              PRIMARY KEY (id, source),
+              CONSTRAINT dgsi_documents_url_key UNIQUE (url, source)
+            ) PARTITION BY LIST (source);
             """
         )
-        cur.execute("CREATE INDEX IF NOT EXISTS dgsi_documents_source_idx ON dgsi_documents(source);")
+        if db_is_partitioned(cur):
+            db_ensure_source_partitions(cur, "dgsi_documents", [s["source"] for s in SOURCES])
+        else:
+            cur.execute("CREATE INDEX IF NOT EXISTS dgsi_documents_source_idx ON dgsi_documents(source);")
         cur.execute("CREATE INDEX IF NOT EXISTS dgsi_documents_sessao_date_idx ON dgsi_documents(sessao_date);")
         cur.execute(
             "CREATE INDEX IF NOT EXISTS dgsi_documents_descritores_gin_idx ON dgsi_documents USING GIN (descritores);"
@@ -118,7 +218,12 @@ def search_documents(
 
 def db_count_source(conn, source: str) -> int:
     with conn.cursor() as cur:
-        cur.execute("SELECT COUNT(*) FROM dgsi_documents WHERE source = %s;", (source,))
+        # dgsi_corpus_stats is kept up to date by triggers once the retriever schema is set up
+        cur.execute("SELECT to_regclass('dgsi_corpus_stats') IS NOT NULL;")
+        if cur.fetchone()[0]:
+            cur.execute("SELECT COALESCE(SUM(documents), 0) FROM dgsi_corpus_stats WHERE source = %s;", (source,))
+        else:
+            cur.execute("SELECT COUNT(*) FROM dgsi_documents WHERE source = %s;", (source,))
         return int(cur.fetchone()[0])
 
 def parse_source_limits(spec: str | None) -> dict[str, int]:
@@ -138,14 +243,36 @@ def parse_source_limits(spec: str | None) -> dict[str, int]:
         out[k] = int(v)
     return out
 
+def db_bump_index_versions(conn) -> None:
+    """Make the retriever's cached results stale for every model (no-op before its schema exists)."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'dgsi_embedding_models' AND column_name = 'index_version'
+            );
+        """)
+        if cur.fetchone()[0]:
+            cur.execute("UPDATE dgsi_embedding_models SET index_version = index_version + 1;")
+    conn.commit()
+
 def db_upsert_doc(conn, rec: "DocRecord", text_hash: str, text_gz: bytes) -> bool:
-    """Insert/update a document row."""
+    """Insert/update a document row.
+
+    Cached retriever results carry the text of the documents, so a rewrite
+    that changes text_sha256 bumps the index version of every model.
+    """
     extra_json = json.dumps(rec.extra, ensure_ascii=False)
     fetched_at = datetime.now(timezone.utc)
 
     with conn.cursor() as cur:
+        # xmax can't be read from a partitioned table, so look for the row first;
+        # the url constraint is (url) on the legacy table and (url, source) on the partitioned one
         cur.execute(
             """
+            WITH existing AS (
+            SELECT text_sha256 FROM dgsi_documents WHERE url = %s
+            )
             INSERT INTO dgsi_documents (
             source, base_name, url, processo, sessao_date, relator,
             descritores, text_sha256, text_plain, text_gzip, extra, fetched_at
@@ -153,7 +280,7 @@ def db_upsert_doc(conn, rec: "DocRecord", text_hash: str, text_gz: bytes) -> boo
             %s, %s, %s, %s, %s, %s,
             %s, %s, %s, %s, %s::jsonb, %s
             )
-            ON CONFLICT (url) DO UPDATE SET
+            ON CONFLICT ON CONSTRAINT dgsi_documents_url_key DO UPDATE SET
             source = EXCLUDED.source,
             base_name = EXCLUDED.base_name,
             processo = EXCLUDED.processo,
@@ -165,9 +292,13 @@ def db_upsert_doc(conn, rec: "DocRecord", text_hash: str, text_gz: bytes) -> boo
             text_gzip = EXCLUDED.text_gzip,
             extra = EXCLUDED.extra,
             fetched_at = EXCLUDED.fetched_at
-            RETURNING (xmax = 0) AS inserted;
+            RETURNING NOT EXISTS (SELECT 1 FROM existing) AS inserted,
+            EXISTS (
+                SELECT 1 FROM existing e WHERE e.text_sha256 IS DISTINCT FROM dgsi_documents.text_sha256
+            ) AS text_changed;
             """,
             (
+                rec.url,
                 rec.source,
                 rec.base_name,
                 rec.url,
@@ -182,9 +313,11 @@ def db_upsert_doc(conn, rec: "DocRecord", text_hash: str, text_gz: bytes) -> boo
                 fetched_at,
             ),
         )
-        inserted = bool(cur.fetchone()[0])
+        inserted, text_changed = cur.fetchone()
     conn.commit()
-    return inserted
+    if text_changed:
+        db_bump_index_versions(conn)
+    return bool(inserted)
 
 
 @dataclass
@@ -0,0 +1,78 @@
+"""Fixtures for the dgsi_scraper tests.
+
+Database tests run against DGSISCRAPER_TEST_DSN (PostgreSQL with pgvector)
+and are skipped when it is not set. Its public schema is dropped and
+recreated for every test: never point it at a database you want to keep.
+"""
+import gzip
+import hashlib
+import os
+import random
+
+import pytest
+
+TEST_DSN = os.getenv("DGSISCRAPER_TEST_DSN")
+
+SOURCES = ("dgsi_stj", "dgsi_sta", "dgsi_trp")
+WORDS = (
+    "tribunal recurso acordao processo penal civil contrato arrendamento despejo crime furto "
+    "homicidio prova testemunha sentença juiz relator apelação revista direito dever obrigação "
+    "indemnização danos morais patrimoniais responsabilidade seguro acidente viação trabalho "
+    "despedimento justa causa salário férias"
+).split()
+
+
+def random_text(rng: random.Random) -> str:
+    """A few hundred words from WORDS and one of eight topic vocabularies."""
+    topic = rng.randrange(8)
+    pool = WORDS + [f"t{topic}w{k}" for k in range(60)] + [f"g{k}" for k in range(400)]
+    return " ".join(rng.choice(pool) for _ in range(rng.randint(50, 600)))
+
+
+@pytest.fixture
+def dsn():
+    """DSN of an empty test database with the scraper's schema."""
+    if not TEST_DSN:
+        pytest.skip("DGSISCRAPER_TEST_DSN is not set")
+    psycopg = pytest.importorskip("psycopg")
+    from dgsi_scraper import scrape
+
+    with psycopg.connect(TEST_DSN) as conn:
+        conn.execute("DROP SCHEMA public CASCADE;")
+        conn.execute("CREATE SCHEMA public;")
+        conn.commit()
+        scrape.db_ensure_schema(conn)
+    return TEST_DSN
+
+
+@pytest.fixture
+def corpus(dsn):
+    """DSN of a test database with 60 random documents over SOURCES."""
+    import psycopg
+
+    rng = random.Random(0)
+    with psycopg.connect(dsn) as conn:
+        for i in range(60):
+            text = random_text(rng)
+            conn.execute(
+                """
+                INSERT INTO dgsi_documents (source, base_name, url, processo, text_sha256, text_plain, text_gzip)
+                VALUES (%s, 'test', %s, %s, %s, %s, %s);
+                """,
+                (
+                    rng.choice(SOURCES), f"http://test/{i}", f"P{i}",
+                    hashlib.sha256(text.encode("utf-8")).hexdigest(), text, gzip.compress(text.encode("utf-8")),
+                ),
+            )
+    return dsn
+
+
+@pytest.fixture
+def retriever(corpus):
+    """TF-IDF DocumentRetriever over corpus, set up and synced (documents and chunks)."""
+    from dgsi_scraper.retriever import DocumentRetriever
+
+    r = DocumentRetriever(corpus, embedding_dim=256, chunk_size=200)
+    r.ensure_vector_schema()
+    r.sync()
+    return r
@@ -0,0 +1,36 @@
+def test_fill_chunk_tsvectors_visits_every_chunk_once(retriever):
+    with retriever.get_connection() as conn:
+        chunks = conn.execute(f"SELECT count(*) FROM {retriever.chunk_table};").fetchone()[0]
+        conn.execute(f"UPDATE {retriever.chunk_table} SET text_tsv = NULL;")
+        # chunks whose text resolves to NULL still get a (empty) tsvector
+        conn.execute(f"""
+            UPDATE {retriever.chunk_table} SET start_offset = NULL
+            WHERE id IN (SELECT id FROM {retriever.chunk_table} ORDER BY id LIMIT 3);
+        """)
+
+    assert retriever.fill_chunk_tsvectors(batch_size=7) == chunks
+    with retriever.get_connection() as conn:
+        missing = conn.execute(f"SELECT count(*) FROM {retriever.chunk_table} WHERE text_tsv IS NULL;").fetchone()[0]
+    assert missing == 0
+    assert retriever.fill_chunk_tsvectors() == 0
+
+
+def test_fill_chunk_tsvectors_bumps_index_version_once(retriever):
+    with retriever.get_connection() as conn:
+        conn.execute(f"UPDATE {retriever.chunk_table} SET text_tsv = NULL;")
+    before = retriever.index_version()
+
+    retriever.fill_chunk_tsvectors(batch_size=5)
+    assert retriever.index_version() == before + 1
+    retriever.fill_chunk_tsvectors()
+    assert retriever.index_version() == before + 1
+
+
+def test_hybrid_search_finds_backfilled_chunks(retriever):
+    with retriever.get_connection() as conn:
+        conn.execute(f"UPDATE {retriever.chunk_table} SET text_tsv = NULL;")
+    retriever.fill_chunk_tsvectors()
+
+    results = retriever.retrieve_hybrid("arrendamento despejo", top_k=5)
+    assert len(results) == 5
+    assert "arrendamento" in results[0].chunk_text or "despejo" in results[0].chunk_text
@@ -0,0 +1,47 @@
+import pytest
+
+
+@pytest.fixture
+def copied(retriever):
+    """retriever with its chunks stored as before offsets: a whitespace-normalized chunk_text copy."""
+    with retriever.get_connection() as conn:
+        conn.execute(f"""
+            UPDATE {retriever.chunk_table} c
+            SET chunk_text = regexp_replace(substr(d.text_plain, c.start_offset + 1, c.end_offset - c.start_offset), '\\s+', ' ', 'g'),
+                start_offset = NULL, end_offset = NULL
+            FROM dgsi_documents d WHERE d.id = c.doc_id;
+        """)
+    return retriever
+
+
+def chunk_rows(retriever, doc_id: int):
+    with retriever.get_connection() as conn:
+        return conn.execute(f"""
+            SELECT c.chunk_text, substr(d.text_plain, c.start_offset + 1, c.end_offset - c.start_offset)
+            FROM {retriever.chunk_table} c JOIN dgsi_documents d ON d.id = c.doc_id
+            WHERE c.doc_id = %s ORDER BY c.chunk_index;
+        """, (doc_id,)).fetchall()
+
+
+def test_chunk_copies_become_spans(copied):
+    before = [text for text, _ in chunk_rows(copied, 1)]
+    assert copied.compact_chunks(batch_size=25) == {"documents_compacted": 60, "documents_skipped": 0}
+    after = chunk_rows(copied, 1)
+    assert all(text is None for text, _ in after)
+    assert [" ".join(span.split()) for _, span in after] == before
+
+
+def test_changed_text_with_the_same_chunk_count_is_not_compacted(copied):
+    # same-length words: the spans (and their count) don't change, the text does
+    with copied.get_connection() as conn:
+        doc_id = conn.execute(
+            "SELECT id FROM dgsi_documents WHERE text_plain LIKE '%furto%' ORDER BY id LIMIT 1;"
+        ).fetchone()[0]
+        conn.execute("UPDATE dgsi_documents SET text_plain = replace(text_plain, 'furto', 'prova') WHERE id = %s;", (doc_id,))
+    stored = chunk_rows(copied, doc_id)
+
+    assert copied.compact_chunks() == {"documents_compacted": 59, "documents_skipped": 1}
+    assert chunk_rows(copied, doc_id) == stored
+    # text_sha256 was not updated; the chunks are re-embedded all the same
+    assert copied.sync() == {"documents_synced": 0, "chunk_sets_synced": 1}
+    assert all("furto" not in span for _, span in chunk_rows(copied, doc_id))
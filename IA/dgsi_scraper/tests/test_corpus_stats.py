@@ -0,0 +1,105 @@
+import gzip
+import hashlib
+
+import pytest
+
+from dgsi_scraper.retriever import LEGACY_TABLES, DocumentRetriever
+
+COUNTS_SQL = f"""
+    SELECT COALESCE(source, '') AS source, COALESCE(decision_class, '') AS decision_class,
+           COUNT(*) AS documents, 0 AS indexed_documents, 0 AS chunks, 0 AS indexed_chunks, 0 AS docs_with_chunks
+    FROM dgsi_documents GROUP BY 1, 2
+    UNION ALL
+    SELECT COALESCE(source, ''), COALESCE(decision_class, ''), 0, COUNT(*) FILTER (WHERE embedding IS NOT NULL), 0, 0, 0
+    FROM {LEGACY_TABLES[0]} GROUP BY 1, 2
+    UNION ALL
+    SELECT COALESCE(source, ''), COALESCE(decision_class, ''), 0, 0,
+           COUNT(*), COUNT(*) FILTER (WHERE embedding IS NOT NULL), COUNT(*) FILTER (WHERE chunk_index = 0)
+    FROM {LEGACY_TABLES[1]} GROUP BY 1, 2
+"""
+
+
+def counted(conn) -> dict:
+    """(source, decision_class) -> counters, recounted from the tables."""
+    return {
+        (source, decision_class): totals
+        for source, decision_class, *totals in conn.execute(f"""
+            SELECT source, decision_class, SUM(documents), SUM(indexed_documents),
+                   SUM(chunks), SUM(indexed_chunks), SUM(docs_with_chunks)
+            FROM ({COUNTS_SQL}) c GROUP BY 1, 2;
+        """)
+    }
+
+
+def tracked(conn) -> dict:
+    """(source, decision_class) -> counters, as kept in dgsi_corpus_stats (all-zero rows left out)."""
+    return {
+        (source, decision_class): totals
+        for source, decision_class, *totals in conn.execute("""
+            SELECT source, decision_class, documents, indexed_documents, chunks, indexed_chunks, docs_with_chunks
+            FROM dgsi_corpus_stats;
+        """)
+        if any(totals)
+    }
+
+
+@pytest.fixture
+def stats(retriever):
+    """retriever with some documents labelled, and a connection to check the stats with."""
+    with retriever.get_connection() as conn:
+        # no transaction left open to block the retriever's DDL
+        conn.autocommit = True
+        for table in ("dgsi_documents", *LEGACY_TABLES[:2]):
+            key = "id" if table != LEGACY_TABLES[1] else "doc_id"
+            conn.execute(f"UPDATE {table} SET decision_class = 'procedente' WHERE {key} <= 20;")
+        assert tracked(conn) == counted(conn)
+        yield conn
+
+
+def test_insert_is_counted(retriever, stats):
+    text = "contrato despejo arrendamento " * 40
+    doc_id = stats.execute("""
+        INSERT INTO dgsi_documents (source, base_name, url, processo, text_sha256, text_plain, text_gzip, decision_class)
+        VALUES ('dgsi_nova', 'test', 'http://test/nova', 'PN', %s, %s, %s, 'procedente') RETURNING id;
+    """, (hashlib.sha256(text.encode()).hexdigest(), text, gzip.compress(text.encode()))).fetchone()[0]
+    assert retriever.index_document(doc_id, text)
+    assert retriever.index_document_chunks(doc_id, text)
+    assert tracked(stats) == counted(stats)
+    assert tracked(stats)[("dgsi_nova", "procedente")][0] == 1
+
+
+def test_updates_are_counted(retriever, stats):
+    # a class change on every table
+    for table, key in (("dgsi_documents", "id"), (LEGACY_TABLES[0], "id"), (LEGACY_TABLES[1], "doc_id")):
+        stats.execute(f"UPDATE {table} SET decision_class = 'improcedente' WHERE {key} BETWEEN 15 AND 30;")
+    assert tracked(stats) == counted(stats)
+
+    # embeddings NULL -> non-NULL
+    stats.execute(f"UPDATE {LEGACY_TABLES[0]} SET embedding = NULL WHERE id <= 10;")
+    stats.execute(f"UPDATE {LEGACY_TABLES[1]} SET embedding = NULL WHERE doc_id <= 10;")
+    assert tracked(stats) == counted(stats)
+    stats.execute(f"UPDATE {retriever.state_table} SET doc_sha256 = NULL, chunks_sha256 = NULL WHERE doc_id <= 10;")
+    assert retriever.sync() == {"documents_synced": 10, "chunk_sets_synced": 10}
+    assert tracked(stats) == counted(stats)
+
+
+def test_deletes_are_counted(stats):
+    # chunks and vectors go with their documents (ON DELETE CASCADE)
+    stats.execute("DELETE FROM dgsi_documents WHERE id IN (3, 25, 41);")
+    stats.execute(f"DELETE FROM {LEGACY_TABLES[1]} WHERE doc_id = 50 AND chunk_index > 0;")
+    assert tracked(stats) == counted(stats)
+
+
+def test_refresh_stats_recounts_after_truncate(retriever, stats):
+    stats.execute(f"TRUNCATE {LEGACY_TABLES[1]};")
+    # TRUNCATE fires no trigger
+    assert tracked(stats) != counted(stats)
+    retriever.refresh_stats()
+    assert tracked(stats) == counted(stats)
+
+
+def test_other_models_are_not_counted(retriever, stats):
+    other = DocumentRetriever(retriever.db_dsn, embedding_dim=128, chunk_size=150)
+    other.ensure_vector_schema()
+    other.sync()
+    assert tracked(stats) == counted(stats)
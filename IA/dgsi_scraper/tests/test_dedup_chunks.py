@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+SHARED_DOCS = range(1, 31)
+
+
+@pytest.fixture
+def terms(retriever):
+    """40 single words of the fitted TF-IDF vocabulary."""
+    return [t for t in retriever.vectorizer.get_feature_names_out() if " " not in t][:40]
+
+
+@pytest.fixture
+def query(terms):
+    """A query matching the boilerplate header."""
+    return " ".join(terms[:8])
+
+
+@pytest.fixture
+def dedup(retriever, terms):
+    """retriever with documents 1-30 sharing a boilerplate header, indexed in the deduplicated layout."""
+    boilerplate = " ".join(terms * 3) + " "
+    with retriever.get_connection() as conn:
+        conn.execute(
+            "UPDATE dgsi_documents SET text_plain = %s || text_plain, text_sha256 = md5(%s || text_plain) WHERE id <= 30;",
+            (boilerplate, boilerplate)
+        )
+    retriever.index_dedup_chunks(batch_size=25)
+    return retriever
+
+
+def orphans(retriever) -> int:
+    unique_table, map_table = retriever.dedup_tables
+    with retriever.get_connection() as conn:
+        return conn.execute(f"""
+            SELECT count(*) FROM {unique_table} u
+            WHERE NOT EXISTS (SELECT 1 FROM {map_table} m WHERE m.unique_id = u.id);
+        """).fetchone()[0]
+
+
+def test_shared_chunks_are_stored_once(dedup):
+    unique_table, map_table = dedup.dedup_tables
+    with dedup.get_connection() as conn:
+        mapped, unique = conn.execute(
+            f"SELECT count(*), count(DISTINCT unique_id) FROM {map_table};"
+        ).fetchone()
+        shared = conn.execute(f"SELECT max(doc_count) FROM {unique_table};").fetchone()[0]
+    assert unique < mapped
+    assert shared == len(SHARED_DOCS)
+    assert dedup.index_dedup_chunks()["documents"] == 0
+
+
+def test_fan_out_is_capped_per_chunk(dedup, query):
+    results = dedup.retrieve_chunks_dedup(query, top_k=5)
+    per_chunk = {}
+    for r in results:
+        per_chunk.setdefault(r.chunk_id, set()).add(r.doc_id)
+    assert len(results) == 5
+    assert max(len(docs) for docs in per_chunk.values()) <= 3
+
+    uncapped = dedup.retrieve_chunks_dedup(query, top_k=5, max_documents_per_chunk=10)
+    assert len({r.chunk_id for r in uncapped}) < len(per_chunk)
+
+
+def test_decision_filter_applies_before_the_limit(dedup, query):
+    _, map_table = dedup.dedup_tables
+    with dedup.get_connection() as conn:
+        conn.execute("UPDATE dgsi_documents SET decision_class = 'rara' WHERE id = 7;")
+        conn.execute(f"UPDATE {map_table} SET decision_class = 'rara' WHERE doc_id = 7;")
+    results = dedup.retrieve_chunks_dedup(query, top_k=3, decision="rara")
+    assert len(results) == 3
+    assert {r.doc_id for r in results} == {7}
+
+
+def test_relabelled_document_is_found_by_its_new_class(dedup, query, tmp_path):
+    path = tmp_path / "classes.json"
+    for label in ("rara", "outra"):
+        path.write_text(json.dumps({"ids_by_class": {label: [{"id": 7}]}}), encoding="utf-8")
+        dedup.load_decision_classes(str(path))
+    assert dedup.retrieve_chunks_dedup(query, top_k=3, decision="rara") == []
+    results = dedup.retrieve_chunks_dedup(query, top_k=3, decision="outra")
+    assert len(results) == 3
+    assert {r.doc_id for r in results} == {7}
+
+
+def test_short_ann_scan_is_repeated_exactly(dedup, query, monkeypatch):
+    execute = dedup._execute_search
+    calls = []
+
+    def short_first(cur, method, sql, params):
+        calls.append(method)
+        rows = execute(cur, method, sql, params)
+        return rows[:1] if len(calls) == 1 else rows
+    monkeypatch.setattr(dedup, "_execute_search", short_first)
+
+    results = dedup.retrieve_chunks_dedup(query, top_k=5)
+    assert len(calls) == 2
+    assert dedup.last_plan["plan"] == "ann+exact"
+    assert len(results) == 5
+
+
+def test_changed_text_is_mapped_again(dedup):
+    _, map_table = dedup.dedup_tables
+    prefix = "novo cabeçalho do documento quarenta "
+    with dedup.get_connection() as conn:
+        conn.execute(
+            "UPDATE dgsi_documents SET text_plain = %s || text_plain, text_sha256 = md5(%s || text_plain) WHERE id = 40;",
+            (prefix, prefix)
+        )
+    assert dedup.index_dedup_chunks()["documents"] == 1
+
+    with dedup.get_connection() as conn:
+        text = conn.execute("SELECT text_plain FROM dgsi_documents WHERE id = 40;").fetchone()[0]
+        rows = conn.execute(f"""
+            SELECT m.start_offset, m.end_offset, u.chunk_sha256
+            FROM {map_table} m JOIN {dedup.dedup_tables[0]} u ON u.id = m.unique_id
+            WHERE m.doc_id = 40 ORDER BY m.chunk_index;
+        """).fetchall()
+    assert rows[0][0] == 0 and rows[-1][1] == len(text)
+    assert all(dedup._chunk_hash(text[start:end]) == digest for start, end, digest in rows)
+    assert orphans(dedup) == 0
@@ -0,0 +1,77 @@
+import pytest
+
+from dgsi_scraper.retriever import LEGACY_TABLES, DocumentRetriever
+
+
+@pytest.fixture
+def inline(retriever):
+    """retriever's database rolled back to vectors stored in dgsi_documents.embedding.
+
+    Only even document ids keep a vector; the registry still names
+    dgsi_documents as the model's doc table.
+    """
+    with retriever.get_connection() as conn:
+        conn.execute("UPDATE dgsi_embedding_models SET doc_table = 'dgsi_documents';")
+        conn.execute("ALTER TABLE dgsi_documents ADD COLUMN embedding vector(256);")
+        conn.execute(f"""
+            UPDATE dgsi_documents d SET embedding = v.embedding
+            FROM {LEGACY_TABLES[0]} v WHERE v.id = d.id AND d.id % 2 = 0;
+        """)
+        conn.execute(f"DROP TABLE {LEGACY_TABLES[0]};")
+    return retriever
+
+
+def new_retriever(dsn: str) -> DocumentRetriever:
+    # loads the vocabulary the vectors in the database were made with
+    return DocumentRetriever(dsn, embedding_dim=256, chunk_size=200)
+
+
+def inline_column(conn) -> bool:
+    return conn.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'dgsi_documents' AND column_name = 'embedding'
+        );
+    """).fetchone()[0]
+
+
+def test_setup_moves_inline_vectors(inline):
+    r = new_retriever(inline.db_dsn)
+    r.ensure_vector_schema()
+    with r.get_connection() as conn:
+        assert not inline_column(conn)
+        assert conn.execute(f"SELECT count(*) FROM {LEGACY_TABLES[0]};").fetchone()[0] == 30
+        assert conn.execute("SELECT doc_table FROM dgsi_embedding_models;").fetchone()[0] == LEGACY_TABLES[0]
+    # the index state still holds: nothing to re-embed
+    assert r.sync()["documents_synced"] == 0
+
+
+def test_first_write_before_setup_creates_the_table(inline):
+    r = new_retriever(inline.db_dsn)
+    assert r.doc_table == LEGACY_TABLES[0]
+    with r.get_connection() as conn:
+        doc_id, text = conn.execute("SELECT id, text_plain FROM dgsi_documents WHERE id = 1;").fetchone()
+    assert r.index_document(doc_id, text)
+    with r.get_connection() as conn:
+        assert not inline_column(conn)
+        assert conn.execute(f"SELECT count(*) FROM {LEGACY_TABLES[0]};").fetchone()[0] == 31
+
+
+def test_registry_row_never_names_dgsi_documents(inline):
+    r = DocumentRetriever.from_registry(inline.db_dsn)
+    assert r.doc_table == LEGACY_TABLES[0]
+    with r.get_connection() as conn:
+        conn.execute("UPDATE dgsi_embedding_models SET is_active = false;")
+    r.retire_model(r.model_version, drop_tables=True)
+    with r.get_connection() as conn:
+        assert conn.execute("SELECT to_regclass('dgsi_documents') IS NOT NULL;").fetchone()[0]
+
+
+def test_reindexing_leaves_document_rows_alone(retriever):
+    with retriever.get_connection() as conn:
+        versions = conn.execute("SELECT id, xmin::text FROM dgsi_documents ORDER BY id;").fetchall()
+    retriever.clear_all_embeddings()
+    retriever.index_all_documents()
+    with retriever.get_connection() as conn:
+        assert conn.execute("SELECT id, xmin::text FROM dgsi_documents ORDER BY id;").fetchall() == versions
+        assert conn.execute(f"SELECT count(*) FROM {retriever.doc_table};").fetchone()[0] == 60
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+from dgsi_scraper.retriever import DocumentRetriever
+
+# terms of the 256-feature TF-IDF vocabulary fitted on the corpus fixture
+QUERIES = ["contrato despejo", "crime furto", "danos despedimento"]
+RARE_IDS = (41, 42, 43)
+
+
+def similarities(results):
+    # ties make the chunk order ambiguous; the scores are not
+    return [round(r.similarity, 5) for r in results]
+
+
+@pytest.fixture
+def classified(retriever, tmp_path):
+    """retriever with a common and a rare decision class and an ivfflat chunk index."""
+    path = tmp_path / "classes.json"
+    path.write_text(json.dumps({"ids_by_class": {
+        "comum": [{"id": i} for i in range(1, 41)],
+        "rara": [{"id": i} for i in RARE_IDS],
+    }}), encoding="utf-8")
+    retriever.load_decision_classes(str(path))
+    retriever.build_vector_indexes(method="ivfflat", targets=("chunks",), lists=10)
+    retriever.refresh_stats()
+    return retriever
+
+
+@pytest.fixture
+def short_first_scan(monkeypatch):
+    """Make the first similarity query of a call drop the rows of the given query position."""
+    def install(retriever, position=0):
+        execute = retriever._execute_search
+        calls = []
+
+        def short_first(cur, method, sql, params):
+            rows = execute(cur, method, sql, params)
+            calls.append(method)
+            if len(calls) > 1:
+                return rows
+            if method == "retrieve_many":
+                return [row for row in rows if row[0] != position + 1]
+            return rows[:1]
+        monkeypatch.setattr(retriever, "_execute_search", short_first)
+        return calls
+    return install
+
+
+def test_rare_class_is_scanned_exactly(classified):
+    results = classified.retrieve_by_class("rara", "crime furto", top_k=5)
+    assert classified.last_plan["plan"] == "exact"
+    assert results and all(r.doc_id in RARE_IDS for r in results)
+
+
+def test_common_class_uses_the_index(classified):
+    classified.exact_scan_rows = 0
+    results = classified.retrieve_by_class("comum", "crime furto", top_k=5)
+    assert classified.last_plan["plan"] == "ann"
+    assert classified.last_plan["probes"] > 1
+    assert len(results) == 5 and all(r.doc_id <= 40 for r in results)
+
+
+def test_retrieve_by_class_refills_a_short_ann_scan(classified, short_first_scan):
+    exact = classified.retrieve_by_class("comum", "contrato despejo", top_k=5)
+    classified.exact_scan_rows = 0
+    calls = short_first_scan(classified)
+
+    results = classified.retrieve_by_class("comum", "contrato despejo", top_k=5)
+    assert calls == ["retrieve_by_class", "retrieve_by_class"]
+    assert classified.last_plan["plan"] == "ann+exact"
+    assert similarities(results) == similarities(exact)
+
+
+def test_retrieve_many_plans_the_class_filter(classified):
+    results = classified.retrieve_many(QUERIES, top_k=5, filters={"decision": "rara"})
+    assert classified.last_plan["plan"] == "exact"
+    assert len(results) == len(QUERIES)
+    assert all(r.doc_id in RARE_IDS and r.decision == "rara" for rows in results for r in rows)
+
+
+def test_retrieve_many_matches_single_queries(classified):
+    batched = classified.retrieve_many(QUERIES, top_k=5, filters={"decision": "rara"})
+    single = [classified.retrieve_by_class("rara", query, top_k=5) for query in QUERIES]
+    assert [similarities(rows) for rows in batched] == [similarities(rows) for rows in single]
+
+
+def test_retrieve_many_refills_only_short_queries(classified, short_first_scan):
+    exact = classified.retrieve_many(QUERIES, top_k=5, filters={"decision": "comum"})
+    classified.exact_scan_rows = 0
+    calls = short_first_scan(classified, position=1)
+
+    results = classified.retrieve_many(QUERIES, top_k=5, filters={"decision": "comum"})
+    assert calls == ["retrieve_many", "retrieve_many"]
+    assert classified.last_plan["plan"] == "ann+exact"
+    assert classified.last_plan["refilled"] == 1
+    assert [similarities(rows) for rows in results] == [similarities(rows) for rows in exact]
+
+
+def test_refill_replaces_the_short_queries_in_place():
+    per_query = [[("a",)] * 3, [("b",)], [("c",)] * 3]
+    short = DocumentRetriever._short_queries(per_query, 3)
+    assert short == [1]
+    DocumentRetriever._refill(per_query, short, [(1, "x"), (1, "y"), (1, "z")])
+    assert per_query[1] == [("x",), ("y",), ("z",)]
+    assert per_query[0] == [("a",)] * 3
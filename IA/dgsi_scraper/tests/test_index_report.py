@@ -0,0 +1,32 @@
+import pytest
+
+from dgsi_scraper.retriever import INDEX_REPORT_DEFAULTS, DocumentRetriever
+
+
+@pytest.mark.parametrize("method, name, other", [("ivfflat", "probes", "ef_search"), ("hnsw", "ef_search", "probes")])
+def test_report_varies_the_parameter_the_index_reads(retriever, method, name, other):
+    retriever.build_vector_indexes(method=method, targets=("chunks",), lists=4)
+    assert retriever.index_method("chunks") == method
+
+    report = retriever.index_report(probes_values=[1, 4], ef_search_values=[10, 40], num_queries=5, top_k=3)
+    assert [row[name] for row in report] == ([1, 4] if name == "probes" else [10, 40])
+    assert all(row["method"] == method and other not in row for row in report)
+    assert all(0.0 <= row["recall_at_k"] <= 1.0 for row in report)
+
+    defaults = retriever.index_report(num_queries=2, top_k=3)
+    assert [row[name] for row in defaults] == INDEX_REPORT_DEFAULTS[name]
+
+
+def test_report_needs_an_index(retriever):
+    with retriever.get_connection() as conn:
+        conn.execute(f"DROP INDEX IF EXISTS {retriever.vector_indexes()['chunks'][1]};")
+    assert retriever.index_method("chunks") is None
+    with pytest.raises(ValueError, match="build-index"):
+        retriever.index_report()
+
+
+def test_search_params_for():
+    assert DocumentRetriever.search_params_for("ivfflat", probes=5, ef_search=80) == {"probes": 5}
+    assert DocumentRetriever.search_params_for("hnsw", probes=5, ef_search=80) == {"ef_search": 80}
+    assert DocumentRetriever.search_params_for("hnsw", probes=5) == {}
+    assert DocumentRetriever.search_params_for(None, probes=5, ef_search=80) == {}
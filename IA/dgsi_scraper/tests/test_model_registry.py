@@ -0,0 +1,120 @@
+import json
+import threading
+
+import pytest
+
+from dgsi_scraper.retriever import LEGACY_TABLES, DocumentRetriever
+from dgsi_scraper.scrape import MAX_INDEX_NAME, db_index_name
+
+LONG_VERSION = "bert-base-portuguese-cased:768:512"
+
+
+def test_long_index_names_are_shortened():
+    name = "dgsi_bert_base_portuguese_cas_c93b66_chunks_embedding_cls_negada_a_revista_idx"
+    short = db_index_name(name)
+    assert len(short) == MAX_INDEX_NAME and len(short + "_new") <= 63
+    assert short != db_index_name(name.replace("negada", "negado"))
+    assert db_index_name("dgsi_chunks_embedding_idx") == "dgsi_chunks_embedding_idx"
+
+
+def test_indexes_of_a_long_model_name_can_be_rebuilt(retriever, tmp_path):
+    second = DocumentRetriever(retriever.db_dsn, embedding_dim=256, chunk_size=200, model_version=LONG_VERSION)
+    second.ensure_vector_schema()
+    assert second.chunk_table not in LEGACY_TABLES
+    second.sync()
+    path = tmp_path / "classes.json"
+    path.write_text(json.dumps({"ids_by_class": {
+        "NEGADA A REVISTA": [{"id": i} for i in range(1, 31)],
+        "NEGADO PROVIMENTO": [{"id": i} for i in range(31, 61)],
+    }}), encoding="utf-8")
+    second.load_decision_classes(str(path))
+    second.index_dedup_chunks()
+
+    # the second build replaces the indexes of the first
+    for _ in range(2):
+        built = second.build_vector_indexes(method="hnsw", per_class=True)
+        second.build_dedup_index(method="hnsw")
+    indexes = [info["index"] for info in built.values()]
+    with second.get_connection() as conn:
+        for name in indexes:
+            assert conn.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,)).fetchone()[0], name
+    assert len(set(indexes)) == 4
+    assert second.retrieve_by_class("NEGADA A REVISTA", "contrato despejo", top_k=3)
+
+
+@pytest.fixture
+def shadow(retriever):
+    """A second TF-IDF model built with shadow_reindex next to retriever (still active)."""
+    r = DocumentRetriever(retriever.db_dsn, embedding_dim=128, chunk_size=150)
+    r.shadow_reindex(index_method="hnsw")
+    return r
+
+
+def table_digest(conn, table: str, order_by: str) -> tuple:
+    return conn.execute(f"SELECT count(*), md5(string_agg(t::text, ',' ORDER BY {order_by})) FROM {table} t;").fetchone()
+
+
+def active_model(conn) -> list:
+    return conn.execute("SELECT model_version, status FROM dgsi_embedding_models WHERE is_active;").fetchall()
+
+
+def test_shadow_build_leaves_the_active_model_alone(retriever):
+    keys = dict(zip(retriever._resolve_tables(), ("id", "doc_id, chunk_index", "doc_id")))
+    with retriever.get_connection() as conn:
+        before = {table: table_digest(conn, table, key) for table, key in keys.items()}
+    r = DocumentRetriever(retriever.db_dsn, embedding_dim=128, chunk_size=150)
+    r.shadow_reindex(index_method="hnsw")
+
+    assert not set(r._resolve_tables()) & set(keys)
+    with retriever.get_connection() as conn:
+        assert {table: table_digest(conn, table, key) for table, key in keys.items()} == before
+        assert active_model(conn) == [(retriever.model_version, "ready")]
+        assert conn.execute(
+            "SELECT status, is_active FROM dgsi_embedding_models WHERE model_version = %s;", (r.model_version,)
+        ).fetchone() == ("ready", False)
+        assert conn.execute(f"SELECT count(*) FROM {r.doc_table};").fetchone()[0] == 60
+
+
+def test_activation_switches_atomically(retriever, shadow):
+    versions = [shadow.model_version, retriever.model_version] * 10
+    seen = []
+    switcher = threading.Thread(target=lambda: [retriever.activate_model(v) for v in versions])
+    with retriever.get_connection() as conn:
+        conn.autocommit = True
+        switcher.start()
+        while switcher.is_alive():
+            seen.append(active_model(conn))
+        switcher.join()
+    # never none or two active models, nor one that isn't ready
+    assert seen and all(len(rows) == 1 and rows[0][1] == "ready" for rows in seen)
+    assert {rows[0][0] for rows in seen} <= {retriever.model_version, shadow.model_version}
+
+    shadow.set_model_status("building")
+    with pytest.raises(ValueError, match="not ready"):
+        retriever.activate_model(shadow.model_version)
+
+
+def test_followers_switch_to_the_activated_model(retriever, shadow):
+    follower = DocumentRetriever.from_registry(retriever.db_dsn, follow_active=True, active_check_interval=0)
+    query = " ".join(t for t in shadow.vectorizer.get_feature_names_out() if " " not in t)
+    assert follower.model_version == retriever.model_version
+    follower.retrieve_chunks(query, top_k=3, projection="ids")
+
+    retriever.activate_model(shadow.model_version)
+    results = follower.retrieve_chunks(query, top_k=3, projection="ids")
+    assert (follower.model_version, follower.chunk_table) == (shadow.model_version, shadow.chunk_table)
+    assert follower.embedding_dim == 128
+    assert [r.chunk_id for r in results] == [r.chunk_id for r in shadow.retrieve_chunks(query, top_k=3, projection="ids")]
+
+
+def test_retire_refuses_the_active_model(retriever, shadow):
+    with pytest.raises(ValueError, match="active"):
+        retriever.retire_model(retriever.model_version, drop_tables=True)
+    with retriever.get_connection() as conn:
+        assert active_model(conn) == [(retriever.model_version, "ready")]
+        assert conn.execute("SELECT to_regclass(%s) IS NOT NULL;", (retriever.chunk_table,)).fetchone()[0]
+
+    retriever.retire_model(shadow.model_version, drop_tables=True)
+    with retriever.get_connection() as conn:
+        assert [m for (m,) in conn.execute("SELECT model_version FROM dgsi_embedding_models;")] == [retriever.model_version]
+        assert not conn.execute("SELECT to_regclass(%s) IS NOT NULL;", (shadow.chunk_table,)).fetchone()[0]
@@ -0,0 +1,94 @@
+import warnings
+
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from dgsi_scraper.neural_encoder import NeuralEncoder, create_random_model
+from dgsi_scraper.retriever import DocumentRetriever
+
+TEXTS = [
+    "acórdão do supremo tribunal de justiça",
+    "",
+    "recurso",
+    "contrato de arrendamento; despejo por falta de pagamento da renda (art. 1083º)",
+    "   ",
+    "indemnização por danos morais",
+]
+
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    return create_random_model(str(tmp_path_factory.mktemp("model")), dim=32)
+
+
+def test_encode_shapes_and_empty_texts(model_dir):
+    encoder = NeuralEncoder(model_dir)
+    vectors = encoder.encode(TEXTS)
+    assert encoder.dim == 32
+    assert vectors.shape == (len(TEXTS), 32) and vectors.dtype == np.float32
+    assert not vectors[1].any() and not vectors[4].any()
+    norms = np.linalg.norm(vectors[[0, 2, 3, 5]], axis=1)
+    assert np.allclose(norms, 1.0, atol=1e-5)
+
+
+def test_length_bucketing_does_not_change_vectors(model_dir):
+    bucketed = NeuralEncoder(model_dir, batch_size=2).encode(TEXTS)
+    plain = NeuralEncoder(model_dir, batch_size=2, length_bucketing=False).encode(TEXTS)
+    assert np.allclose(bucketed, plain, atol=1e-5)
+
+
+def test_batches_respect_size_and_token_limits(model_dir):
+    encoder = NeuralEncoder(model_dir, batch_size=3, max_batch_tokens=40)
+    lengths = [5, 30, 12, 8, 20, 3, 15, 9]
+    batches = encoder._batches(lengths)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 3
+        # longest first, so the first text sets the padded length
+        assert lengths[batch[0]] == max(lengths[i] for i in batch)
+        assert len(batch) == 1 or len(batch) * lengths[batch[0]] <= 40
+
+
+def test_int8_quantized_encoder(model_dir):
+    pytest.importorskip("torchao")
+    with warnings.catch_warnings():
+        # torch.ao.quantization warned on every encoder it quantized
+        warnings.simplefilter("error", DeprecationWarning)
+        encoder = NeuralEncoder(model_dir, quantize="int8")
+        vectors = encoder.encode(TEXTS)
+    assert vectors.shape == (len(TEXTS), 32)
+    assert np.isfinite(vectors).all()
+    dense = NeuralEncoder(model_dir).encode(TEXTS)
+    for i in (0, 2, 3, 5):
+        assert vectors[i] @ dense[i] > 0.9
+
+
+def test_retriever_uses_the_model_dimension(model_dir):
+    retriever = DocumentRetriever(
+        "postgresql://unused", model_name="sentence-transformers", model_path=model_dir, chunk_size=200
+    )
+    assert retriever.embedding_dim == 32
+    assert retriever.model_version.endswith(":32:200")
+    assert retriever.vector_type == "vector"
+    vectors = retriever.generate_embeddings(TEXTS)
+    assert np.allclose(vectors, NeuralEncoder(model_dir).encode(TEXTS), atol=1e-5)
+    assert np.allclose(retriever.generate_embedding(TEXTS[0], use_chunking=False), vectors[0], atol=1e-5)
+
+
+def test_sync_and_search_with_a_random_model(corpus, model_dir):
+    retriever = DocumentRetriever(corpus, model_name="sentence-transformers", model_path=model_dir, chunk_size=200)
+    retriever.ensure_vector_schema()
+    retriever.sync()
+
+    stats = retriever.get_document_stats()
+    assert stats["indexed_documents"] == stats["total_documents"] == 60
+    results = retriever.retrieve_chunks("contrato de arrendamento", top_k=3)
+    assert len(results) == 3
+    with retriever.get_connection() as conn:
+        row = conn.execute(
+            "SELECT embedding_dim, model_path FROM dgsi_embedding_models WHERE model_version = %s;",
+            (retriever.model_version,)
+        ).fetchone()
+    assert row == (32, model_dir)
@@ -0,0 +1,113 @@
+import gzip
+import hashlib
+
+import pytest
+
+psycopg = pytest.importorskip("psycopg")
+
+from dgsi_scraper import partitioning, scrape
+from dgsi_scraper.retriever import DocumentRetriever
+
+# dgsi_documents as created before it was partitioned
+LEGACY_DOCUMENTS = """
+    CREATE TABLE dgsi_documents (
+      id BIGSERIAL PRIMARY KEY,
+      source TEXT NOT NULL,
+      base_name TEXT NOT NULL,
+      url TEXT NOT NULL UNIQUE,
+      processo TEXT,
+      sessao_date TEXT,
+      relator TEXT,
+      descritores TEXT[] NOT NULL DEFAULT '{}',
+      text_sha256 TEXT NOT NULL,
+      text_plain TEXT NOT NULL,
+      text_gzip BYTEA NOT NULL,
+      extra JSONB NOT NULL DEFAULT '{}'::jsonb,
+      fetched_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+
+@pytest.fixture
+def dsn(dsn):
+    """The test database with an unpartitioned dgsi_documents."""
+    with psycopg.connect(dsn) as conn:
+        conn.execute("DROP TABLE dgsi_documents CASCADE;")
+        conn.execute(LEGACY_DOCUMENTS)
+        conn.commit()
+        scrape.db_ensure_schema(conn)
+    return dsn
+
+
+def counts_by_source(conn, table: str) -> dict:
+    return dict(conn.execute(f"SELECT source, count(*) FROM {table} GROUP BY source;").fetchall())
+
+
+def similarities(results):
+    return [round(r.similarity, 5) for r in results]
+
+
+def test_migrate_keeps_rows_and_results(retriever):
+    tables = ("dgsi_documents", retriever.chunk_table, retriever.doc_table)
+    with retriever.get_connection() as conn:
+        assert not scrape.db_is_partitioned(conn.cursor())
+        before = {table: counts_by_source(conn, table) for table in tables}
+    stats = retriever.get_document_stats()
+    results = retriever.retrieve_chunks("contrato despejo", top_k=5, filter_source="dgsi_stj")
+
+    with psycopg.connect(retriever.db_dsn) as conn:
+        report = partitioning.migrate(conn)
+        cur = conn.cursor()
+        assert all(scrape.db_is_partitioned(cur, table) for table in tables)
+        assert {table: counts_by_source(conn, table) for table in tables} == before
+    assert set(report["tables"]) == set(tables)
+
+    migrated = DocumentRetriever(retriever.db_dsn, embedding_dim=256, chunk_size=200)
+    assert migrated.get_document_stats() == stats
+    assert migrated.refresh_stats() == stats
+    after = migrated.retrieve_chunks("contrato despejo", top_k=5, filter_source="dgsi_stj")
+    assert similarities(after) == similarities(results)
+    assert all(r.source == "dgsi_stj" for r in after)
+
+
+def test_migrate_twice_fails(corpus):
+    with psycopg.connect(corpus) as conn:
+        partitioning.migrate(conn)
+        with pytest.raises(RuntimeError):
+            partitioning.migrate(conn)
+
+
+def test_drop_source_needs_partitions(corpus):
+    with psycopg.connect(corpus) as conn:
+        with pytest.raises(RuntimeError):
+            partitioning.drop_source(conn, "dgsi_sta")
+
+
+def test_drop_source_removes_only_that_source(retriever):
+    with psycopg.connect(retriever.db_dsn) as conn:
+        partitioning.migrate(conn)
+        before = counts_by_source(conn, retriever.chunk_table)
+        partitioning.drop_source(conn, "dgsi_sta")
+        for table in ("dgsi_documents", retriever.chunk_table, retriever.doc_table, retriever.state_table):
+            assert conn.execute(f"SELECT count(*) FROM {table} WHERE source = 'dgsi_sta';").fetchone()[0] == 0
+        after = counts_by_source(conn, retriever.chunk_table)
+    del before["dgsi_sta"]
+    assert after == before
+    assert retriever.get_document_stats() == retriever.refresh_stats()
+
+
+def test_upsert_on_partitioned_documents(dsn):
+    # the dsn of this module is unpartitioned; start over with a new database layout
+    with psycopg.connect(dsn) as conn:
+        conn.execute("DROP TABLE dgsi_documents CASCADE;")
+        conn.commit()
+        scrape.db_ensure_schema(conn)
+        assert scrape.db_is_partitioned(conn.cursor())
+        record = scrape.DocRecord(
+            source="dgsi_stj", base_name="test", url="http://test/upsert", processo="P1", sessao_date=None,
+            relator=None, descritores=[], text_plain="acórdão", extra={},
+        )
+        text = record.text_plain.encode("utf-8")
+        assert scrape.db_upsert_doc(conn, record, hashlib.sha256(text).hexdigest(), gzip.compress(text))
+        assert not scrape.db_upsert_doc(conn, record, hashlib.sha256(text).hexdigest(), gzip.compress(text))
+        assert counts_by_source(conn, "dgsi_documents") == {"dgsi_stj": 1}
@@ -0,0 +1,123 @@
+import threading
+
+import pytest
+
+from dgsi_scraper import query_log
+from dgsi_scraper.query_log import PlanSampler, hot_node, instrumented, plan_record, span
+
+PLAN = {
+    "Node Type": "Limit", "Actual Total Time": 5.0, "Actual Loops": 1,
+    "Plans": [{
+        "Node Type": "Index Scan", "Index Name": "dgsi_chunks_embedding_idx", "Relation Name": "dgsi_document_chunks",
+        "Actual Total Time": 4.5, "Actual Loops": 1,
+        "Plans": [{"Node Type": "Seq Scan", "Relation Name": "dgsi_documents", "Actual Total Time": 0.25, "Actual Loops": 2}],
+    }],
+}
+
+
+def test_hot_node_has_the_most_exclusive_time():
+    assert hot_node(PLAN) == "Index Scan using dgsi_chunks_embedding_idx on dgsi_document_chunks (4.00 ms)"
+
+
+def test_plan_record_normalizes_the_statement():
+    record = plan_record("retrieve", "tfidf:256:200", "SELECT 1\n   FROM   t;", [{"Plan": PLAN, "Execution Time": 5.5}], {"sql_ms": 6.0})
+    assert record[3] == "SELECT 1 FROM t;"
+    assert record[2] == plan_record("retrieve", "v", " SELECT 1 FROM t; ", [{"Plan": PLAN}], None)[2]
+    assert record[4] == 5.5 and record[8].startswith("Index Scan")
+
+
+def test_spans_add_up_in_the_outermost_call():
+    class Searcher:
+        @instrumented
+        def outer(self):
+            with span("sql"):
+                pass
+            self.inner()
+
+        @instrumented
+        def inner(self):
+            with span("sql"):
+                pass
+
+    searcher = Searcher()
+    searcher.outer()
+    assert searcher.last_timings["method"] == "outer"
+    assert set(searcher.last_timings) == {"method", "sql_ms", "total_ms"}
+    assert query_log.current_spans() is None
+
+
+@pytest.mark.parametrize("rate, draw, sampled", [(0.0, 0.0, False), (0.1, 0.05, True), (0.1, 0.5, False), (1.0, 0.99, True)])
+def test_sample_rate(monkeypatch, rate, draw, sampled):
+    from dgsi_scraper import retriever
+
+    monkeypatch.setattr(retriever.random, "random", lambda: draw)
+    searcher = retriever.DocumentRetriever("postgresql://unused", embedding_dim=256, chunk_size=200, explain_sample_rate=rate)
+    assert searcher._sample_explain() is sampled
+
+
+def test_full_queue_drops_samples():
+    started, release = threading.Event(), threading.Event()
+    sampler = PlanSampler(connect=None, max_pending=1)
+
+    def blocked(*sample):
+        started.set()
+        release.wait()
+    sampler.capture = blocked
+
+    assert sampler.submit("retrieve", "v", "SELECT 1", None, (), None)
+    started.wait()
+    assert sampler.submit("retrieve", "v", "SELECT 1", None, (), None)
+    assert not sampler.submit("retrieve", "v", "SELECT 1", None, (), None)
+    assert sampler.dropped == 1
+    release.set()
+    sampler.flush()
+
+
+def plans(retriever) -> list:
+    with retriever.get_connection() as conn:
+        if not conn.execute("SELECT to_regclass(%s) IS NOT NULL;", (query_log.QUERY_PLANS_TABLE,)).fetchone()[0]:
+            return []
+        return conn.execute(
+            f"SELECT method, model_version, hot_node, spans, plan FROM {query_log.QUERY_PLANS_TABLE};"
+        ).fetchall()
+
+
+def test_unsampled_searches_log_nothing(retriever):
+    retriever.retrieve_chunks("contrato despejo", top_k=3)
+    retriever.flush_query_plans()
+    assert plans(retriever) == []
+
+
+def test_sampled_search_is_explained_off_the_request_path(retriever, monkeypatch):
+    retriever.explain_sample_rate = 1.0
+    release = threading.Event()
+    capture = retriever.plan_sampler.capture
+
+    def after_release(*sample):
+        release.wait()
+        capture(*sample)
+    monkeypatch.setattr(retriever.plan_sampler, "capture", after_release)
+
+    # the search returns while its plan is still waiting to be captured
+    assert len(retriever.retrieve_chunks("contrato despejo", top_k=3, ef_search=77)) == 3
+    assert plans(retriever) == []
+    release.set()
+    retriever.flush_query_plans()
+
+    [(method, model_version, hot, spans, plan)] = plans(retriever)
+    assert (method, model_version) == ("retrieve_chunks", retriever.model_version)
+    assert hot and "sql_ms" in spans
+    assert plan["Plan"]["Actual Loops"] == 1
+    summary = retriever.query_plan_summary()
+    assert [(row["method"], row["samples"]) for row in summary] == [("retrieve_chunks", 1)]
+
+
+def test_replay_uses_the_search_settings(retriever, monkeypatch):
+    retriever.explain_sample_rate = 1.0
+    samples = []
+    monkeypatch.setattr(retriever.plan_sampler, "submit", lambda *sample: samples.append(sample))
+    retriever.retrieve_chunks("contrato despejo", top_k=3, probes=7, ef_search=77)
+    [(_, _, _, _, settings, _)] = samples
+    assert dict(zip(query_log.REPLAYED_SETTINGS, settings)) == {
+        "ivfflat.probes": "7", "hnsw.ef_search": "77", "enable_indexscan": "on",
+    }
@@ -0,0 +1,99 @@
+import gzip
+import hashlib
+
+import pytest
+
+from dgsi_scraper import scrape
+from dgsi_scraper.result_cache import ResultCache
+from dgsi_scraper.retriever import ChunkRetrievalResult, DocumentRetriever, RetrievalResult
+
+
+def chunk(chunk_id: int, text: str = "texto") -> ChunkRetrievalResult:
+    return ChunkRetrievalResult(
+        chunk_id=chunk_id, doc_id=1, chunk_index=0, chunk_text=text, similarity=0.5,
+        url="http://test/1", processo=None, source="dgsi_stj", sessao_date=None,
+    )
+
+
+def test_cached_results_are_copies():
+    cache = ResultCache((RetrievalResult, ChunkRetrievalResult))
+    cache.put("k", [chunk(1)])
+    first = cache.get("k")
+    first[0].chunk_text = "changed"
+    assert cache.get("k") == [chunk(1)]
+    assert cache.stats()["hits"] == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache((ChunkRetrievalResult,), max_size=2)
+    cache.put("a", [chunk(1)])
+    cache.put("b", [chunk(2)])
+    cache.get("a")
+    cache.put("c", [chunk(3)])
+    assert cache.get("b") is None
+    assert cache.get("a") == [chunk(1)] and cache.get("c") == [chunk(3)]
+
+
+def test_key_covers_every_part():
+    assert ResultCache.key("retrieve", "m", 1, {"query": "a"}) == ResultCache.key("retrieve", "m", 1, {"query": "a"})
+    assert ResultCache.key("retrieve", "m", 1, {"query": "a"}) != ResultCache.key("retrieve", "m", 2, {"query": "a"})
+    assert ResultCache.key("retrieve", "m", 1, {"query": "a"}) != ResultCache.key("retrieve", "m", 1, {"query": "b"})
+
+
+@pytest.fixture
+def cached(retriever):
+    """A second retriever on the same model with a result cache that re-reads the index version on every call."""
+    return DocumentRetriever(
+        retriever.db_dsn, embedding_dim=256, chunk_size=200, result_cache_size=16, version_check_interval=0
+    )
+
+
+def test_repeated_search_is_served_from_the_cache(cached):
+    first = cached.retrieve_chunks("contrato despejo", top_k=3)
+    assert cached.retrieve_chunks("contrato despejo", top_k=3) == first
+    assert cached.result_cache.stats()["hits"] == 1
+    cached.retrieve_chunks("contrato despejo", top_k=4)
+    assert cached.result_cache.stats()["misses"] == 2
+
+
+def test_indexing_invalidates_cached_results(retriever, cached):
+    first = cached.retrieve_chunks("contrato despejo", top_k=3)
+    doc_id = first[0].doc_id
+    # another process re-indexes the best document without the query terms
+    assert retriever.index_document_chunks(doc_id, "crime furto " * 50)
+
+    after = cached.retrieve_chunks("contrato despejo", top_k=3)
+    assert cached.result_cache.stats()["hits"] == 0
+    assert doc_id not in {r.doc_id for r in after}
+
+
+def test_sync_bumps_once_per_batch(retriever):
+    with retriever.get_connection() as conn:
+        conn.execute("UPDATE dgsi_documents SET text_plain = text_plain || ' crime', text_sha256 = md5(text_plain || ' crime');")
+    before = retriever.index_version()
+    retriever.sync(batch_size=25)
+    # 60 documents: 3 batches of chunks and 3 of document vectors
+    assert retriever.index_version() == before + 6
+
+
+def test_scraper_bumps_only_when_the_text_changes(retriever, cached):
+    cached.retrieve_chunks("contrato despejo", top_k=3)
+    version = cached.index_version()
+    with retriever.get_connection() as conn:
+        url, source, text = conn.execute("SELECT url, source, text_plain FROM dgsi_documents WHERE id = 1;").fetchone()
+
+        def upsert(text_plain: str):
+            record = scrape.DocRecord(
+                source=source, base_name="test", url=url, processo="P0", sessao_date=None,
+                relator=None, descritores=[], text_plain=text_plain, extra={},
+            )
+            data = text_plain.encode("utf-8")
+            scrape.db_upsert_doc(conn, record, hashlib.sha256(data).hexdigest(), gzip.compress(data))
+
+        upsert(text)
+        assert cached.index_version() == version
+        upsert(text + " revista")
+        assert cached.index_version() == version + 1
+    # a cached result holding the old text is not served
+    cached.retrieve_chunks("contrato despejo", top_k=3)
+    assert cached.result_cache.stats()["hits"] == 0
@@ -0,0 +1,63 @@
+import re
+
+import pytest
+
+from dgsi_scraper.retriever import PGVECTOR_TYPES_VERSION, DocumentRetriever
+
+
+def pgvector_version(dsn: str) -> tuple:
+    import psycopg
+
+    with psycopg.connect(dsn) as conn:
+        version = conn.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector';").fetchone()[0]
+    return tuple(int(part) for part in re.findall(r"\d+", version)[:3])
+
+
+def column_type(conn, table: str) -> str:
+    return conn.execute("""
+        SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attname = 'embedding';
+    """, (table,)).fetchone()[0]
+
+
+def test_sparse_storage_is_a_model_of_its_own(retriever):
+    if pgvector_version(retriever.db_dsn) < PGVECTOR_TYPES_VERSION:
+        pytest.skip("sparsevec needs pgvector >= 0.7")
+    sparse = DocumentRetriever(retriever.db_dsn, embedding_dim=256, chunk_size=200, sparse=True)
+    assert sparse.model_version == retriever.model_version.replace("tfidf:256:200:", "tfidf:256:200:sparsevec:")
+    sparse.shadow_reindex(index_method="hnsw")
+    assert sparse.chunk_table != retriever.chunk_table
+    with sparse.get_connection() as conn:
+        assert column_type(conn, sparse.chunk_table) == "sparsevec(256)"
+        assert column_type(conn, sparse.doc_table) == "sparsevec(256)"
+        # the active model is untouched
+        assert column_type(conn, retriever.chunk_table) == "vector(256)"
+        assert conn.execute(
+            "SELECT model_version, vector_type FROM dgsi_embedding_models WHERE is_active;"
+        ).fetchone() == (retriever.model_version, "vector")
+
+    query = "contrato despejo crime furto"
+    dense_hits = [r.id for r in retriever.retrieve(query, top_k=5, projection="ids")]
+    sparse_hits = [r.id for r in sparse.retrieve(query, top_k=5, projection="ids")]
+    assert sparse_hits and sparse_hits[0] == dense_hits[0]
+
+
+def test_registered_model_is_not_converted_in_place(retriever):
+    same_version = DocumentRetriever(
+        retriever.db_dsn, embedding_dim=256, chunk_size=200, sparse=True, model_version=retriever.model_version
+    )
+    with pytest.raises(ValueError, match="another model version"):
+        same_version.ensure_vector_schema()
+    with retriever.get_connection() as conn:
+        assert column_type(conn, retriever.chunk_table) == "vector(256)"
+        assert conn.execute("SELECT vector_type FROM dgsi_embedding_models;").fetchall() == [("vector",)]
+
+
+def test_sparse_storage_needs_pgvector_0_7(retriever):
+    if pgvector_version(retriever.db_dsn) >= PGVECTOR_TYPES_VERSION:
+        pytest.skip("pgvector supports sparsevec")
+    sparse = DocumentRetriever(retriever.db_dsn, embedding_dim=256, chunk_size=200, sparse=True)
+    with pytest.raises(RuntimeError, match="pgvector >= 0.7"):
+        sparse.ensure_vector_schema()
+    with retriever.get_connection() as conn:
+        assert conn.execute("SELECT count(*) FROM dgsi_embedding_models;").fetchone()[0] == 1
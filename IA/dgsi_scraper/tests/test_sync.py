@@ -0,0 +1,65 @@
+import numpy as np
+
+from dgsi_scraper.retriever import DocumentRetriever
+
+
+def indexed_at(retriever) -> dict:
+    """doc_id -> (doc_indexed_at, chunks_indexed_at)."""
+    with retriever.get_connection() as conn:
+        return {
+            doc_id: times
+            for doc_id, *times in conn.execute(
+                f"SELECT doc_id, doc_indexed_at, chunks_indexed_at FROM {retriever.state_table};"
+            )
+        }
+
+
+def re_embedded(before: dict, after: dict, kind: int) -> set:
+    """Documents whose vector (kind 0) or chunks (kind 1) were written again."""
+    return {doc_id for doc_id, times in after.items() if before.get(doc_id, (None, None))[kind] != times[kind]}
+
+
+def test_unchanged_documents_are_skipped(retriever):
+    before = indexed_at(retriever)
+    assert retriever.sync() == {"documents_synced": 0, "chunk_sets_synced": 0}
+    assert indexed_at(retriever) == before
+
+
+def test_changed_text_is_re_embedded(retriever):
+    before = indexed_at(retriever)
+    with retriever.get_connection() as conn:
+        conn.execute("""
+            UPDATE dgsi_documents
+            SET text_plain = 'crime furto ' || text_plain,
+                text_sha256 = encode(sha256(convert_to('crime furto ' || text_plain, 'UTF8')), 'hex')
+            WHERE id IN (4, 9);
+        """)
+    assert retriever.sync() == {"documents_synced": 2, "chunk_sets_synced": 2}
+    after = indexed_at(retriever)
+    assert re_embedded(before, after, 0) == re_embedded(before, after, 1) == {4, 9}
+
+    with retriever.get_connection() as conn:
+        text, stored = conn.execute(
+            f"SELECT d.text_plain, v.embedding FROM dgsi_documents d JOIN {retriever.doc_table} v USING (id) WHERE id = 4;"
+        ).fetchone()
+    assert np.allclose(np.array(stored.strip("[]").split(","), dtype=np.float32), retriever.generate_embedding(text))
+
+
+def test_changed_model_version_is_re_embedded(retriever):
+    before = indexed_at(retriever)
+    with retriever.get_connection() as conn:
+        conn.execute(f"UPDATE {retriever.state_table} SET doc_model_version = 'tfidf:256:200' WHERE doc_id IN (11, 12);")
+        conn.execute(f"UPDATE {retriever.state_table} SET chunks_model_version = 'tfidf:256:200' WHERE doc_id = 13;")
+    assert retriever.sync() == {"documents_synced": 2, "chunk_sets_synced": 1}
+    after = indexed_at(retriever)
+    assert re_embedded(before, after, 0) == {11, 12}
+    assert re_embedded(before, after, 1) == {13}
+
+
+def test_another_model_version_re_embeds_everything(retriever):
+    other = DocumentRetriever(retriever.db_dsn, embedding_dim=256, chunk_size=200, model_version="tfidf:256:200:v2")
+    other.ensure_vector_schema()
+    assert other.sync() == {"documents_synced": 60, "chunk_sets_synced": 60}
+    assert other.sync() == {"documents_synced": 0, "chunk_sets_synced": 0}
+    # in its own tables: the first model has nothing to re-embed
+    assert retriever.sync() == {"documents_synced": 0, "chunk_sets_synced": 0}
@@ -0,0 +1,54 @@
+import numpy as np
+
+from dgsi_scraper.retriever import DocumentRetriever
+
+
+def new_retriever(dsn: str) -> DocumentRetriever:
+    return DocumentRetriever(dsn, embedding_dim=256, chunk_size=200)
+
+
+def test_vocabulary_is_saved_under_its_hash(retriever):
+    digest = retriever._vocab_sha256
+    assert retriever.model_version == f"tfidf:256:200:{digest[:12]}"
+    with retriever.get_connection() as conn:
+        registered = conn.execute("SELECT model_version, vocab_sha256 FROM dgsi_embedding_models;").fetchall()
+        terms, idf = conn.execute(
+            "SELECT terms, idf FROM dgsi_tfidf_vocabularies WHERE vocab_sha256 = %s;", (digest,)
+        ).fetchone()
+    assert registered == [(retriever.model_version, digest)]
+    assert terms == retriever.vectorizer.get_feature_names_out().tolist()
+    assert DocumentRetriever.vocabulary_sha256(terms, idf) == digest
+
+
+def test_fit_is_deterministic(corpus):
+    first, second = new_retriever(corpus), new_retriever(corpus)
+    assert first.model_version == second.model_version
+
+
+def test_other_processes_load_the_saved_vocabulary(retriever):
+    # a fit now would give another vocabulary
+    with retriever.get_connection() as conn:
+        conn.execute("UPDATE dgsi_documents SET text_plain = 'contrato contrato contrato' WHERE id <= 30;")
+    other = new_retriever(retriever.db_dsn)
+    assert other.model_version == retriever.model_version
+    query = "contrato despejo crime furto"
+    assert np.allclose(other.generate_embedding(query), retriever.generate_embedding(query))
+
+
+def test_model_registered_without_a_vocabulary_is_re_embedded(retriever):
+    # as set up before vocabularies were saved
+    with retriever.get_connection() as conn:
+        conn.execute("UPDATE dgsi_embedding_models SET model_version = 'tfidf:256:200', vocab_sha256 = NULL;")
+        conn.execute(f"""
+            UPDATE {retriever.state_table}
+            SET doc_model_version = 'tfidf:256:200', chunks_model_version = 'tfidf:256:200';
+        """)
+    other = new_retriever(retriever.db_dsn)
+    assert other.chunk_table == retriever.chunk_table
+    other.ensure_vector_schema()
+    with other.get_connection() as conn:
+        assert conn.execute("SELECT model_version, vocab_sha256 FROM dgsi_embedding_models;").fetchall() == [
+            (retriever.model_version, retriever._vocab_sha256)
+        ]
+    assert other.sync() == {"documents_synced": 60, "chunk_sets_synced": 60}
+    assert other.sync() == {"documents_synced": 0, "chunk_sets_synced": 0}
@@ -9,6 +9,8 @@ import psycopg
 from sklearn.cluster import KMeans
 from sklearn.metrics import silhouette_score
 
+from knn.embedding_snapshot import DEFAULT_SNAPSHOT_DIR, load_embedding_snapshot
+
 
 def ensure_clusters_table(conn) -> None:
     """
@@ -47,56 +49,35 @@ def fetch_embeddings(
     conn,
     limit: Optional[int] = None,
     where_label_in: Optional[List[str]] = None,
+    snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+    refresh: bool = False,
 ) -> Tuple[List[int], List[str], np.ndarray]:
     """
     Fetch (doc_id, label, embedding[]) from public.dgsi_document_embeddings.
+    Rows come from the memory-mapped snapshot in snapshot_dir (re-exported
+    with a binary COPY only when the table changed), ordered by doc_id;
+    label filter and limit are applied to it.
     Returns:
       doc_ids: list[int]
       labels: list[str]
       X: np.ndarray shape (N, D), dtype float32
     """
-    sql = """
-        SELECT doc_id, label, embedding
-        FROM public.dgsi_document_embeddings
-    """
-    params: List[Any] = []
-    clauses: List[str] = []
+    X, labels, doc_ids = load_embedding_snapshot(conn, snapshot_dir, refresh=refresh)
 
+    rows = np.arange(len(doc_ids))
     if where_label_in:
-        clauses.append("label = ANY(%s)")
-        params.append(where_label_in)
-
-    if clauses:
-        sql += " WHERE " + " AND ".join(clauses)
-
-    sql += " ORDER BY doc_id ASC"
-
+        rows = rows[np.isin(labels, where_label_in)]
     if limit is not None and limit > 0:
-        sql += " LIMIT %s"
-        params.append(limit)
+        rows = rows[:limit]
 
-    with conn.cursor() as cur:
-        cur.execute(sql, params)
-        rows = cur.fetchall()
-
-    if not rows:
+    if len(rows) == 0:
         return [], [], np.empty((0, 0), dtype=np.float32)
 
-    doc_ids: List[int] = []
-    labels: List[str] = []
-
-    # embedding is REAL[] in Postgres -> comes as Python list[float]
-    # Build array efficiently
-    emb_list: List[np.ndarray] = []
-    for doc_id, label, emb in rows:
-        if emb is None:
-            continue
-        doc_ids.append(int(doc_id))
-        labels.append(str(label))
-        emb_list.append(np.asarray(emb, dtype=np.float32))
-
-    X = np.vstack(emb_list) if emb_list else np.empty((0, 0), dtype=np.float32)
-    return doc_ids, labels, X
+    X = X[rows]
+    if not isinstance(X, np.ndarray):
+        # every row is stored sparsely: KMeans gets the dense matrix as before
+        X = X.toarray()
+    return doc_ids[rows].tolist(), labels[rows].tolist(), np.asarray(X, dtype=np.float32)
 
 
 def l2_normalize(X: np.ndarray, eps: float = 1e-12) -> np.ndarray:
@@ -174,6 +155,8 @@ def main():
     parser.add_argument("--normalize", type=str, choices=["none", "l2"], default="l2", help="Vector normalization before KMeans")
     parser.add_argument("--limit", type=int, default=0, help="Optional limit of rows (0 means no limit)")
     parser.add_argument("--silhouette", action="store_true", help="Compute silhouette score (can take a bit)")
+    parser.add_argument("--snapshot-dir", type=str, default=DEFAULT_SNAPSHOT_DIR, help="Memory-mapped embedding snapshot directory")
+    parser.add_argument("--refresh-snapshot", action="store_true", help="Re-export the embedding snapshot")
     parser.add_argument("--label-filter", type=str, default="NEGADA,IMPROCEDENTE,CONFIRMADA,PROCEDENTE,REVOGADA,PROVIDO,CONCEDIDA", help="Comma-separated labels to include (optional)")
     args = parser.parse_args()
 
@@ -188,7 +171,10 @@ def main():
         ensure_clusters_table(conn)
 
         print("Fetching embeddings from public.dgsi_document_embeddings ...")
-        doc_ids, labels, X = fetch_embeddings(conn, limit=limit, where_label_in=label_filter)
+        doc_ids, labels, X = fetch_embeddings(
+            conn, limit=limit, where_label_in=label_filter,
+            snapshot_dir=args.snapshot_dir, refresh=args.refresh_snapshot,
+        )
         if X.size == 0:
             raise RuntimeError("No embeddings found to cluster (X is empty).")
 
@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import shutil
+import struct
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import psycopg
+from scipy.sparse import csr_matrix
+
+
+DEFAULT_SNAPSHOT_DIR = "knn/output/embedding_snapshot"
+
+# Rows with neither a dense nor a sparse embedding are left out
+EMBEDDED_ROWS = "embedding IS NOT NULL OR emb_indices IS NOT NULL"
+
+# Cheap enough to run on every start: it decides whether the snapshot is current.
+# created_at is also set on update by index_embeddings_for_ids, so re-embedded
+# rows move it too.
+FINGERPRINT_SQL = f"""
+    SELECT COUNT(*), MAX(created_at), array_agg(DISTINCT COALESCE(model_name, '')),
+           MAX(embedding_dim), COUNT(*) FILTER (WHERE embedding IS NULL)
+    FROM public.dgsi_document_embeddings
+    WHERE {EMBEDDED_ROWS};
+"""
+
+COPY_SQL = f"""
+    COPY (
+        SELECT doc_id, label, embedding, emb_indices, emb_values
+        FROM public.dgsi_document_embeddings
+        WHERE {EMBEDDED_ROWS}
+        ORDER BY doc_id
+    ) TO STDOUT (FORMAT BINARY)
+"""
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+
+def _fingerprint(cur) -> dict:
+    cur.execute(FINGERPRINT_SQL)
+    rows, newest, models, dim, sparse_rows = cur.fetchone()
+    return {
+        "rows": int(rows),
+        "max_created_at": newest.isoformat() if newest else None,
+        "models": sorted(models or []),
+        "dim": int(dim or 0),
+        "sparse_rows": int(sparse_rows),
+    }
+
+
+def snapshot_fingerprint(conn) -> dict:
+    """Row count, newest created_at, model names and dimension of the labeled embeddings."""
+    with conn.cursor() as cur:
+        fingerprint = _fingerprint(cur)
+    conn.rollback()
+    return fingerprint
+
+
+@contextmanager
+def _read_only_snapshot(conn):
+    """A REPEATABLE READ, READ ONLY transaction: every statement in it sees the same rows."""
+    conn.rollback()
+    isolation_level, read_only = conn.isolation_level, conn.read_only
+    conn.isolation_level, conn.read_only = psycopg.IsolationLevel.REPEATABLE_READ, True
+    try:
+        with conn.transaction():
+            yield
+    finally:
+        conn.isolation_level, conn.read_only = isolation_level, read_only
+
+
+def _copy_rows(copy) -> Iterator[List[Optional[bytes]]]:
+    """Rows of a COPY ... (FORMAT BINARY) stream, as raw field bytes (None for NULL).
+
+    The stream arrives in blocks that don't follow row boundaries; only the
+    unparsed tail of a block is kept between blocks.
+    """
+    buf = bytearray()
+    pos = 0
+    header = False
+    for block in copy:
+        buf += block
+        if not header:
+            if len(buf) < 19:
+                continue
+            if bytes(buf[:11]) != COPY_SIGNATURE:
+                raise ValueError("Not a binary COPY stream")
+            (extension,) = struct.unpack_from(">i", buf, 15)
+            pos = 19 + extension
+            header = True
+        while True:
+            if len(buf) - pos < 2:
+                break
+            (nfields,) = struct.unpack_from(">h", buf, pos)
+            if nfields == -1:
+                # trailer; let psycopg read the end of the COPY
+                for _ in copy:
+                    pass
+                return
+            fields: List[Optional[bytes]] = []
+            p = pos + 2
+            for _ in range(nfields):
+                if len(buf) - p < 4:
+                    break
+                (size,) = struct.unpack_from(">i", buf, p)
+                p += 4
+                if size == -1:
+                    fields.append(None)
+                    continue
+                if len(buf) - p < size:
+                    break
+                fields.append(bytes(buf[p:p + size]))
+                p += size
+            if len(fields) < nfields:
+                break
+            yield fields
+            pos = p
+        del buf[:pos]
+        pos = 0
+
+
+def _array_values(data: bytes, element: str) -> np.ndarray:
+    """Elements of a one-dimensional array in binary send format (no NULL elements)."""
+    ndim, has_nulls, _ = struct.unpack_from(">iii", data, 0)
+    if ndim == 0:
+        return np.empty(0, dtype=element)
+    if ndim != 1 or has_nulls:
+        raise ValueError("Embeddings must be one-dimensional arrays without NULLs")
+    (count,) = struct.unpack_from(">i", data, 12)
+    # every element is (int32 length, value)
+    pairs = np.frombuffer(data, dtype=np.dtype([("size", ">i4"), ("value", element)]), count=count, offset=20)
+    return pairs["value"]
+
+
+def export_embedding_snapshot(conn, out_dir: str = DEFAULT_SNAPSHOT_DIR) -> dict:
+    """Write public.dgsi_document_embeddings to out_dir as .npy files.
+
+    Rows stream through a binary COPY straight into a preallocated float32
+    matrix (embeddings.npy, memory-mapped while it is filled), so no vector
+    is ever a Python list. When every row is stored sparsely the snapshot is
+    CSR instead (indptr.npy, indices.npy, values.npy). Ids and labels go to
+    ids.npy and labels.npy, the fingerprint to meta.json.
+
+    The fingerprint, the non-zero count and the COPY run in one read-only
+    REPEATABLE READ transaction, so the arrays are sized for exactly the rows
+    copied; rows written meanwhile are left for the next snapshot. Files are
+    written to a temporary directory and moved into place at the end.
+    """
+    tmp_dir = out_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    with _read_only_snapshot(conn), conn.cursor() as cur:
+        fingerprint = _fingerprint(cur)
+        total, dim = fingerprint["rows"], fingerprint["dim"]
+        sparse = total > 0 and fingerprint["sparse_rows"] == total
+
+        ids = np.empty(total, dtype=np.int64)
+        labels: List[str] = []
+        if sparse:
+            cur.execute(f"""
+                SELECT COALESCE(SUM(cardinality(emb_indices)), 0)
+                FROM public.dgsi_document_embeddings WHERE {EMBEDDED_ROWS};
+            """)
+            nnz = int(cur.fetchone()[0])
+            indptr = np.zeros(total + 1, dtype=np.int64)
+            indices = np.lib.format.open_memmap(os.path.join(tmp_dir, "indices.npy"), mode="w+", dtype=np.int32, shape=(nnz,))
+            values = np.lib.format.open_memmap(os.path.join(tmp_dir, "values.npy"), mode="w+", dtype=np.float32, shape=(nnz,))
+        else:
+            X = np.lib.format.open_memmap(os.path.join(tmp_dir, "embeddings.npy"), mode="w+", dtype=np.float32, shape=(total, dim))
+
+        with cur.copy(COPY_SQL) as copy:
+            for n, (doc_id, label, emb, emb_indices, emb_values) in enumerate(_copy_rows(copy)):
+                ids[n] = struct.unpack(">q", doc_id)[0]
+                labels.append(label.decode("utf-8"))
+                if sparse:
+                    row_indices = _array_values(emb_indices, ">i4")
+                    end = indptr[n] + len(row_indices)
+                    indices[indptr[n]:end] = row_indices
+                    values[indptr[n]:end] = _array_values(emb_values, ">f4")
+                    indptr[n + 1] = end
+                elif emb is not None:
+                    X[n] = _array_values(emb, ">f4")
+                else:
+                    # sparse row in a dense snapshot: only the non-zero terms are stored
+                    X[n, _array_values(emb_indices, ">i4")] = _array_values(emb_values, ">f4")
+
+    if sparse:
+        indices.flush()
+        values.flush()
+        del indices, values
+        np.save(os.path.join(tmp_dir, "indptr.npy"), indptr)
+    else:
+        X.flush()
+        del X
+    np.save(os.path.join(tmp_dir, "ids.npy"), ids)
+    np.save(os.path.join(tmp_dir, "labels.npy"), np.array(labels, dtype=str))
+
+    meta = {**fingerprint, "layout": "csr" if sparse else "dense"}
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    old_dir = out_dir.rstrip("/") + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    print(f"Exported {total} labeled embeddings to {out_dir}")
+    return meta
+
+
+def _read_meta(snapshot_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(snapshot_dir, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_embedding_snapshot(
+    conn,
+    snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+    refresh: bool = False,
+) -> Tuple[object, np.ndarray, np.ndarray]:
+    """(X, labels, doc_ids) of public.dgsi_document_embeddings, ordered by doc_id.
+
+    The snapshot in snapshot_dir is reused while its fingerprint (row count,
+    newest created_at, model names, dimension) matches the table; otherwise,
+    or with refresh=True, it is exported again first. X is a read-only
+    memory-mapped float32 matrix, or a CSR matrix when every row is stored
+    sparsely.
+    """
+    fingerprint = snapshot_fingerprint(conn)
+    meta = _read_meta(snapshot_dir)
+    current = meta is not None and all(meta.get(key) == value for key, value in fingerprint.items())
+    if refresh or not current:
+        print("Embedding snapshot is missing or outdated; exporting it ...")
+        meta = export_embedding_snapshot(conn, snapshot_dir)
+
+    doc_ids = np.load(os.path.join(snapshot_dir, "ids.npy"))
+    labels = np.load(os.path.join(snapshot_dir, "labels.npy"))
+    if meta["layout"] == "csr":
+        X = csr_matrix(
+            (
+                np.load(os.path.join(snapshot_dir, "values.npy"), mmap_mode="r"),
+                np.load(os.path.join(snapshot_dir, "indices.npy"), mmap_mode="r"),
+                np.load(os.path.join(snapshot_dir, "indptr.npy")),
+            ),
+            shape=(meta["rows"], meta["dim"]),
+        )
+    else:
+        X = np.load(os.path.join(snapshot_dir, "embeddings.npy"), mmap_mode="r")
+    return X, labels, doc_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot dgsi_document_embeddings to memory-mapped .npy files")
+    parser.add_argument("--db-dsn", default=os.getenv("DGSISCRAPER_DB_DSN"))
+    parser.add_argument("--snapshot-dir", default=DEFAULT_SNAPSHOT_DIR)
+    parser.add_argument("--refresh", action="store_true", help="Export even if the snapshot is current")
+    args = parser.parse_args()
+
+    if not args.db_dsn:
+        raise RuntimeError("DB DSN not provided")
+
+    with psycopg.connect(args.db_dsn) as conn:
+        X, labels, _ = load_embedding_snapshot(conn, args.snapshot_dir, refresh=args.refresh)
+    print(f"Snapshot {args.snapshot_dir}: {X.shape[0]} embeddings, D={X.shape[1]}, {len(set(labels.tolist()))} labels")
+
+
+if __name__ == "__main__":
+    main()
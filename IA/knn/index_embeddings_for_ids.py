@@ -1,7 +1,9 @@
 import json
 import os
 import argparse
-from typing import Dict, Set, Tuple
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np
 
 from dgsi_scraper.retriever import DocumentRetriever
 
@@ -42,6 +44,10 @@ def ensure_embeddings_table(conn) -> None:
             );
             """
         )
+        # Sparse rows keep only the non-zero terms in emb_indices/emb_values
+        cur.execute("ALTER TABLE public.dgsi_document_embeddings ADD COLUMN IF NOT EXISTS emb_indices INT[];")
+        cur.execute("ALTER TABLE public.dgsi_document_embeddings ADD COLUMN IF NOT EXISTS emb_values REAL[];")
+        cur.execute("ALTER TABLE public.dgsi_document_embeddings ALTER COLUMN embedding DROP NOT NULL;")
     conn.commit()
 
 
@@ -50,9 +56,16 @@ def index_embeddings_for_ids(
     doc_id_to_class: Dict[int, str],
     batch_size: int = 50,
     model_name: str = "",
+    sparse: bool = False,
+    pooling: Optional[str] = None,
 ):
     """
     Generate and store embeddings for a specific set of document IDs.
+
+    With sparse=True only the non-zero (index, value) pairs are stored.
+    With pooling ("mean", "max", "weighted") each embedding is pooled from the
+    document's stored chunk embeddings, so it covers the full text; documents
+    without chunks fall back to generate_embedding.
     """
     conn = retriever.get_connection()
     ensure_embeddings_table(conn)
@@ -73,6 +86,11 @@ def index_embeddings_for_ids(
         total = len(rows)
         print(f"Found {total} documents to index")
 
+        pooled = {}
+        if pooling:
+            pooled = dict(retriever.pooled_document_embeddings([int(row[0]) for row in rows], method=pooling))
+            print(f"Pooled ({pooling}) chunk embeddings for {len(pooled)} documents")
+
         indexed = 0
 
         for i in range(0, total, batch_size):
@@ -87,28 +105,41 @@ def index_embeddings_for_ids(
                 if not text or not text.strip():
                     continue
 
-                embedding = retriever.generate_embedding(text)
-                emb_list = embedding.tolist()
-                emb_dim = len(emb_list)
                 label = doc_id_to_class.get(int(doc_id))
                 if not label:
                     continue
-                updates.append((int(doc_id), label, emb_list, emb_dim))
+                if int(doc_id) in pooled:
+                    embedding = pooled[int(doc_id)]
+                    if sparse:
+                        indices = np.flatnonzero(embedding)
+                        updates.append((int(doc_id), label, None, indices.tolist(), embedding[indices].tolist()))
+                    else:
+                        updates.append((int(doc_id), label, embedding.tolist(), None, None))
+                elif sparse:
+                    indices, values = retriever.generate_sparse_embedding(text)
+                    updates.append((int(doc_id), label, None, indices.tolist(), values.tolist()))
+                else:
+                    embedding = retriever.generate_embedding(text)
+                    updates.append((int(doc_id), label, embedding.tolist(), None, None))
 
             with conn.cursor() as cur:
-                for doc_id, label, embedding, emb_dim in updates:
+                for doc_id, label, embedding, indices, values in updates:
                     cur.execute(
                         """
                         INSERT INTO public.dgsi_document_embeddings
-                          (doc_id, label, embedding, embedding_dim, model_name)
-                        VALUES (%s, %s, %s, %s, %s)
+                          (doc_id, label, embedding, emb_indices, emb_values, embedding_dim, model_name)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
                         ON CONFLICT (doc_id) DO UPDATE SET
                           label = EXCLUDED.label,
                           embedding = EXCLUDED.embedding,
+                          emb_indices = EXCLUDED.emb_indices,
+                          emb_values = EXCLUDED.emb_values,
                           embedding_dim = EXCLUDED.embedding_dim,
-                          model_name = EXCLUDED.model_name;
+                          model_name = EXCLUDED.model_name,
+                          -- moves the embedding snapshot fingerprint (see embedding_snapshot)
+                          created_at = NOW();
                         """,
-                        (doc_id, label, embedding, emb_dim, model_name),
+                        (doc_id, label, embedding, indices, values, retriever.embedding_dim, model_name),
                     )
 
             conn.commit()
@@ -143,6 +174,17 @@ def main():
         default=50,
         help="Batch size for embedding generation",
     )
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Store only the non-zero TF-IDF terms (emb_indices/emb_values)",
+    )
+    parser.add_argument(
+        "--pooling",
+        type=str,
+        choices=["mean", "max", "weighted"],
+        help="Pool each document's stored chunk embeddings instead of embedding its first characters",
+    )
 
     args = parser.parse_args()
 
@@ -155,12 +197,15 @@ def main():
 
     retriever = DocumentRetriever(
         db_dsn=args.db_dsn,
+        doc_pooling=args.pooling,
     )
 
     index_embeddings_for_ids(
         retriever=retriever,
         doc_id_to_class=doc_id_to_class,
         batch_size=args.batch_size,
+        sparse=args.sparse,
+        pooling=args.pooling,
     )
 
 
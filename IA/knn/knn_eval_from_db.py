@@ -8,29 +8,17 @@ from sklearn.neighbors import KNeighborsClassifier
 from sklearn.preprocessing import normalize
 from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
 
+from knn.embedding_snapshot import DEFAULT_SNAPSHOT_DIR, load_embedding_snapshot
 
-def load_embeddings(db_dsn: str):
-    with psycopg.connect(db_dsn) as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT doc_id, label, embedding
-                FROM public.dgsi_document_embeddings
-            """)
-            rows = cur.fetchall()
-
-    doc_ids = []
-    labels = []
-    X = []
 
-    for doc_id, label, emb in rows:
-        doc_ids.append(doc_id)
-        labels.append(label)
-        X.append(emb)
+def load_embeddings(db_dsn: str, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, refresh: bool = False):
+    """Load labeled embeddings; rows stored sparsely come back as a CSR matrix.
 
-    X = np.array(X, dtype=np.float32)
-    labels = np.array(labels)
-
-    return X, labels, doc_ids
+    Served from the memory-mapped snapshot in snapshot_dir (see
+    embedding_snapshot), which is exported again only when the table changed.
+    """
+    with psycopg.connect(db_dsn) as conn:
+        return load_embedding_snapshot(conn, snapshot_dir, refresh=refresh)
 
 
 def main():
@@ -40,6 +28,8 @@ def main():
     parser.add_argument("--metric", default="cosine")
     parser.add_argument("--test-size", type=float, default=0.2)
     parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--snapshot-dir", default=DEFAULT_SNAPSHOT_DIR)
+    parser.add_argument("--refresh-snapshot", action="store_true", help="Re-export the embedding snapshot")
 
     args = parser.parse_args()
 
@@ -47,8 +37,8 @@ def main():
         raise RuntimeError("DB DSN not provided")
 
     print("Loading embeddings from DB...")
-    X, y, _ = load_embeddings(args.db_dsn)
-    print(f"Loaded {len(X)} documents")
+    X, y, _ = load_embeddings(args.db_dsn, args.snapshot_dir, refresh=args.refresh_snapshot)
+    print(f"Loaded {X.shape[0]} documents")
 
     # Remove minority classes
     min_samples = 50 
@@ -65,7 +55,7 @@ def main():
     X = X[mask]
     y = y[mask]
 
-    print(f"Remaining documents after filtering: {len(X)}")
+    print(f"Remaining documents after filtering: {X.shape[0]}")
 
     print("Applying L2 normalization...")
     X = normalize(X, norm="l2")
@@ -9,7 +9,7 @@ import numpy as np
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.preprocessing import normalize
 
-from dgsi_scraper.knn_eval_from_db import load_embeddings
+from knn.knn_eval_from_db import load_embeddings
 from dgsi_scraper.retriever import DocumentRetriever
 
 
@@ -29,21 +29,21 @@ def _get_training_matrix(db_dsn: str) -> Tuple[np.ndarray, np.ndarray, List[int]
     """Load labeled embeddings from DB and L2-normalize.
 
     Returns:
-      X: float32 [N, D] normalized
+      X: float32 [N, D] normalized (CSR if the embeddings are stored sparse)
       y: str [N]
       doc_ids: list[int] length N
     """
     X, y, doc_ids = load_embeddings(db_dsn)
-    X = np.asarray(X, dtype=np.float32)
+    X = X.astype(np.float32)
     X = normalize(X, norm="l2")
     y = np.asarray(y)
     return X, y, doc_ids
 
 
 @lru_cache(maxsize=8)
-def _get_retriever(db_dsn: str) -> DocumentRetriever:
+def _get_retriever(db_dsn: str, pooling: str | None = None) -> DocumentRetriever:
     """Cache the embedding model inside DocumentRetriever."""
-    return DocumentRetriever(db_dsn=db_dsn)
+    return DocumentRetriever(db_dsn=db_dsn, doc_pooling=pooling)
 
 
 @lru_cache(maxsize=32)
@@ -67,10 +67,13 @@ def predict_label_from_text(
     db_dsn: str | None = None,
     k: int = 9,
     metric: str = "cosine",
+    pooling: str | None = None,
 ) -> str:
     """Predict a single decision label for an input text.
 
-    This is the function you should call from the API.
+    This is the function you should call from the API. Pass the same pooling
+    the training embeddings were indexed with (index_embeddings_for_ids
+    --pooling), so the query vector also covers the full text.
 
     Returns:
       predicted_label (str)
@@ -80,7 +83,7 @@ def predict_label_from_text(
     if not text or not text.strip():
         raise ValueError("Empty text")
 
-    retriever = _get_retriever(db_dsn)
+    retriever = _get_retriever(db_dsn, pooling)
     q = retriever.generate_embedding(text, use_chunking=True).astype(np.float32)
     q = normalize(q.reshape(1, -1), norm="l2")
 
@@ -96,6 +99,7 @@ def predict_label_from_file(
     k: int = 9,
     metric: str = "cosine",
     encoding: str = "utf-8",
+    pooling: str | None = None,
 ) -> str:
     """Convenience wrapper for local testing."""
     with open(path, "r", encoding=encoding, errors="ignore") as f:
@@ -105,6 +109,7 @@ def predict_label_from_file(
         db_dsn=db_dsn,
         k=k,
         metric=metric,
+        pooling=pooling,
     )
 
 
@@ -114,6 +119,8 @@ def main() -> None:
     p.add_argument("--file", required=True, help="Path to txt file")
     p.add_argument("--k", type=int, default=7)
     p.add_argument("--metric", default="cosine")
+    p.add_argument("--pooling", choices=["mean", "max", "weighted"],
+                   help="Pooling the training embeddings were indexed with")
     args = p.parse_args()
 
     label = predict_label_from_file(
@@ -121,6 +128,7 @@ def main() -> None:
         db_dsn=args.db_dsn,
         k=args.k,
         metric=args.metric,
+        pooling=args.pooling,
     )
     print(label)
 
@@ -0,0 +1,155 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from knn.embedding_snapshot import COPY_SIGNATURE, _array_values, _copy_rows, load_embedding_snapshot
+
+FLOAT4_OID = 700
+INT4_OID = 23
+
+
+def field(data):
+    return struct.pack(">i", -1) if data is None else struct.pack(">i", len(data)) + data
+
+
+def array(values, element: str, oid: int) -> bytes:
+    if not values:
+        return struct.pack(">iii", 0, 0, oid)
+    header = struct.pack(">iiiii", 1, 0, oid, len(values), 1)
+    return header + b"".join(struct.pack(">i", 4) + struct.pack(element, v) for v in values)
+
+
+def copy_stream(rows, extension: bytes = b"") -> bytes:
+    """A COPY ... (FORMAT BINARY) stream of rows of raw field bytes."""
+    out = COPY_SIGNATURE + struct.pack(">ii", 0, len(extension)) + extension
+    for row in rows:
+        out += struct.pack(">h", len(row)) + b"".join(field(f) for f in row)
+    return out + struct.pack(">h", -1)
+
+
+def blocks(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+ROWS = [
+    [struct.pack(">q", 7), "Procedente".encode("utf-8"), array([0.5, -1.25, 2.0], ">f", FLOAT4_OID), None, None],
+    [struct.pack(">q", 9), "Não provido".encode("utf-8"), None, array([1, 4], ">i", INT4_OID), array([0.25, 3.0], ">f", FLOAT4_OID)],
+    [struct.pack(">q", 12), b"", array([], ">f", FLOAT4_OID), None, None],
+]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 18, 19, 20, 64, 10 ** 6])
+def test_rows_survive_any_block_boundaries(size):
+    assert list(_copy_rows(blocks(copy_stream(ROWS), size))) == ROWS
+
+
+def test_header_extension_is_skipped():
+    assert list(_copy_rows([copy_stream(ROWS, extension=b"\x00\x01\x02\x03")])) == ROWS
+
+
+def test_rest_of_the_stream_is_read_after_the_trailer():
+    stream = iter(blocks(copy_stream(ROWS), 11) + [b"after"])
+    assert len(list(_copy_rows(stream))) == len(ROWS)
+    assert next(stream, None) is None
+
+
+def test_other_streams_are_rejected():
+    with pytest.raises(ValueError):
+        list(_copy_rows([b"COPY 1\n" + b"\x00" * 32]))
+
+
+def test_array_values():
+    assert _array_values(ROWS[0][2], ">f4").tolist() == [0.5, -1.25, 2.0]
+    assert _array_values(ROWS[1][3], ">i4").tolist() == [1, 4]
+    assert _array_values(ROWS[2][2], ">f4").size == 0
+    two_dimensional = struct.pack(">iiiiiii", 2, 0, FLOAT4_OID, 1, 1, 1, 1)
+    with pytest.raises(ValueError):
+        _array_values(two_dimensional, ">f4")
+
+
+@pytest.fixture
+def conn():
+    """Connection to DGSISCRAPER_TEST_DSN with an empty dgsi_document_embeddings."""
+    dsn = os.getenv("DGSISCRAPER_TEST_DSN")
+    if not dsn:
+        pytest.skip("DGSISCRAPER_TEST_DSN is not set")
+    psycopg = pytest.importorskip("psycopg")
+    from knn.index_embeddings_for_ids import ensure_embeddings_table
+
+    with psycopg.connect(dsn) as conn:
+        conn.execute("DROP TABLE IF EXISTS public.dgsi_document_embeddings;")
+        conn.commit()
+        ensure_embeddings_table(conn)
+        yield conn
+
+
+def insert(conn, doc_id, label, embedding=None, indices=None, values=None, dim=4):
+    conn.execute("""
+        INSERT INTO public.dgsi_document_embeddings (doc_id, label, embedding, embedding_dim, model_name, emb_indices, emb_values)
+        VALUES (%s, %s, %s, %s, 'test', %s, %s);
+    """, (doc_id, label, embedding, dim, indices, values))
+    conn.commit()
+
+
+def test_dense_snapshot_round_trip(conn, tmp_path):
+    insert(conn, 3, "b", [0.0, 1.0, 2.0, 3.0])
+    insert(conn, 1, "a", [0.5, 0.25, 0.0, -1.0])
+    # a sparse row in a dense snapshot
+    insert(conn, 2, "a", indices=[1, 3], values=[2.0, 4.0])
+    X, labels, ids = load_embedding_snapshot(conn, str(tmp_path / "snapshot"))
+    assert ids.tolist() == [1, 2, 3]
+    assert labels.tolist() == ["a", "a", "b"]
+    assert np.array_equal(X, np.array([[0.5, 0.25, 0.0, -1.0], [0.0, 2.0, 0.0, 4.0], [0.0, 1.0, 2.0, 3.0]], dtype=np.float32))
+
+
+def test_sparse_snapshot_is_csr(conn, tmp_path):
+    insert(conn, 1, "a", indices=[0, 2], values=[1.0, 2.0])
+    insert(conn, 2, "b", indices=[3], values=[5.0])
+    X, _, ids = load_embedding_snapshot(conn, str(tmp_path / "snapshot"))
+    assert ids.tolist() == [1, 2]
+    assert np.array_equal(X.toarray(), np.array([[1.0, 0.0, 2.0, 0.0], [0.0, 0.0, 0.0, 5.0]], dtype=np.float32))
+
+
+def test_snapshot_is_reused_until_the_table_changes(conn, tmp_path):
+    out = str(tmp_path / "snapshot")
+    insert(conn, 1, "a", [1.0, 0.0, 0.0, 0.0])
+    load_embedding_snapshot(conn, out)
+    written = os.path.getmtime(os.path.join(out, "meta.json"))
+    load_embedding_snapshot(conn, out)
+    assert os.path.getmtime(os.path.join(out, "meta.json")) == written
+
+    insert(conn, 2, "b", [0.0, 1.0, 0.0, 0.0])
+    X, _, ids = load_embedding_snapshot(conn, out)
+    assert ids.tolist() == [1, 2] and X.shape == (2, 4)
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_rows_written_during_the_export_wait_for_the_next_one(conn, tmp_path, monkeypatch, sparse):
+    import psycopg
+
+    from knn import embedding_snapshot
+
+    row = {"indices": [0], "values": [1.0]} if sparse else {"embedding": [1.0, 0.0, 0.0, 0.0]}
+    insert(conn, 1, "a", **row)
+    fingerprint = embedding_snapshot._fingerprint
+    calls = []
+
+    def insert_after_fingerprint(cur):
+        taken = fingerprint(cur)
+        calls.append(taken)
+        # the second fingerprint is the export's own
+        if len(calls) == 2:
+            with psycopg.connect(conn.info.dsn) as other:
+                insert(other, 2, "b", **row)
+        return taken
+    monkeypatch.setattr(embedding_snapshot, "_fingerprint", insert_after_fingerprint)
+
+    out = str(tmp_path / "snapshot")
+    X, _, ids = load_embedding_snapshot(conn, out)
+    assert ids.tolist() == [1] and X.shape == (1, 4)
+
+    monkeypatch.setattr(embedding_snapshot, "_fingerprint", fingerprint)
+    X, _, ids = load_embedding_snapshot(conn, out)
+    assert ids.tolist() == [1, 2] and X.shape == (2, 4)
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from pathlib import Path
 from fastapi import FastAPI, HTTPException, File, UploadFile
 from uuid import uuid4
@@ -5,10 +6,15 @@ from pydantic import BaseModel
 from typing import List, Dict, Any
 import subprocess
 import tempfile
-from agent import agent
+from agent import agent, tools
 from tfidf_svm import tfidf_svm_predict_from_file
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await tools.retriever.close()
+
+app = FastAPI(lifespan=lifespan)
 SESSIONS = {}
 
 class IdentifyReq(BaseModel):